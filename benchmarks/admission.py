@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""Measures the time from enqueueing a batch of tasks until all of them are
+running.
+
+Usage: python benchmarks/admission.py [num_tasks [min_start_interval ...]]
+"""
+
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from taskpile.core import ExternalTask, Taskpile  # noqa
+
+
+def time_until_all_running(num_tasks, min_start_interval):
+    taskpile = Taskpile(
+        max_parallel=num_tasks, min_start_interval=min_start_interval)
+    start = time.time()
+    for i in range(num_tasks):
+        taskpile.enqueue(ExternalTask('sleep 60'))
+    while len(taskpile.running) < num_tasks:
+        taskpile.update()
+        delay = taskpile.seconds_until_next_start()
+        if delay is not None:
+            time.sleep(delay)
+    duration = time.time() - start
+
+    for task in taskpile.running:
+        task.terminate()
+    for task in taskpile.running:
+        task.join()
+        os.unlink(task.outbuf_name)
+        os.unlink(task.errbuf_name)
+    return duration
+
+
+def main(argv):
+    num_tasks = int(argv[1]) if len(argv) > 1 else 64
+    intervals = [float(x) for x in argv[2:]] or [0., 0.01, 0.05]
+    for min_start_interval in intervals:
+        print('{0} tasks, min_start_interval={1}s: {2:.3f}s'.format(
+            num_tasks, min_start_interval,
+            time_until_all_running(num_tasks, min_start_interval)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
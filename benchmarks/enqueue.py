@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Measures the memory used per queued task and the rate at which tasks can
+be enqueued.
+
+Each measurement runs in a fresh process, so the memory is the growth of the
+resident set size caused by creating and enqueueing the tasks.
+
+Usage: python benchmarks/enqueue.py [num_tasks ...]
+"""
+
+from __future__ import print_function
+
+from multiprocessing import Pipe, Process
+import os
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from taskpile.core import ExternalTask, Taskpile  # noqa
+
+
+def resident_bytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def enqueue(num_tasks, connection):
+    taskpile = Taskpile(max_parallel=0)
+    rss = resident_bytes()
+    start = time.time()
+    for i in range(num_tasks):
+        taskpile.enqueue(ExternalTask('sleep {0}'.format(i)))
+    duration = time.time() - start
+    connection.send((duration, resident_bytes() - rss))
+    connection.close()
+
+
+def measure(num_tasks):
+    """Returns the time in seconds and the memory in bytes it takes to
+    enqueue `num_tasks` tasks."""
+    parent, child = Pipe()
+    process = Process(target=enqueue, args=(num_tasks, child))
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+def main(argv):
+    sizes = [int(x) for x in argv[1:]] or [1000, 10000, 100000]
+    for num_tasks in sizes:
+        duration, memory = measure(num_tasks)
+        print('{0:>7} tasks: {1:>8.0f} tasks/s, {2:>5.0f} bytes per '
+              'task'.format(
+                  num_tasks, num_tasks / duration, memory / num_tasks))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
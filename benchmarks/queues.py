@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Measures the cost of a Taskpile update depending on the number of queued
+tasks.
+
+The tasks do not start any processes, so only the bookkeeping is measured.
+
+Usage: python benchmarks/queues.py [num_tasks ...]
+"""
+
+from __future__ import print_function
+
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from taskpile.core import State, Taskpile  # noqa
+
+
+class DummyTask(object):
+    def __init__(self):
+        self.state = State.PENDING
+        self.pid = None
+        self.cpus = 1
+        self.memory = None
+
+    def start(self):
+        self.state = State.RUNNING
+        self.pid = 0
+
+    def stop(self):
+        self.state = State.STOPPED
+
+    def cont(self):
+        self.state = State.RUNNING
+
+    def poll(self):
+        return False
+
+    def join(self):
+        pass
+
+    def terminate(self):
+        self.state = State.FINISHED
+
+
+def time_per_update(num_tasks, max_parallel=8, repeat=1000):
+    taskpile = Taskpile(max_parallel=max_parallel)
+    for i in range(num_tasks):
+        taskpile.enqueue(DummyTask())
+    taskpile.update()
+
+    def finish_one_and_update():
+        taskpile.running.peek().state = State.FINISHED
+        taskpile.update()
+
+    return timeit.timeit(finish_one_and_update, number=repeat) / repeat
+
+
+def main(argv):
+    sizes = [int(x) for x in argv[1:]] or [1000, 10000, 100000]
+    for num_tasks in sizes:
+        print('{0:>7} tasks: {1:.2f} us per update'.format(
+            num_tasks, 1e6 * time_per_update(num_tasks)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
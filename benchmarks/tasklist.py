@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Measures the cost of updating and redrawing the task list of the UI
+depending on the number of queued tasks.
+
+Usage: python benchmarks/tasklist.py [num_tasks ...]
+"""
+
+from __future__ import print_function
+
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from queues import DummyTask  # noqa
+from taskpile.core import State, Taskpile  # noqa
+from taskpile.scheduling import PriorityPolicy  # noqa
+from taskpile.ui.urwid import TaskList  # noqa
+
+
+class NamedDummyTask(DummyTask):
+    def __init__(self, i):
+        super(NamedDummyTask, self).__init__()
+        self.name = 'task {0}'.format(i)
+        self.priority = i % 3
+        self.expected_runtime = None
+        self.exitcode = None
+        self.exitsignal = None
+        self.rusage = None
+        self.usage = None
+
+
+def time_per_redraw(num_tasks, max_parallel=8, size=(120, 50), repeat=100):
+    taskpile = Taskpile(max_parallel=max_parallel, policy=PriorityPolicy())
+    for i in range(num_tasks):
+        taskpile.enqueue(NamedDummyTask(i))
+    tasklist = TaskList(taskpile)
+    tasklist.update()
+
+    def finish_one_and_redraw():
+        task = taskpile.running.peek()
+        task.state = State.FINISHED
+        task.exitcode = task.exitsignal = 0
+        tasklist.update()
+        tasklist.render(size, focus=True)
+
+    return timeit.timeit(finish_one_and_redraw, number=repeat) / repeat
+
+
+def main(argv):
+    sizes = [int(x) for x in argv[1:]] or [1000, 10000, 100000]
+    for num_tasks in sizes:
+        print('{0:>7} tasks: {1:.2f} ms per update and redraw'.format(
+            num_tasks, 1e3 * time_per_redraw(num_tasks)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -12,4 +12,4 @@ setup(
     author_email='jan@hyper-world.de',
     # url= ... TODO
     packages=find_packages(),
-    scripts=['bin/taskpile'])
+    scripts=['bin/taskpile', 'bin/taskpiled', 'bin/taskpilectl'])
@@ -0,0 +1,158 @@
+from __future__ import absolute_import
+
+import os
+
+from taskpile.core import _clock, TaskpileListener
+
+
+_clock_ticks = os.sysconf('SC_CLK_TCK')
+_page_size = os.sysconf('SC_PAGE_SIZE')
+
+
+class ResourceUsage(object):
+    """Resources used by a task.
+
+    `cpu_time` is in seconds, all other amounts are in bytes. `cpu_percent`
+    is the CPU usage since the previous sample (``None`` for the first one).
+    `rss` is the current resident memory of a running task and the maximum
+    resident memory of a finished one.
+    """
+
+    def __init__(
+            self, cpu_time=0., rss=0, read_bytes=0, write_bytes=0,
+            cpu_percent=None, time=None):
+        self.cpu_time = cpu_time
+        self.rss = rss
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+        self.cpu_percent = cpu_percent
+        self.time = time
+
+    @classmethod
+    def from_rusage(cls, rusage):
+        """Converts the result of ``os.wait4`` (Linux units)."""
+        return cls(
+            cpu_time=rusage.ru_utime + rusage.ru_stime,
+            rss=rusage.ru_maxrss * 1024,
+            read_bytes=rusage.ru_inblock * 512,
+            write_bytes=rusage.ru_oublock * 512)
+
+
+def get_usage(task):
+    """Returns the latest usage of `task`: the final one from its rusage if
+    it has been reaped or the last sample otherwise."""
+    if task.rusage is not None:
+        return ResourceUsage.from_rusage(task.rusage)
+    return task.usage
+
+
+def _children(pid):
+    children = []
+    try:
+        tids = os.listdir('/proc/{0}/task'.format(pid))
+    except OSError:
+        return children
+    for tid in tids:
+        try:
+            with open('/proc/{0}/task/{1}/children'.format(pid, tid)) as f:
+                children.extend(int(c) for c in f.read().split())
+        except IOError:
+            pass
+    return children
+
+
+def iter_process_tree(pid):
+    """Yields `pid` and the pids of all its living descendants."""
+    pids = [pid]
+    while len(pids) > 0:
+        pid = pids.pop()
+        yield pid
+        pids.extend(_children(pid))
+
+
+def read_process_state(pid):
+    """Returns the state letter of process `pid` (e.g. ``'R'`` for running
+    or ``'T'`` for stopped) or ``None`` if it does not exist."""
+    try:
+        with open('/proc/{0}/stat'.format(pid)) as f:
+            stat = f.read()
+    except IOError:
+        return None
+    return stat[stat.rindex(')') + 2]
+
+
+def read_process_usage(pid):
+    """Returns the CPU time (including that of reaped children), the resident
+    memory and the bytes read and written of process `pid` or ``None`` if
+    the process does not exist anymore."""
+    try:
+        with open('/proc/{0}/stat'.format(pid)) as f:
+            stat = f.read()
+    except IOError:
+        return None
+    fields = stat[stat.rindex(')') + 2:].split()
+    cpu_time = sum(int(t) for t in fields[11:15]) / float(_clock_ticks)
+    rss = int(fields[21]) * _page_size
+    read_bytes = write_bytes = 0
+    try:
+        with open('/proc/{0}/io'.format(pid)) as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                if key == 'read_bytes':
+                    read_bytes = int(value)
+                elif key == 'write_bytes':
+                    write_bytes = int(value)
+    except IOError:
+        pass
+    return cpu_time, rss, read_bytes, write_bytes
+
+
+def sample_process_tree(pid, previous=None):
+    """Returns the :class:`ResourceUsage` of process `pid` and all its
+    descendants. With the `previous` sample the CPU usage is computed."""
+    usage = ResourceUsage(time=_clock())
+    for p in iter_process_tree(pid):
+        values = read_process_usage(p)
+        if values is None:
+            continue
+        usage.cpu_time += values[0]
+        usage.rss += values[1]
+        usage.read_bytes += values[2]
+        usage.write_bytes += values[3]
+    if previous is not None and usage.time > previous.time:
+        usage.cpu_percent = max(0., 100. * (
+            usage.cpu_time - previous.cpu_time) / (usage.time - previous.time))
+    return usage
+
+
+class ResourceSampler(TaskpileListener):
+    """Samples the resource usage of the running tasks of `taskpile` from
+    ``/proc`` every `interval` seconds and stores it in their ``usage``
+    attribute.
+    """
+
+    def __init__(self, taskpile, interval=5.):
+        self.taskpile = taskpile
+        self.interval = interval
+        self._last_sample = None
+        taskpile.listeners.append(self)
+
+    def on_updated(self):
+        now = _clock()
+        if self._last_sample is not None and \
+                now - self._last_sample < self.interval:
+            return
+        self._last_sample = now
+        for task in self.taskpile.running:
+            if task.pid is not None:
+                task.usage = sample_process_tree(task.pid, task.usage)
+
+    def seconds_until_update(self):
+        if len(self.taskpile.running) <= 0:
+            return None
+        if self._last_sample is None:
+            return 0.
+        return max(0., self._last_sample + self.interval - _clock())
+
+    def close(self):
+        self.taskpile.listeners.remove(self)
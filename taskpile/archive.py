@@ -0,0 +1,135 @@
+"""Compact storage of finished tasks.
+
+A taskpile running for a long time accumulates many finished tasks. With a
+:class:`TaskArchive` set (see :meth:`taskpile.core.Taskpile.set_archive`),
+finished tasks are written to disk and replaced by a :class:`TaskSummary`
+holding only what is needed to list them. The full task is loaded again with
+:func:`load_details` when needed, e.g. to copy it.
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+from tempfile import TemporaryFile
+
+from taskpile.accounting import get_usage, ResourceUsage
+from taskpile.core import ExternalTask, State
+from taskpile.journal import AdoptedTask
+
+
+class TaskSummary(object):
+    """Finished task stored in a :class:`TaskArchive`.
+
+    Provides the attributes of a finished task needed to list it and to
+    show its output. `usage` is the final resource usage of the task,
+    `started_at` and `finished_at` are its start and end times.
+    """
+
+    __slots__ = (
+        'name', 'command', 'pid', 'priority', 'exitcode', 'exitsignal',
+        'started_at', 'finished_at', 'outbuf_name', 'errbuf_name', '_usage',
+        '_archive', '_offset')
+
+    state = State.FINISHED
+    rusage = None
+    needs_polling = False
+
+    def __init__(self, task, archive, offset):
+        self.name = task.name
+        self.command = getattr(task, 'command', None)
+        self.pid = task.pid
+        self.priority = task.priority
+        self.exitcode = task.exitcode
+        self.exitsignal = task.exitsignal
+        self.started_at = task.started_at
+        self.finished_at = task.finished_at
+        self.outbuf_name = getattr(task, 'outbuf_name', None)
+        self.errbuf_name = getattr(task, 'errbuf_name', None)
+        usage = get_usage(task)
+        if usage is None:
+            self._usage = None
+        else:
+            self._usage = (
+                usage.cpu_time, usage.rss, usage.read_bytes,
+                usage.write_bytes)
+        self._archive = archive
+        self._offset = offset
+
+    @property
+    def usage(self):
+        if self._usage is None:
+            return None
+        return ResourceUsage(*self._usage)
+
+    @property
+    def runtime(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def terminate(self):
+        pass  # Finished already.
+
+    def load(self):
+        """Returns the full task loaded from the archive."""
+        return self._archive.load(self)
+
+
+def load_details(task):
+    """Returns `task` or, if it is a :class:`TaskSummary`, the full task
+    loaded from its archive."""
+    if isinstance(task, TaskSummary):
+        return task.load()
+    return task
+
+
+class TaskArchive(object):
+    """Store of finished tasks in file `filename`.
+
+    One JSON object is written per task. Without `filename` an anonymous
+    temporary file is used, which vanishes when the archive is closed. Only
+    :class:`ExternalTask` instances are archived.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        if filename is None:
+            self._file = TemporaryFile('w+')
+        else:
+            self._file = open(filename, 'w+')
+
+    def store(self, task):
+        """Writes finished `task` to the archive and returns its
+        :class:`TaskSummary` (or `task` itself if it cannot be archived).
+        """
+        if not isinstance(task, ExternalTask):
+            return task
+        record = dict(
+            command=task.command, name=task.name,
+            original_files=task.original_files, niceness=task.niceness,
+            priority=task.priority, expected_runtime=task.expected_runtime,
+            cwd=task.cwd, template_spec=task.template_spec, cpus=task.cpus,
+            memory=task.memory, unrendered_command=task.unrendered_command,
+            pid=task.pid, exitcode=task.exitcode,
+            exitsignal=task.exitsignal, started_at=task.started_at,
+            finished_at=task.finished_at,
+            outbuf_name=getattr(task, 'outbuf_name', None),
+            errbuf_name=getattr(task, 'errbuf_name', None))
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        self._file.write(json.dumps(record) + '\n')
+        return TaskSummary(task, self, offset)
+
+    def load(self, summary):
+        """Returns the task of `summary` as finished
+        :class:`taskpile.journal.AdoptedTask`."""
+        self._file.flush()
+        self._file.seek(summary._offset)
+        record = json.loads(self._file.readline())
+        task = AdoptedTask(state=State.FINISHED, **record)
+        task.usage = summary.usage
+        return task
+
+    def close(self):
+        self._file.close()
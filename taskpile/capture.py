@@ -0,0 +1,451 @@
+"""Capturing of task output with bounded disk usage.
+
+Tasks write their output directly to files (see :class:`ExternalTask`).
+:class:`OutputCapture` moves the content of large files into numbered
+segment files ``<output file>.<offset>[.gz|.zst]``, `offset` being the
+position of the segment in the whole output, and truncates the output file.
+Missing offsets mark dropped parts of the output. Use :func:`open_output` to
+read the output regardless of how it is stored.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import gzip
+import os
+import os.path
+import shutil
+import threading
+from tempfile import mkstemp, TemporaryFile
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from taskpile.core import _clock, TaskpileListener
+
+
+GZIP = 'gz'
+ZSTD = 'zst'
+
+_CHUNK_SIZE = 1024 * 1024
+
+# Renaming segments into place and reading all segments of an output is
+# done under this lock as outputs of finished tasks are compressed in a
+# background thread.
+_lock = threading.Lock()
+
+
+def default_compression():
+    """Returns :data:`ZSTD` if the zstandard module is available and
+    :data:`GZIP` otherwise."""
+    return GZIP if zstandard is None else ZSTD
+
+
+def _segments(filename):
+    """Returns the segments of output file `filename` as list of
+    ``(offset, path)`` tuples ordered by offset."""
+    directory, basename = os.path.split(filename)
+    prefix = basename + '.'
+    segments = []
+    try:
+        entries = os.listdir(directory or '.')
+    except OSError:
+        return segments
+    for entry in entries:
+        if not entry.startswith(prefix):
+            continue
+        offset, _, ext = entry[len(prefix):].partition('.')
+        if offset.isdigit() and ext in ('', GZIP, ZSTD):
+            segments.append((int(offset), os.path.join(directory, entry)))
+    segments.sort()
+    return segments
+
+
+def _open_writer(f, compression):
+    if compression == GZIP:
+        return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=1)
+    elif compression == ZSTD:
+        return zstandard.ZstdCompressor().stream_writer(f)
+    return f
+
+
+def _write_segment(filename, src, size, compression):
+    """Writes `size` bytes from `src` to a temporary segment file of
+    `filename` and returns its path."""
+    directory, basename = os.path.split(filename)
+    fd, tmp_path = mkstemp(dir=directory or '.', prefix=basename + '.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        writer = _open_writer(f, compression)
+        while size > 0:
+            chunk = src.read(min(size, _CHUNK_SIZE))
+            if not chunk:
+                break
+            writer.write(chunk)
+            size -= len(chunk)
+        writer.close()
+    return tmp_path
+
+
+def _segment_path(filename, offset, compression):
+    path = '{0}.{1}'.format(filename, offset)
+    if compression is not None:
+        path += '.' + compression
+    return path
+
+
+def _copy_segment(path, dst):
+    """Writes the decompressed content of segment `path` to `dst` and returns
+    the number of bytes written."""
+    if path.endswith('.' + ZSTD):
+        if zstandard is None:
+            raise IOError(
+                'Reading {0} requires the zstandard module.'.format(path))
+        with open(path, 'rb') as f:
+            _, written = zstandard.ZstdDecompressor().copy_stream(f, dst)
+        return written
+    start = dst.tell()
+    if path.endswith('.' + GZIP):
+        src = gzip.open(path, 'rb')
+    else:
+        src = open(path, 'rb')
+    with src:
+        shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+    return dst.tell() - start
+
+
+class _NullWriter(object):
+    def __init__(self):
+        self._written = 0
+
+    def write(self, data):
+        self._written += len(data)
+
+    def tell(self):
+        return self._written
+
+
+def _join_segments(segments):
+    """Writes the segments to an anonymous temporary file, marking dropped
+    parts, and returns the file and the offset of the end of the last
+    segment in the output."""
+    out = TemporaryFile('w+b')
+    end = 0
+    for offset, path in segments:
+        if offset > end:
+            out.write('[taskpile: {0} bytes of output dropped]\n'.format(
+                offset - end).encode())
+        end = offset + _copy_segment(path, out)
+    return out, end
+
+
+def _open_if_exists(filename, mode='r'):
+    try:
+        return open(filename, mode)
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    return None
+
+
+def open_output(filename):
+    """Opens output file `filename` of a task for reading.
+
+    If parts of the output are stored in segments, these are combined with
+    the output file in an anonymous temporary file. Dropped parts of the
+    output are replaced by a line stating the number of bytes dropped.
+    """
+    with _lock:
+        segments = _segments(filename)
+        if len(segments) <= 0:
+            return open(filename)
+        out, _ = _join_segments(segments)
+        f = _open_if_exists(filename, 'rb')
+        if f is not None:
+            with f:
+                shutil.copyfileobj(f, out, _CHUNK_SIZE)
+    out.seek(0)
+    return out
+
+
+class OutputFollower(object):
+    """Follows output file `filename` of a running task.
+
+    `file` is a readable file with the output read so far (see
+    :func:`open_output`). Call :meth:`update` to add the output written
+    since. If no parts of the output are stored in segments, `file` is the
+    output file itself. Otherwise, only the newly written bytes are copied
+    to `file`.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._open()
+
+    def _open(self):
+        with _lock:
+            segments = _segments(self.filename)
+            self._output = _open_if_exists(self.filename, 'rb')
+            if len(segments) <= 0 and self._output is not None:
+                self.file = self._output
+                self._output_offset = 0
+                self._copy = False
+            else:
+                self.file, self._output_offset = _join_segments(segments)
+                self._copy = True
+            self._read = 0
+            self._update_file()
+
+    def _update_file(self):
+        if self._output is None:
+            return
+        size = os.fstat(self._output.fileno()).st_size
+        if self._copy and size > self._read:
+            self._output.seek(self._read)
+            self.file.seek(0, os.SEEK_END)
+            shutil.copyfileobj(self._output, self.file, _CHUNK_SIZE)
+            self.file.flush()
+            size = self._output.tell()
+        self._read = size
+
+    def _rotated(self):
+        return any(
+            os.path.exists(_segment_path(
+                self.filename, self._output_offset, compression))
+            for compression in (None, GZIP, ZSTD))
+
+    def update(self):
+        """Adds the output written since the last update to `file`.
+
+        Returns ``False`` if the output has been rotated meanwhile. In that
+        case `file` has been replaced by a new file.
+        """
+        if self._output is None:
+            return True
+        stat = os.fstat(self._output.fileno())
+        # Output files are removed, not truncated, when their task finished
+        # and they got compressed. The open file still has all the output.
+        if stat.st_size < self._read or (
+                stat.st_nlink > 0 and self._rotated()):
+            self.close()
+            self._open()
+            return False
+        self._update_file()
+        return True
+
+    def close(self):
+        if self._output is not None and self._output is not self.file:
+            self._output.close()
+        self.file.close()
+
+
+def output_signature(filename):
+    """Returns the segments of output `filename` and the inode number, size
+    and modification time of the output file (``None`` if it does not
+    exist).
+
+    The signature changes whenever the output changes. As segments do not
+    change once written, their names suffice.
+    """
+    try:
+        stat = os.stat(filename)
+        output = (stat.st_ino, stat.st_size, stat.st_mtime)
+    except OSError:
+        output = None
+    return tuple(path for _, path in _segments(filename)), output
+
+
+def remove_output(filename):
+    """Removes output file `filename` and all its segments."""
+    with _lock:
+        for _, path in _segments(filename):
+            os.unlink(path)
+        try:
+            os.unlink(filename)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+
+class OutputCapture(TaskpileListener):
+    """Limits the disk space used by the output files of the tasks of
+    `taskpile`.
+
+    Every `interval` seconds, output files of running tasks exceeding
+    `segment_bytes` are moved to a segment and truncated. If `max_bytes` is
+    given, only the first segment (the head of the output) and the latest
+    segments (the tail) are kept, so that roughly `max_bytes` of output are
+    stored per stream. `segment_bytes` defaults to a quarter of `max_bytes`.
+
+    Segments are compressed with `compression` (:data:`GZIP`, :data:`ZSTD`
+    or ``None``) in a background thread. Until then, they are stored
+    uncompressed. With `compress_finished`, the output files of finished
+    tasks (if larger than `min_compress_bytes`) are compressed as well.
+    This is the default only if `max_bytes` is given, as compressed output
+    has to be decompressed as a whole to read it (see :func:`open_output`),
+    which takes time proportional to its size.
+
+    The tasks keep writing directly to their files, which requires the files
+    to be opened in append mode. Like with the copytruncate option of
+    logrotate, output written while a file is moved to a segment is lost.
+    """
+
+    def __init__(
+            self, taskpile, max_bytes=None, segment_bytes=None,
+            compression=default_compression(), interval=1.,
+            min_compress_bytes=4096, compress_finished=None):
+        if segment_bytes is None and max_bytes is not None:
+            segment_bytes = max(1, max_bytes // 4)
+        if compress_finished is None:
+            compress_finished = max_bytes is not None
+        self.taskpile = taskpile
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.compression = compression
+        self.interval = interval
+        self.min_compress_bytes = min_compress_bytes
+        self.compress_finished = compress_finished
+        self._last_check = None
+        self._offsets = {}
+        self._jobs = queue.Queue()
+        self._worker = None
+        taskpile.listeners.append(self)
+
+    @staticmethod
+    def _output_files(task):
+        for attr in ('outbuf_name', 'errbuf_name'):
+            filename = getattr(task, attr, None)
+            if filename is not None:
+                yield filename
+
+    def on_updated(self):
+        if self.segment_bytes is None:
+            return
+        now = _clock()
+        if self._last_check is not None and \
+                now - self._last_check < self.interval:
+            return
+        self._last_check = now
+        for task in self.taskpile.running:
+            for filename in self._output_files(task):
+                self.rotate(filename)
+
+    def seconds_until_update(self):
+        if self.segment_bytes is None or len(self.taskpile.running) <= 0:
+            return None
+        if self._last_check is None:
+            return 0.
+        return max(0., self._last_check + self.interval - _clock())
+
+    def on_finished(self, task):
+        for filename in self._output_files(task):
+            offset = self._next_offset(filename)
+            self._offsets.pop(filename, None)
+            if self.compression is not None and self.compress_finished:
+                self._submit(self._compress, filename, offset)
+
+    def rotate(self, filename):
+        """Moves the content of output file `filename` to a segment if it
+        exceeds `segment_bytes` and drops segments exceeding `max_bytes`.
+
+        The content is copied uncompressed, so the output file can be
+        truncated right away. The segment is compressed later.
+        """
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            return
+        if size < self.segment_bytes:
+            return
+        offset = self._next_offset(filename)
+        path = _segment_path(filename, offset, None)
+        with open(filename, 'r+b') as f:
+            tmp_path = _write_segment(filename, f, size, None)
+            with _lock:
+                os.rename(tmp_path, path)
+            f.truncate(0)
+        self._offsets[filename] = offset + size
+        if self.compression is not None:
+            self._submit(self._compress_segment, filename, offset)
+
+        if self.max_bytes is not None:
+            with _lock:
+                tail = _segments(filename)[1:]  # Always keep the head.
+                num_kept = max(0, self.max_bytes // self.segment_bytes - 2)
+                for _, path in tail[:max(0, len(tail) - num_kept)]:
+                    os.unlink(path)
+
+    def _next_offset(self, filename):
+        """Returns the offset of the current content of output file
+        `filename` in the whole output."""
+        offset = self._offsets.get(filename)
+        if offset is None:
+            segments = _segments(filename)
+            if len(segments) <= 0:
+                offset = 0
+            else:
+                # Not recorded if the output was rotated by an earlier
+                # taskpile process.
+                offset, path = segments[-1]
+                offset += _copy_segment(path, _NullWriter())
+            self._offsets[filename] = offset
+        return offset
+
+    def _submit(self, function, *args):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._compress_outputs)
+            self._worker.daemon = True
+            self._worker.start()
+        self._jobs.put((function, args))
+
+    def _compress_outputs(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            function, args = job
+            try:
+                function(*args)
+            except (IOError, OSError):
+                pass  # Keep the uncompressed output.
+
+    def _compress_segment(self, filename, offset):
+        path = _segment_path(filename, offset, None)
+        with open(path, 'rb') as f:
+            tmp_path = _write_segment(
+                filename, f, os.fstat(f.fileno()).st_size, self.compression)
+        with _lock:
+            if os.path.exists(path):
+                os.rename(tmp_path, _segment_path(
+                    filename, offset, self.compression))
+                os.unlink(path)
+            else:
+                os.unlink(tmp_path)  # The segment was dropped meanwhile.
+
+    def _compress(self, filename, offset):
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            return
+        if size < self.min_compress_bytes:
+            return
+        with open(filename, 'rb') as f:
+            tmp_path = _write_segment(filename, f, size, self.compression)
+        with _lock:
+            os.rename(
+                tmp_path, _segment_path(filename, offset, self.compression))
+            os.unlink(filename)
+
+    def close(self):
+        """Waits for pending compressions and detaches from the taskpile."""
+        if self._worker is not None:
+            self._jobs.put(None)
+            self._worker.join()
+            self._worker = None
+        self.taskpile.listeners.remove(self)
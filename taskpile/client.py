@@ -0,0 +1,190 @@
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import os
+import os.path
+import socket
+import sys
+
+from taskpile.sanitize import parse_size
+
+
+# This module is imported by the command line client and should only import
+# what is needed to talk to the server to start fast.
+
+
+def default_socket_path():
+    return os.path.join(os.path.expanduser('~'), '.taskpile', 'socket')
+
+
+class RemoteError(Exception):
+    pass
+
+
+class Client(object):
+    """Client for a :class:`taskpile.server.TaskpileServer`."""
+
+    def __init__(self, path=None):
+        if path is None:
+            path = default_socket_path()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+        self._file = self._socket.makefile('rb')
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def request(self, cmd, **kwargs):
+        kwargs['cmd'] = cmd
+        self._socket.sendall(json.dumps(kwargs).encode() + b'\n')
+        line = self._file.readline()
+        if len(line) <= 0:
+            raise RemoteError('Connection closed by taskpile.')
+        response = json.loads(line.decode())
+        if 'error' in response:
+            raise RemoteError(response['error'])
+        return response
+
+    def submit(self, commands, **kwargs):
+        """Enqueues a task for each command and returns the task ids.
+
+        Keyword arguments are passed on to
+        :class:`taskpile.core.ExternalTask`. The tasks run in the current
+        working directory unless `cwd` is given.
+        """
+        kwargs.setdefault('cwd', os.getcwd())
+        tasks = []
+        for command in commands:
+            task = dict(kwargs)
+            task['command'] = command
+            tasks.append(task)
+        return self.request('submit', tasks=tasks)['ids']
+
+    def submit_spec(self, filename, **kwargs):
+        """Adds the tasks of a task spec file and returns their number.
+
+        The tasks are created by the taskpile when it is about to run them,
+        so they do not have ids yet.
+        """
+        kwargs.setdefault('cwd', os.getcwd())
+        return self.request(
+            'submit_spec', filename=os.path.abspath(filename),
+            **kwargs)['count']
+
+    def list(self):
+        return self.request('list')['tasks']
+
+    def kill(self, ids):
+        self.request('kill', ids=ids)
+
+    def set_max_parallel(self, value):
+        self.request('set_max_parallel', value=value)
+
+    def stop(self):
+        self.request('stop')
+
+
+def _print_tasks(tasks):
+    print('{0:>6} {1:<8} {2:>6} {3:>6}  {4}'.format(
+        'ID', 'STATE', 'PID', 'EXIT', 'TASK'))
+    for task in tasks:
+        exitcode = task['exitcode']
+        if task['exitsignal']:
+            exitcode = 'SIG{0}'.format(task['exitsignal'])
+        print('{0:>6} {1:<8} {2:>6} {3:>6}  {4}'.format(
+            task['id'], task['state'],
+            '' if task['pid'] is None else task['pid'],
+            '' if exitcode is None else exitcode, task['name']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Control a running taskpile.')
+    parser.add_argument(
+        '--socket', default=default_socket_path(),
+        help='Socket of the taskpile (default: %(default)s).')
+    subparsers = parser.add_subparsers(dest='command')
+
+    submit = subparsers.add_parser('submit', help='Enqueue a task.')
+    submit.add_argument(
+        'task_command', nargs='?',
+        help='Shell command to run. Omit to read one command per line from '
+        'stdin.')
+    submit.add_argument('--name', help='Name of the task.')
+    submit.add_argument('--niceness', type=int, default=0)
+    submit.add_argument('--priority', type=int, default=0)
+    submit.add_argument(
+        '--runtime', type=float, help='Expected runtime in seconds.')
+    submit.add_argument(
+        '--cpus', type=float, default=1,
+        help='Number of CPUs the task needs (default: %(default)s).')
+    submit.add_argument(
+        '--mem', help='Memory the task needs, e.g. 512M or 20G.')
+
+    submit_spec = subparsers.add_parser(
+        'submit-spec', help='Enqueue the tasks of a task spec file.')
+    submit_spec.add_argument('filename')
+    submit_spec.add_argument('--niceness', type=int, default=0)
+    submit_spec.add_argument('--priority', type=int, default=0)
+    submit_spec.add_argument('--repeats', type=int, default=1)
+    submit_spec.add_argument('--start-repeat', type=int, default=0)
+
+    subparsers.add_parser('list', help='List all tasks.')
+
+    kill = subparsers.add_parser('kill', help='Kill tasks.')
+    kill.add_argument('ids', type=int, nargs='+')
+
+    max_parallel = subparsers.add_parser(
+        'set-max-parallel', help='Set the maximum number of parallel tasks.')
+    max_parallel.add_argument('value', type=int)
+
+    subparsers.add_parser(
+        'stop', help='Kill all tasks and stop the taskpile daemon.')
+
+    args = parser.parse_args(argv)
+
+    try:
+        client = Client(args.socket)
+    except socket.error as err:
+        sys.exit('Cannot connect to taskpile at {0}: {1}'.format(
+            args.socket, err))
+    try:
+        if args.command == 'submit':
+            if args.task_command is None:
+                commands = [l.strip() for l in sys.stdin if l.strip() != '']
+            else:
+                commands = [args.task_command]
+            kwargs = {'niceness': args.niceness, 'priority': args.priority}
+            if args.name is not None:
+                kwargs['name'] = args.name
+            if args.runtime is not None:
+                kwargs['expected_runtime'] = args.runtime
+            kwargs['cpus'] = args.cpus
+            if args.mem is not None:
+                kwargs['memory'] = parse_size(args.mem)
+            for task_id in client.submit(commands, **kwargs):
+                print(task_id)
+        elif args.command == 'submit-spec':
+            count = client.submit_spec(
+                args.filename, niceness=args.niceness,
+                priority=args.priority, start_repeat=args.start_repeat,
+                num_repeats=args.repeats)
+            print('Added {0} tasks.'.format(count))
+        elif args.command == 'list':
+            _print_tasks(client.list())
+        elif args.command == 'kill':
+            client.kill(args.ids)
+        elif args.command == 'set-max-parallel':
+            client.set_max_parallel(args.value)
+        elif args.command == 'stop':
+            client.stop()
+    except RemoteError as err:
+        sys.exit('Error: {0}'.format(err))
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,30 @@
 from __future__ import absolute_import
 
-from multiprocessing import cpu_count, Process, Value
+from collections import OrderedDict
+import errno
+import fcntl
+import hashlib
+import itertools
+import multiprocessing
+from multiprocessing import cpu_count, Process
 import os
+import select
+import shutil
 import signal
 import sys
 import subprocess
 import string
-from tempfile import mkstemp, NamedTemporaryFile
+import time
+from tempfile import mkdtemp, mkstemp, NamedTemporaryFile
 
 
 try:
     from taskpile import _patch_multiprocessing
 except:
     import _patch_multiprocessing
-from taskpile.sanitize import quote_for_shell
+from taskpile.sanitize import parse_size, quote_for_shell, \
+    split_simple_command
+from taskpile.scheduling import FifoPolicy, TaskQueue
 from taskpile.taskspec import TaskGroupSpec
 
 
@@ -31,8 +42,55 @@ class State(object):
         return 0 <= state and state < 4
 
 
+def _make_group_leader(pid):
+    """Moves process `pid` (0 for the calling process) into a new process
+    group.
+
+    Called in both the parent and the child to not depend on which runs
+    first after the fork.
+    """
+    try:
+        os.setpgid(pid, 0)
+    except OSError as err:
+        # The child might have already exec'd or exited.
+        if err.errno not in (errno.EACCES, errno.ESRCH):
+            raise
+
+
 class Task(object):
-    def __init__(self, function, args=(), kwargs={}, name=None, niceness=0):
+    """Function run in a separate process.
+
+    `cpus` and `memory` (in bytes, ``None`` if unknown) are the resources the
+    task reserves while running (see :class:`Taskpile`). If the taskpile
+    uses a :class:`taskpile.placement.PlacementEngine`, `placement` holds
+    the CPUs last assigned to the task.
+
+    Once the task has been reaped, `rusage` holds the resource usage reported
+    by the kernel (see ``os.wait4``). `usage` can be set to the latest
+    :class:`taskpile.accounting.ResourceUsage` sample while it runs.
+    `started_at` and `finished_at` are the times (as returned by
+    ``time.time()``) the task was started and finished.
+
+    `needs_polling` tells whether the end of the task is only noticed by
+    polling it, i.e. whether it is not a child process signalling its exit
+    with ``SIGCHLD`` (see :class:`ChildWatcher`).
+
+    The state is tracked by the taskpile process alone: it changes when the
+    task is started, stopped, continued or terminated and when its process
+    is reaped. Tasks use ``__slots__`` to keep large queues small.
+    """
+
+    __slots__ = (
+        'function', 'args', 'kwargs', 'name', 'niceness', 'priority',
+        'expected_runtime', 'cpus', 'memory', 'placement', 'rusage', 'usage',
+        'started_at', 'finished_at', '_exitcode', '_exitsignal', '_pid',
+        '_reaped', '_state')
+
+    needs_polling = False
+
+    def __init__(
+            self, function, args=(), kwargs={}, name=None, niceness=0,
+            priority=0, expected_runtime=None, cpus=1, memory=None):
         self.function = function
         self.args = args
         self.kwargs = kwargs
@@ -41,62 +99,263 @@ class Task(object):
         else:
             self.name = name
         self.niceness = niceness
+        self.priority = priority
+        self.expected_runtime = expected_runtime
+        self.cpus = cpus
+        self.memory = memory
+        self.placement = None
+        self.rusage = None
+        self.usage = None
+        self.started_at = None
+        self.finished_at = None
         self._exitcode = None
         self._exitsignal = None
         self._pid = None
-        self._state = Value('H', State.PENDING)
+        self._reaped = False
+        self._state = State.PENDING
 
     exitcode = property(lambda self: self._exitcode)
     exitsignal = property(lambda self: self._exitsignal)
     pid = property(lambda self: self._pid)
-    state = property(lambda self: self._state.value)
+    state = property(lambda self: self._state)
+
+    @property
+    def runtime(self):
+        """Seconds from the start to the end of the task or ``None`` if it
+        has not been started or not finished yet."""
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
 
     def start(self):
+        self.started_at = time.time()
         process = Process(
-            target=self.__run,
-            args=(self._state, self.niceness, self.function) + self.args,
+            target=self.__run, args=(self.niceness, self.function) + self.args,
             kwargs=self.kwargs)
         process.start()
+        # The process is reaped by poll() or join(). Prevent multiprocessing
+        # from reaping it behind our back when starting further processes.
+        multiprocessing.current_process()._children.discard(process)
         self._pid = process.pid
+        _make_group_leader(self._pid)
+        self._state = State.RUNNING
 
     @staticmethod
-    def __run(state_var, niceness, function, *args, **kwargs):
-        state_var.value = State.RUNNING
+    def __run(niceness, function, *args, **kwargs):
+        _make_group_leader(0)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
         os.nice(niceness)
+        retval = function(*args, **kwargs)
         try:
-            retval = function(*args, **kwargs)
-            try:
-                exitcode = int(retval)
-            except:
-                exitcode = 0
-        finally:
-            state_var.value = State.FINISHED
+            exitcode = int(retval)
+        except:
+            exitcode = 0
         sys.exit(exitcode)
 
     def stop(self):
-        os.kill(self.pid, signal.SIGSTOP)
-        self._state.value = State.STOPPED
+        self._signal(signal.SIGSTOP)
+        self._state = State.STOPPED
 
     def cont(self):
-        os.kill(self.pid, signal.SIGCONT)
-        self._state.value = State.RUNNING
+        self._signal(signal.SIGCONT)
+        self._state = State.RUNNING
+
+    def _signal(self, signum):
+        """Sends `signum` to the process group of the task, i.e. also to
+        the processes started by the task's process."""
+        try:
+            os.killpg(self.pid, signum)
+        except OSError as err:
+            if err.errno != errno.ESRCH:
+                raise
+            # Not a process group leader, e.g. a task adopted from a
+            # journal written by an older taskpile.
+            os.kill(self.pid, signum)
+
+    def is_suspended(self):
+        """Returns whether the task's process and all its descendants are
+        stopped (or have exited).
+
+        Descendants might have left the task's process group and would not
+        be stopped by :meth:`stop`.
+        """
+        # Imported here as taskpile.accounting depends on this module.
+        from taskpile.accounting import iter_process_tree, \
+            read_process_state
+        if self.pid is None:
+            return True
+        return all(
+            read_process_state(pid) in (None, 'T', 't', 'Z', 'X')
+            for pid in iter_process_tree(self.pid))
 
     def join(self):
-        if self.pid is not None:
-            opid, exit_status_indication = os.waitpid(self.pid, 0)
+        self._wait(0)
+
+    def poll(self):
+        """Reaps the task's process without blocking if it has exited.
+
+        Returns ``True`` if the process has been reaped (now or before).
+        """
+        return self._wait(os.WNOHANG)
+
+    def _wait(self, options):
+        if self.pid is None:
+            return False
+        if self._reaped:
+            return True
+        try:
+            pid, exit_status_indication, rusage = os.wait4(self.pid, options)
+        except OSError as err:
+            if err.errno != errno.ECHILD:
+                raise
+            pid, exit_status_indication, rusage = self.pid, None, None
+        if pid == 0:
+            return False
+        self._reaped = True
+        self.finished_at = time.time()
+        self.rusage = rusage
+        if exit_status_indication is not None:
             self._exitsignal = exit_status_indication & 0xff
             self._exitcode = exit_status_indication >> 8
+        self._state = State.FINISHED
+        return True
+
+    def kill(self):
+        """Kills the task's process group with ``SIGKILL``."""
+        if self.pid is not None and not self._reaped:
+            self._signal(signal.SIGKILL)
 
     def terminate(self):
-        if self.pid is not None:
-            os.kill(self.pid, signal.SIGTERM)
-        self._state.value = State.FINISHED
+        """Sends ``SIGTERM`` to the task's process group. A started task
+        is finished once its process has been reaped (see :meth:`poll`);
+        a task which has not been started is finished right away."""
+        if self.pid is None:
+            self._state = State.FINISHED
+            self.finished_at = time.time()
+        elif not self._reaped:
+            self._signal(signal.SIGTERM)
+            if self.state == State.STOPPED:
+                # A stopped process will not handle SIGTERM otherwise.
+                self._signal(signal.SIGCONT)
+                self._state = State.RUNNING
+
+
+class TemplateCache(object):
+    """Renders template files for task specs.
+
+    Each template is read once (and again if its modification time changes)
+    and rendered with a single write. Rendered files are named by a hash of
+    their content in `directory`, so identical renderings share one file.
+    If a template is rendered again with the same values for the fields it
+    uses, the existing file is returned without rendering (counted in
+    `hits`, other renderings in `misses`).
+
+    If no `directory` is given, a temporary directory is created on first
+    use and removed by :meth:`close`. With `use_tmpfs` it is created in
+    ``/dev/shm`` (if available) to keep rendered files off the disk.
+
+    Every rendering holds a reference to the rendered file. Once all
+    references were given back with :meth:`release`, the file is removed.
+    """
+
+    def __init__(self, directory=None, use_tmpfs=False):
+        self.directory = directory
+        self.use_tmpfs = use_tmpfs
+        self._owns_directory = False
+        self.hits = 0
+        self.misses = 0
+        self._templates = {}
+        self._rendered = {}
+        self._refcounts = {}
+        # Keys of _rendered per rendered file to forget them with the file.
+        self._keys = {}
+
+    def render(self, template_filename, task_spec):
+        """Renders `template_filename` with the values of `task_spec` and
+        returns the name of the rendered file."""
+        template_filename = os.path.abspath(template_filename)
+        mtime, text, fields = self._load(template_filename)
+        key = (template_filename, mtime, tuple(
+            repr(task_spec.get(field)) for field in fields))
+        filename = self._rendered.get(key)
+        if filename is not None and os.path.exists(filename):
+            self.hits += 1
+            self._refcounts[filename] += 1
+            return filename
+
+        self.misses += 1
+        content = text.format(**task_spec)
+        if self.directory is None:
+            tmpfs = '/dev/shm'
+            self.directory = mkdtemp(
+                prefix='taskpile-',
+                dir=tmpfs if self.use_tmpfs and os.path.isdir(tmpfs) else None)
+            self._owns_directory = True
+        filename = os.path.join(self.directory, '{0}{1}'.format(
+            hashlib.sha1(content).hexdigest(),
+            os.path.splitext(template_filename)[1]))
+        if not os.path.exists(filename):
+            fd, tmp_filename = mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.rename(tmp_filename, filename)
+        self._rendered[key] = filename
+        self._keys.setdefault(filename, set()).add(key)
+        self._refcounts[filename] = self._refcounts.get(filename, 0) + 1
+        return filename
+
+    def release(self, filename):
+        """Gives back a reference to a file returned by :meth:`render`."""
+        count = self._refcounts.get(filename, 0) - 1
+        if count > 0:
+            self._refcounts[filename] = count
+            return
+        self._refcounts.pop(filename, None)
+        for key in self._keys.pop(filename, ()):
+            del self._rendered[key]
+        try:
+            os.unlink(filename)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+    def _load(self, template_filename):
+        mtime = os.stat(template_filename).st_mtime
+        template = self._templates.get(template_filename)
+        if template is None or template[0] != mtime:
+            with open(template_filename, 'r') as f:
+                text = f.read()
+            fields = set()
+            for _, field_name, _, _ in string.Formatter().parse(text):
+                if field_name is not None:
+                    fields.add(field_name.split('.', 1)[0].split('[', 1)[0])
+            template = (mtime, text, sorted(fields))
+            self._templates[template_filename] = template
+        return template
+
+    def close(self):
+        if self._owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+            self._owns_directory = False
+        self._rendered = {}
+        self._refcounts = {}
+        self._keys = {}
+
+
+template_cache = TemplateCache()
 
 
 class TemplateFileFormatter(string.Formatter):
-    def __init__(self, task_spec):
+    """Formats commands rendering the files referenced with the ``!t``
+    conversion. Relative template paths are relative to `cwd` (the current
+    directory if ``None``)."""
+
+    def __init__(self, task_spec, cache=None, cwd=None):
         super(TemplateFileFormatter, self).__init__()
         self.task_spec = task_spec
+        self.cache = template_cache if cache is None else cache
+        self.cwd = cwd
         self.original_files = {}
 
     def parse(self, format_string):
@@ -115,97 +374,777 @@ class TemplateFileFormatter(string.Formatter):
             return super(TemplateFileFormatter, self).convert_field(
                 value, conversion)
 
-        fd, new_filename = mkstemp()
-        try:
-            self.original_files[new_filename] = value
-            with open(value, 'r') as template:
-                for line in template:
-                    os.write(fd, line.format(**self.task_spec))
-        finally:
-            os.close(fd)
+        if self.cwd is not None:
+            value = os.path.join(self.cwd, value)
+        new_filename = self.cache.render(value, self.task_spec)
+        self.original_files[new_filename] = value
         return quote_for_shell(new_filename)
 
 
 class ExternalTask(Task):
+    """Task running a shell command.
+
+    If `template_spec` is given, template files referenced in the command
+    with the ``!t`` conversion are rendered with the values of
+    `template_spec` when the task starts (or :meth:`render_templates` is
+    called) and removed again when it finishes. Relative paths of template
+    files are relative to `cwd`. Rendering replaces `command` by the command
+    referencing the rendered files. The command as given is kept in
+    `unrendered_command` (``None`` before rendering), and `template_spec`
+    is kept as well, so the task can be rendered again as a new task.
+
+    The output of the command is written to the files `outbuf_name` and
+    `errbuf_name`. Read them with :func:`taskpile.capture.open_output`.
+    """
+
+    __slots__ = (
+        'command', 'original_files', 'cwd', 'template_spec',
+        'unrendered_command', 'outbuf_name', 'errbuf_name', '_rendered_files',
+        '_popen')
+
     # FIXME remove original_files from core ExternalTask as it is only needed
     # for the UI
-    def __init__(self, command, name=None, original_files={}, niceness=0):
+    def __init__(
+            self, command, name=None, original_files={}, niceness=0,
+            priority=0, expected_runtime=None, cwd=None, template_spec=None,
+            cpus=1, memory=None, unrendered_command=None):
         if name is None:
             name = command
         self.command = command
         self.original_files = original_files
-        super(ExternalTask, self).__init__(None, name=name, niceness=niceness)
+        self.cwd = cwd
+        self.template_spec = template_spec
+        self.unrendered_command = unrendered_command
+        self._rendered_files = []
+        self._popen = None
+        super(ExternalTask, self).__init__(
+            None, name=name, niceness=niceness, priority=priority,
+            expected_runtime=expected_runtime, cpus=cpus, memory=memory)
 
     def start(self):
+        self.started_at = time.time()
         outbuf = NamedTemporaryFile('w', delete=False)
         errbuf = NamedTemporaryFile('w', delete=False)
         self.outbuf_name = outbuf.name
         self.errbuf_name = errbuf.name
+        for buf in (outbuf, errbuf):
+            # Allows to truncate the file while the task writes to it (see
+            # taskpile.capture).
+            flags = fcntl.fcntl(buf, fcntl.F_GETFL)
+            fcntl.fcntl(buf, fcntl.F_SETFL, flags | os.O_APPEND)
 
-        def invoke():
-            subprocess.call(
-                (self.command,), shell=True, stdout=outbuf, stderr=errbuf)
+        try:
+            try:
+                self.render_templates()
+            except Exception as err:
+                self._fail(
+                    'Cannot render template files: {0}'.format(err),
+                    outbuf, errbuf)
+                return
+            # The command is spawned directly (no intermediate Python
+            # process) to make pid, exit status and signals refer to the
+            # process actually doing the work.
+            args = split_simple_command(self.command)
+            try:
+                try:
+                    if args is not None:
+                        self._popen = self._spawn(args, outbuf, errbuf)
+                except OSError:
+                    args = None  # Let the shell report the error.
+                if args is None:
+                    self._popen = self._spawn(
+                        ['/bin/sh', '-c', self.command], outbuf, errbuf)
+            except Exception as err:
+                # E.g. the niceness, CPU affinity or working directory could
+                # not be set.
+                self._fail(
+                    'Cannot start command: {0}'.format(err), outbuf, errbuf)
+        finally:
             outbuf.close()
             errbuf.close()
+            if self._popen is not None:
+                self._pid = self._popen.pid
+                _make_group_leader(self._pid)
+                self._state = State.RUNNING
 
-        self.function = invoke
-        super(ExternalTask, self).start()
-        outbuf.close()
-        errbuf.close()
+    def render_templates(self, cache=None):
+        """Renders the template files of the command (if not done
+        already)."""
+        if self.template_spec is None or self.unrendered_command is not None:
+            return
+        if cache is None:
+            cache = template_cache
+        formatter = TemplateFileFormatter(
+            self.template_spec, cache, self.cwd)
+        command = formatter.format(self.command, **self.template_spec)
+        self.unrendered_command = self.command
+        self.command = command
+        self.original_files = formatter.original_files
+        self._rendered_files = [(cache, f) for f in self.original_files]
+
+    def _release_rendered_files(self):
+        for cache, filename in self._rendered_files:
+            cache.release(filename)
+        self._rendered_files = []
+
+    def _spawn(self, args, outbuf, errbuf):
+        return subprocess.Popen(
+            args, stdout=outbuf, stderr=errbuf, cwd=self.cwd, close_fds=True,
+            preexec_fn=self._prepare_child)
+
+    def _fail(self, message, outbuf, errbuf):
+        """Lets a shell fail in place of the command, so the task finishes
+        like any failed task and `message` shows in its output."""
+        errbuf.write('taskpile: {0}\n'.format(message))
+        errbuf.flush()
+        self._popen = subprocess.Popen(
+            ['/bin/sh', '-c', 'exit 1'], stdout=outbuf, stderr=errbuf,
+            close_fds=True)
+
+    def _prepare_child(self):
+        _make_group_leader(0)
+        os.nice(self.niceness)
+        if self.placement is not None:
+            # Imported here to only load ctypes if placements are used.
+            from taskpile.placement import prefer_memory_nodes, set_affinity
+            set_affinity(0, self.placement.cpus)
+            prefer_memory_nodes(self.placement.nodes)
+
+    def _wait(self, options):
+        reaped = super(ExternalTask, self)._wait(options)
+        if reaped and self._popen is not None:
+            # Keeps the Popen object from trying to reap the process itself.
+            self._popen.returncode = self.exitcode
+        if reaped:
+            self._release_rendered_files()
+        return reaped
 
     @classmethod
-    def from_task_spec(cls, spec, niceness=0):
+    def from_task_spec(cls, spec, niceness=0, priority=0, cwd=None):
         name = spec.get(TaskGroupSpec.NAME_KEY, None)
-        formatter = TemplateFileFormatter(spec)
-        cmd = formatter.format(spec[TaskGroupSpec.CMD_KEY], **spec)
-        return ExternalTask(cmd, name, original_files=formatter.original_files)
+        priority = int(spec.get(TaskGroupSpec.PRIORITY_KEY, priority))
+        expected_runtime = spec.get(TaskGroupSpec.RUNTIME_KEY, None)
+        if expected_runtime is not None:
+            expected_runtime = float(expected_runtime)
+        cpus = float(spec.get(TaskGroupSpec.CPUS_KEY, 1))
+        memory = spec.get(TaskGroupSpec.MEMORY_KEY, None)
+        if memory is not None:
+            memory = parse_size(memory)
+        cmd = spec[TaskGroupSpec.CMD_KEY]
+        uses_templates = any(
+            conversion == 't' for _, _, _, conversion in
+            TemplateFileFormatter(spec).parse(cmd))
+        return ExternalTask(
+            cmd, name, niceness=niceness, priority=priority,
+            expected_runtime=expected_runtime, cwd=cwd,
+            template_spec=dict(spec) if uses_templates else None, cpus=cpus,
+            memory=memory)
+
+
+class ChildWatcher(object):
+    """Makes the termination of child processes observable as a file
+    descriptor becoming readable.
+
+    A ``SIGCHLD`` handler is installed which writes to a pipe. The read end
+    (see :meth:`fileno`) can be passed to ``select`` or an event loop to call
+    :meth:`Taskpile.update` as soon as a task exits instead of polling.
+    """
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        for fd in (self._read_fd, self._write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        self._previous_handler = signal.signal(
+            signal.SIGCHLD, self._on_sigchld)
+        signal.siginterrupt(signal.SIGCHLD, False)
+
+    def fileno(self):
+        return self._read_fd
+
+    def _on_sigchld(self, signum, frame):
+        try:
+            os.write(self._write_fd, b'\0')
+        except OSError:
+            pass  # Pipe is full, thus the reader will be woken up anyway.
+
+    def clear(self):
+        try:
+            while os.read(self._read_fd, 512):
+                pass
+        except OSError as err:
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def wait(self, timeout=None):
+        """Blocks until a child exited or `timeout` seconds passed.
+
+        Returns ``True`` if a child exited.
+        """
+        while True:
+            try:
+                readable, _, _ = select.select(
+                    [self._read_fd], [], [], timeout)
+                break
+            except select.error as err:
+                if err.args[0] != errno.EINTR:
+                    raise
+        self.clear()
+        return len(readable) > 0
+
+    def close(self):
+        if self._previous_handler is None:
+            self._previous_handler = signal.SIG_DFL
+        signal.signal(signal.SIGCHLD, self._previous_handler)
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+class TaskSource(object):
+    """Provides tasks to a :class:`Taskpile` which are only created when
+    the taskpile is about to run them.
+
+    `tasks` is an iterable creating the tasks and `total` the number of
+    tasks it will provide (if known).
+    """
+
+    def __init__(self, tasks, total=None, name=None):
+        self._tasks = iter(tasks)
+        self.total = total
+        self.name = name
+        self.drawn = 0
+        self.error = None
+
+    def next_task(self):
+        """Returns the next task or ``None`` if the source is exhausted."""
+        try:
+            task = next(self._tasks)
+        except StopIteration:
+            return None
+        self.drawn += 1
+        return task
+
+    @property
+    def remaining(self):
+        if self.total is None:
+            return None
+        return self.total - self.drawn
+
+
+class SpecTaskSource(TaskSource):
+    """Creates the tasks of a task spec file one by one.
+
+    The first `drawn` tasks are skipped, which allows to resume a partially
+    processed spec file.
+    """
+
+    def __init__(
+            self, filename, start_repeat=0, num_repeats=1, niceness=0,
+            priority=0, cwd=None, drawn=0):
+        self.filename = os.path.abspath(filename)
+        self.start_repeat = start_repeat
+        self.num_repeats = num_repeats
+        self.niceness = niceness
+        self.priority = priority
+        self.cwd = cwd
+        specs = TaskGroupSpec.from_spec_file(self.filename).specs(
+            start_repeat, num_repeats)
+        tasks = (
+            ExternalTask.from_task_spec(spec, niceness, priority, cwd)
+            for spec in specs[drawn:])
+        super(SpecTaskSource, self).__init__(
+            tasks, len(specs), os.path.basename(filename))
+        self.drawn = drawn
+
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+AVAILABLE_MEMORY = 'available'
+
+
+def available_memory():
+    """Returns the memory available for new processes (``MemAvailable`` in
+    ``/proc/meminfo``) in bytes or ``None`` if it is unknown."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return None
+
+
+def parse_memory_budget(value):
+    """Parses a memory budget given as size or as ``'available'``."""
+    if value.strip().lower() == AVAILABLE_MEMORY:
+        return AVAILABLE_MEMORY
+    return parse_size(value)
+
+
+class TaskpileListener(object):
+    """Base class for objects observing the task transitions of a
+    :class:`Taskpile`. Add instances to :attr:`Taskpile.listeners`.
+    """
+
+    def on_enqueued(self, task):
+        pass
+
+    def on_started(self, task):
+        pass
+
+    def on_stopped(self, task):
+        pass
+
+    def on_continued(self, task):
+        pass
+
+    def on_finished(self, task):
+        pass
+
+    def on_terminated(self, task):
+        """Called when `task` was asked to terminate with
+        :meth:`Taskpile.terminate`. Started tasks finish once their process
+        exited."""
+        pass
+
+    def on_archived(self, task, summary):
+        """Called when finished `task` has been replaced by `summary` in
+        :attr:`Taskpile.finished` (see :meth:`Taskpile.set_archive`)."""
+        pass
+
+    def on_source_added(self, source):
+        pass
+
+    def on_source_exhausted(self, source):
+        """Called when all tasks of `source` have been enqueued or creating
+        a task failed (see :attr:`TaskSource.error`)."""
+        pass
+
+    def on_updated(self):
+        """Called at the end of each :meth:`Taskpile.update`."""
+        pass
+
+    def seconds_until_update(self):
+        """Returns the time in seconds until the listener needs the next
+        :meth:`Taskpile.update` or ``None`` if it only reacts to task
+        transitions."""
+        return None
 
 
 class Taskpile(object):
-    def __init__(self, max_parallel=max(1, cpu_count() - 1)):
-        self.pending = []
-        self.running = []
+    """Queue of tasks running at most `max_parallel` tasks at once.
+
+    All free slots are filled in a single :meth:`update`. If starting many
+    programs at once causes problems, `min_start_interval` can be set to the
+    minimum time in seconds between two task starts (i.e. the inverse of the
+    maximum start rate). Continuing stopped tasks is not rate limited.
+
+    Pending tasks are kept in `pending`, a scheduling policy from
+    :mod:`taskpile.scheduling` deciding which task to run next (FIFO by
+    default). Running tasks are kept in the `running` :class:`TaskQueue` and
+    finished ones in the `finished` list. Stopped tasks are put back to the
+    front of `pending`. An update only inspects running tasks, thus its cost
+    does not depend on the number of pending tasks. To remove a task from the
+    queues, terminate it with :meth:`terminate`.
+
+    Large numbers of tasks should be added as :class:`TaskSource` with
+    :meth:`add_source`. Tasks are only taken from sources (in the order the
+    sources were added) while there are less than `lookahead` pending tasks.
+    In addition, the next task of every source is kept pending, so that the
+    scheduling policy chooses among all sources.
+
+    Each running task occupies as many of the `max_parallel` slots as it
+    needs CPUs (see :attr:`Task.cpus`). If a `memory_budget` (in bytes) is
+    given, tasks are only started while the memory declared by the running
+    and stopped tasks fits into it. With :data:`AVAILABLE_MEMORY` as budget,
+    started tasks have to fit into the memory currently available according
+    to the kernel instead, less the declared memory running tasks have not
+    allocated yet (as far as known from their sampled ``usage``). Pending
+    tasks not fitting into the free slots or memory are skipped and later
+    tasks (among the first `lookahead` pending tasks) are started in their
+    place. A task needing more than the whole budget is started when no
+    other task is running. Stopped tasks keep their memory and can always
+    be continued.
+
+    If a `controller` (like :class:`taskpile.loadcontrol.LoadController`)
+    is set, it adjusts `max_parallel` at the beginning of each update. If a
+    `placement_engine` (:class:`taskpile.placement.PlacementEngine`) is set,
+    tasks get dedicated CPUs whenever they are started or continued.
+
+    If an archive (:class:`taskpile.archive.TaskArchive`) is set with
+    :meth:`set_archive`, finished tasks are written to it and replaced by
+    compact summaries in `finished`.
+
+    Updates are only needed after tasks exited (see :class:`ChildWatcher`),
+    tasks or sources were added or the settings changed, and additionally
+    after :meth:`seconds_until_update`. Tasks which are not child processes
+    are polled every `poll_interval` seconds.
+    """
+
+    def __init__(
+            self, max_parallel=max(1, cpu_count() - 1), min_start_interval=0,
+            policy=None, lookahead=16, memory_budget=None):
+        if policy is None:
+            policy = FifoPolicy()
+        self.pending = policy
+        self.running = TaskQueue()
         self.finished = []
+        self.sources = []
         self.max_parallel = max_parallel
+        self.min_start_interval = min_start_interval
+        self.lookahead = lookahead
+        self.memory_budget = memory_budget
+        self.controller = None
+        self.placement_engine = None
+        self.archive = None
+        self.listeners = []
+        self.poll_interval = 1.
+        self.kill_grace = 5.
+        self._last_start = None
+        # Times at which terminated tasks still alive get killed.
+        self._kill_deadlines = {}
+        # Sources of the pending tasks taken from sources.
+        self._source_of = {}
+        # Stopped tasks put back to pending, which still hold their memory.
+        self._stopped = set()
+
+    def _notify(self, event, *args):
+        for listener in self.listeners:
+            getattr(listener, event)(*args)
 
     def enqueue(self, task):
         self.pending.append(task)
+        if task.state == State.STOPPED:
+            self._stopped.add(task)
+        self._notify('on_enqueued', task)
+
+    def add_source(self, source):
+        self.sources.append(source)
+        self._notify('on_source_added', source)
+
+    def num_undrawn(self):
+        """Returns the number of tasks the sources will still provide (not
+        counting sources of unknown size)."""
+        return sum(s.remaining for s in self.sources if s.total is not None)
+
+    def _draw_from_sources(self):
+        for task in [t for t in self._source_of if t not in self.pending]:
+            del self._source_of[task]
+        represented = set(self._source_of.values())
+        for source in list(self.sources):
+            if source not in represented:
+                self._draw(source)
+        while len(self.pending) < self.lookahead and len(self.sources) > 0:
+            self._draw(self.sources[0])
+
+    def _draw(self, source):
+        try:
+            task = source.next_task()
+        except Exception as err:
+            source.error = err
+            task = None
+        if task is None:
+            self.sources.remove(source)
+            self._notify('on_source_exhausted', source)
+        else:
+            self._source_of[task] = source
+            self.enqueue(task)
+
+    def set_policy(self, policy):
+        """Replaces the scheduling policy and moves all pending tasks to it.
+        """
+        tasks = list(self.pending)
+        for task in reversed(tasks):
+            if task.state == State.STOPPED:
+                policy.appendleft(task)
+        for task in tasks:
+            if task.state != State.STOPPED:
+                policy.append(task)
+        self.pending = policy
+
+    def set_archive(self, archive):
+        """Sets the archive finished tasks are moved to and moves the
+        tasks finished so far to it."""
+        self.archive = archive
+        for i in range(len(self.finished)):
+            self._archive(i)
+
+    def _archive(self, index):
+        if self.archive is None:
+            return
+        task = self.finished[index]
+        summary = self.archive.store(task)
+        if summary is not task:
+            self.finished[index] = summary
+            self._notify('on_archived', task, summary)
+
+    def _finish(self, task):
+        self._kill_deadlines.pop(task, None)
+        self.finished.append(task)
+        self._notify('on_finished', task)
+        self._archive(-1)
 
     def update(self):
         self._update_queues()
+        if self.controller is not None:
+            self.controller.update(self)
         self._manage_tasks()
+        self._notify('on_updated')
+
+    def terminate(self, task):
+        """Terminates `task` regardless of whether it is pending, stopped or
+        running.
+
+        Started tasks are sent ``SIGTERM`` and stay in `running` until their
+        process has been reaped by an :meth:`update`. Tasks still alive
+        after `kill_grace` seconds are killed with ``SIGKILL``.
+        """
+        task.terminate()
+        if task in self.pending:
+            self.pending.remove(task)
+            if task.pid is None:
+                self._finish(task)
+            else:
+                # Stopped task which still has to be reaped.
+                self.running.append(task)
+        if task.state != State.FINISHED:
+            self._kill_deadlines.setdefault(task, _clock() + self.kill_grace)
+        self._notify('on_terminated', task)
+
+    def shutdown(self, grace=5., kill_timeout=1.):
+        """Terminates all tasks and returns what happened to them.
+
+        All running and stopped tasks are sent ``SIGTERM`` at once and
+        reaped as they exit. Tasks still alive after `grace` seconds are
+        killed with ``SIGKILL``. The returned ``OrderedDict`` maps every
+        task which was not finished to one of
+
+        * ``'cancelled'``: the task was never started,
+        * ``'exited'``: the task exited before it was terminated,
+        * ``'terminated'``: the task exited within the grace period,
+        * ``'killed'``: the task had to be killed,
+        * ``'unreaped'``: the task did not exit within `kill_timeout`
+          seconds after being killed. It stays in `running`.
+
+        Task sources are discarded.
+        """
+        report = OrderedDict()
+        self.sources = []
+        alive = []
+        for task in list(self.running) + list(self.pending):
+            if task.pid is None:
+                report[task] = 'cancelled'
+                self.terminate(task)
+                continue
+            if task in self.pending:
+                self.pending.remove(task)
+                self.running.append(task)
+            if task.poll():
+                report[task] = 'exited'
+            else:
+                alive.append(task)
+        for task in alive:
+            task.terminate()
+            report[task] = 'terminated'
+
+        remaining = self._reap(alive, _clock() + grace)
+        for task in remaining:
+            task.kill()
+            report[task] = 'killed'
+        for task in self._reap(remaining, _clock() + kill_timeout):
+            report[task] = 'unreaped'
+
+        for task, outcome in report.items():
+            if outcome not in ('cancelled', 'unreaped'):
+                self._release_cpus(task)
+                self.running.remove(task)
+                self._finish(task)
+        self._notify('on_updated')
+        return report
+
+    @staticmethod
+    def _reap(tasks, deadline):
+        """Reaps `tasks` until all exited or the `deadline` passed and
+        returns the remaining ones."""
+        while True:
+            tasks = [task for task in tasks if not task.poll()]
+            delay = deadline - _clock()
+            if len(tasks) <= 0 or delay <= 0:
+                return tasks
+            time.sleep(min(0.01, delay))
 
     def _update_queues(self):
-        pending = []
-        running = []
-        stopped = []
-        for task in self.pending + self.running:
+        for task in list(self.running):
+            task.poll()
             state = int(task.state)
             assert State.is_valid_state(state)
-            if state == State.PENDING:
-                pending.append(task)
-            elif state == State.RUNNING:
-                running.append(task)
-            elif state == State.FINISHED:
-                task.join()
-                self.finished.append(task)
+            if state == State.FINISHED:
+                self._release_cpus(task)
+                self.running.remove(task)
+                self._finish(task)
             elif state == State.STOPPED:
-                stopped.append(task)
-        self.pending = stopped + pending
-        self.running = running
+                self._release_cpus(task)
+                self.running.remove(task)
+                self.pending.appendleft(task)
+                self._stopped.add(task)
+                self._notify('on_stopped', task)
+        now = _clock()
+        for task, deadline in list(self._kill_deadlines.items()):
+            if deadline <= now:
+                task.kill()
+                del self._kill_deadlines[task]
 
     def _manage_tasks(self):
-        while len(self.running) > self.max_parallel:
-            task = self.running.pop()
+        used_cpus = self._used_cpus()
+        while len(self.running) > 0 and (
+                used_cpus > self.max_parallel and len(self.running) > 1 or
+                self.max_parallel <= 0):
+            # Terminated tasks are about to exit anyway.
+            task = self.running.last()
+            while task is not None and task in self._kill_deadlines:
+                task = self.running.prev_task(task)
+            if task is None:
+                break
+            self.running.remove(task)
             task.stop()
-            self.pending.insert(0, task)
-        # Start at most one process at once. Otherwise, we can easily run
-        # in race conditions in the programs started and alike.
-        # There also seems to be a race condition in Python itself.
-        if len(self.pending) > 0 and len(self.running) < self.max_parallel:
-            task = self.pending.pop(0)
+            self._release_cpus(task)
+            used_cpus -= task.cpus
+            self.pending.appendleft(task)
+            self._stopped.add(task)
+            self._notify('on_stopped', task)
+        self._draw_from_sources()
+        free_memory = self._free_memory()
+        while len(self.pending) > 0 and used_cpus < self.max_parallel:
+            task = self._next_admissible_task(used_cpus, free_memory)
+            if task is None:
+                break
             if task.state == State.STOPPED:
+                # Cores might have been given to other tasks in between.
+                self._assign_cpus(task)
                 task.cont()
-            else:
+                event = 'on_continued'
+            elif self._start_delay() <= 0:
+                self._assign_cpus(task)
                 task.start()
+                self._apply_cpus(task)
+                self._last_start = _clock()
+                if free_memory is not None and task.memory is not None:
+                    free_memory -= task.memory
+                event = 'on_started'
+            else:
+                break
+            if task is self.pending.peek():
+                self.pending.popleft()
+            else:
+                self.pending.remove(task)
             self.running.append(task)
+            used_cpus += task.cpus
+            self._notify(event, task)
+            self._draw_from_sources()
+
+    def _assign_cpus(self, task):
+        if self.placement_engine is not None:
+            self.placement_engine.assign(task)
+            self._apply_cpus(task)
+
+    def _apply_cpus(self, task):
+        if self.placement_engine is not None:
+            self.placement_engine.apply(task)
+
+    def _release_cpus(self, task):
+        if self.placement_engine is not None:
+            self.placement_engine.release(task)
+
+    def _used_cpus(self):
+        return sum(task.cpus for task in self.running)
+
+    def _free_memory(self):
+        self._stopped = set(
+            task for task in self._stopped
+            if task in self.pending and task.state == State.STOPPED)
+        if self.memory_budget is None:
+            return None
+        elif self.memory_budget == AVAILABLE_MEMORY:
+            # Recently started tasks might not have allocated their memory
+            # yet, while the memory of stopped tasks is not available anyway.
+            return available_memory() - sum(
+                self._unallocated_memory(task) for task in self.running)
+        return self.memory_budget - sum(
+            task.memory for task in itertools.chain(
+                self.running, self._stopped)
+            if task.memory is not None)
+
+    @staticmethod
+    def _unallocated_memory(task):
+        if task.memory is None:
+            return 0
+        rss = 0 if task.usage is None else task.usage.rss
+        return max(0, task.memory - rss)
+
+    def _next_admissible_task(self, used_cpus, free_memory):
+        task = self.pending.peek()
+        if len(self.running) <= 0:
+            return task  # Run tasks exceeding the budget on their own.
+        if self._is_admissible(task, used_cpus, free_memory):
+            return task
+        for task in self.pending.head(self.lookahead)[1:]:
+            if self._is_admissible(task, used_cpus, free_memory):
+                return task
+        return None
+
+    def _is_admissible(self, task, used_cpus, free_memory):
+        if used_cpus + task.cpus > self.max_parallel:
+            return False
+        return free_memory is None or task.memory is None or \
+            task.state == State.STOPPED or task.memory <= free_memory
+
+    def seconds_until_next_start(self):
+        """Returns the time in seconds until the next pending task may be
+        started or ``None`` if no task is waiting for a free slot.
+        """
+        if len(self.pending) <= 0 or \
+                self._used_cpus() >= self.max_parallel:
+            return None
+        return self._start_delay()
+
+    def seconds_until_update(self):
+        """Returns the time in seconds until the next :meth:`update` is
+        needed even if no task changes its state or ``None`` if no such
+        update is needed.
+
+        This takes into account the start rate limit, the `controller`, the
+        listeners, tasks which have to be polled or killed and the memory
+        available with a budget of :data:`AVAILABLE_MEMORY`.
+        """
+        delays = [listener.seconds_until_update()
+                  for listener in self.listeners]
+        if len(self._kill_deadlines) > 0:
+            delays.append(
+                max(0, min(self._kill_deadlines.values()) - _clock()))
+        # Without a start delay only a lack of memory could have prevented
+        # starting the next task during the last update.
+        start_delay = self.seconds_until_next_start()
+        if start_delay is not None and start_delay > 0:
+            delays.append(start_delay)
+        if len(self.running) > 0 or len(self.pending) > 0:
+            if self.controller is not None:
+                delays.append(self.controller.seconds_until_update())
+            if self.memory_budget == AVAILABLE_MEMORY and \
+                    start_delay is not None:
+                delays.append(self.poll_interval)
+        if any(task.needs_polling for task in self.running):
+            delays.append(self.poll_interval)
+        delays = [delay for delay in delays if delay is not None]
+        if len(delays) <= 0:
+            return None
+        return min(delays)
+
+    def _start_delay(self):
+        if self._last_start is None:
+            return 0
+        return max(
+            0, self._last_start + self.min_start_interval - _clock())
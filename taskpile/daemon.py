@@ -0,0 +1,211 @@
+from __future__ import absolute_import
+
+import argparse
+import errno
+import itertools
+import os
+import os.path
+import select
+import sys
+
+from taskpile.archive import TaskArchive
+from taskpile.capture import OutputCapture
+from taskpile.client import default_socket_path
+from taskpile.core import ChildWatcher, parse_memory_budget, Taskpile, \
+    template_cache
+from taskpile.journal import Journal, JournalLockedError
+from taskpile.loadcontrol import LoadController
+from taskpile.placement import PlacementEngine
+from taskpile.sanitize import parse_size
+from taskpile.scheduling import PriorityPolicy
+from taskpile.server import ServerError, TaskpileServer
+
+
+class SelectLoop(object):
+    """Minimal event loop providing the ``watch_file`` interface of
+    ``urwid.MainLoop``."""
+
+    def __init__(self):
+        self._watches = {}
+        self._handles = itertools.count()
+
+    def watch_file(self, fd, callback):
+        handle = next(self._handles)
+        self._watches[handle] = (fd, callback)
+        return handle
+
+    def remove_watch_file(self, handle):
+        return self._watches.pop(handle, None) is not None
+
+    def run_once(self, timeout=None):
+        """Waits at most `timeout` seconds for watched files to become
+        readable and calls their callbacks."""
+        fds = dict(self._watches.values())
+        try:
+            readable, _, _ = select.select(list(fds), [], [], timeout)
+        except select.error as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            return
+        for fd in readable:
+            fds[fd]()
+
+
+class Daemon(object):
+    """Runs a taskpile without user interface, controlled through a
+    :class:`TaskpileServer`.
+
+    Tasks which were adopted from a journal are not child processes, so the
+    daemon also updates the taskpile every `poll_interval` seconds. When
+    stopped, tasks get `shutdown_grace` seconds to exit before they are
+    killed.
+    """
+
+    def __init__(
+            self, taskpile, socket_path, journal=None, poll_interval=1,
+            shutdown_grace=5.):
+        self.taskpile = taskpile
+        self.journal = journal
+        self.poll_interval = poll_interval
+        self.shutdown_grace = shutdown_grace
+        self.loop = SelectLoop()
+        self.child_watcher = ChildWatcher()
+        self.loop.watch_file(
+            self.child_watcher.fileno(), self.child_watcher.clear)
+        self.server = TaskpileServer(
+            taskpile, socket_path, self.loop, on_stop=self.stop)
+        self._stopped = False
+
+    def stop(self):
+        self._stopped = True
+
+    def run(self):
+        try:
+            while not self._stopped:
+                self.taskpile.update()
+                timeout = self.taskpile.seconds_until_update()
+                if timeout is None:
+                    timeout = self.poll_interval
+                self.loop.run_once(min(timeout, self.poll_interval))
+            report = self.taskpile.shutdown(self.shutdown_grace)
+            if self.journal is not None:
+                # Keep the journal if some task could not be reaped.
+                self.journal.close(remove='unreaped' not in report.values())
+                self.journal = None
+            template_cache.close()
+        finally:
+            self.server.close()
+            self.child_watcher.close()
+            if self.journal is not None:
+                self.journal.close()
+
+
+def daemonize():
+    """Detaches the process from the terminal by the usual double fork."""
+    if os.fork() > 0:
+        os._exit(0)
+    os.setsid()
+    if os.fork() > 0:
+        os._exit(0)
+    os.chdir('/')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in range(3):
+        os.dup2(devnull, fd)
+    os.close(devnull)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run a taskpile in the background. Use taskpilectl to '
+        'control it.')
+    parser.add_argument(
+        '--socket', default=default_socket_path(),
+        help='Socket to listen at (default: %(default)s).')
+    parser.add_argument(
+        '--journal', default=os.path.join(
+            os.path.expanduser('~'), '.taskpile', 'journal'),
+        help='File recording the tasks to resume them if the daemon gets '
+        'killed (default: %(default)s).')
+    parser.add_argument(
+        '--no-journal', action='store_true', help='Do not record the tasks.')
+    parser.add_argument(
+        '--max-parallel', type=int,
+        help='Maximum number of parallel tasks.')
+    parser.add_argument(
+        '--adapt-to-load', action='store_true',
+        help='Run less tasks in parallel while the system is loaded by other '
+        'processes.')
+    parser.add_argument(
+        '--foreground', action='store_true',
+        help='Do not detach from the terminal.')
+    parser.add_argument(
+        '--tmpfs-templates', action='store_true',
+        help='Render template files to /dev/shm instead of the temporary '
+        'directory.')
+    parser.add_argument(
+        '--memory-budget',
+        help='Memory the running tasks may reserve in total, e.g. 64G, or '
+        '"available" to start tasks only while their memory is available.')
+    parser.add_argument(
+        '--pin-cpus', action='store_true',
+        help='Give each running task dedicated CPU cores, taking the NUMA '
+        'nodes into account.')
+    parser.add_argument(
+        '--max-output',
+        help='Output to keep per task and stream, e.g. 100M. The beginning '
+        'and the end of longer outputs are kept.')
+    parser.add_argument(
+        '--compress-output', action='store_true',
+        help='Compress the output of finished tasks, which is done by '
+        'default with --max-output. Compressed output has to be '
+        'decompressed as a whole to view it.')
+    args = parser.parse_args(argv)
+    template_cache.use_tmpfs = args.tmpfs_templates
+
+    socket_path = os.path.abspath(args.socket)
+    for path in (socket_path, os.path.abspath(args.journal)):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+    journal = None
+    if not args.no_journal:
+        try:
+            journal = Journal(os.path.abspath(args.journal))
+        except JournalLockedError as err:
+            sys.exit('{0} Use --journal to choose another one.'.format(err))
+
+    taskpile = Taskpile(policy=PriorityPolicy())
+    if args.max_parallel is not None:
+        taskpile.max_parallel = args.max_parallel
+    if args.memory_budget is not None:
+        taskpile.memory_budget = parse_memory_budget(args.memory_budget)
+    if args.pin_cpus:
+        taskpile.placement_engine = PlacementEngine()
+    if args.adapt_to_load:
+        taskpile.controller = LoadController(
+            max_parallel=taskpile.max_parallel)
+    if journal is not None:
+        journal.restore(taskpile)
+    taskpile.set_archive(TaskArchive())
+    max_output = None
+    if args.max_output is not None:
+        max_output = parse_size(args.max_output)
+    output_capture = OutputCapture(
+        taskpile, max_output,
+        compress_finished=args.compress_output or max_output is not None)
+    try:
+        daemon = Daemon(taskpile, socket_path, journal)
+    except ServerError as err:
+        sys.exit(str(err))
+
+    if not args.foreground:
+        daemonize()
+    try:
+        daemon.run()
+    finally:
+        output_capture.close()
+        taskpile.archive.close()
+
+
+if __name__ == '__main__':
+    main()
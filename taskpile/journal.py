@@ -0,0 +1,320 @@
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import errno
+import fcntl
+import json
+import os
+import os.path
+import time
+
+from taskpile.core import ExternalTask, SpecTaskSource, State, \
+    TaskpileListener
+
+
+def process_start_time(pid):
+    """Returns the start time of process `pid` in clock ticks since boot or
+    ``None`` if no such process is alive.
+
+    Together with the pid, the start time identifies a process even if pids
+    get reused.
+    """
+    try:
+        with open('/proc/{0}/stat'.format(pid)) as f:
+            stat = f.read()
+    except IOError:
+        return None
+    # The process name might contain spaces and parentheses.
+    fields = stat[stat.rindex(')') + 2:].split()
+    if fields[0] in 'ZX':
+        return None
+    return int(fields[19])
+
+
+class AdoptedTask(ExternalTask):
+    """Task restored from a :class:`Journal`.
+
+    If the process of the task is still alive, it is adopted, i.e. it can be
+    stopped, continued and terminated. As it is not a child process of this
+    taskpile its exit status cannot be obtained and its end is only noticed
+    by polling.
+    """
+
+    __slots__ = ('start_time',)
+
+    def __init__(
+            self, command, name=None, original_files={}, niceness=0,
+            priority=0, expected_runtime=None, cwd=None, template_spec=None,
+            cpus=1, memory=None, unrendered_command=None, pid=None,
+            start_time=None, state=State.PENDING, exitcode=None,
+            exitsignal=None, outbuf_name=None, errbuf_name=None,
+            started_at=None, finished_at=None):
+        super(AdoptedTask, self).__init__(
+            command, name, original_files, niceness, priority,
+            expected_runtime, cwd, template_spec, cpus, memory,
+            unrendered_command)
+        self._pid = pid
+        self.start_time = start_time
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self._state = state
+        self._exitcode = exitcode
+        self._exitsignal = exitsignal
+        self._reaped = state == State.FINISHED
+        if outbuf_name is not None:
+            self.outbuf_name = outbuf_name
+            self.errbuf_name = errbuf_name
+
+    @property
+    def needs_polling(self):
+        return self._popen is None and self.pid is not None and \
+            not self._reaped
+
+    def is_alive(self):
+        if self.pid is None or self.start_time is None:
+            return False
+        return process_start_time(self.pid) == self.start_time
+
+    def _wait(self, options):
+        if self._popen is not None or self.pid is None or self._reaped:
+            return super(AdoptedTask, self)._wait(options)
+        while self.is_alive():
+            if options & os.WNOHANG:
+                return False
+            time.sleep(0.1)
+        self._reaped = True
+        self._state = State.FINISHED
+        return True
+
+
+class JournalLockedError(Exception):
+    pass
+
+
+class Journal(TaskpileListener):
+    """Append-only record of the task transitions of a taskpile, allowing to
+    resume it after the taskpile process died.
+
+    The journal stores one JSON object per line. Records are buffered and
+    written with a single ``fsync`` at the end of each taskpile update, so
+    enqueuing many tasks at once does not wait for the disk for every task.
+    Only :class:`ExternalTask` instances are recorded. Of a
+    :class:`SpecTaskSource` only the spec file and the number of tasks
+    already taken from it are recorded.
+
+    Attach the journal to a taskpile with :meth:`restore`.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = self._open_locked(filename, 'a+')
+        self._ids = {}
+        self._next_id = 0
+        self._sources = {}
+        self._next_source_id = 0
+        self._buffer = []
+
+    @staticmethod
+    def _open_locked(filename, mode):
+        f = open(filename, mode)
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as err:
+            f.close()
+            if err.errno in (errno.EAGAIN, errno.EACCES):
+                raise JournalLockedError(
+                    'Journal {0} is used by another taskpile.'.format(
+                        filename))
+            raise
+        return f
+
+    def restore(self, taskpile):
+        """Restores the tasks recorded in the journal into `taskpile` and
+        records further changes of the taskpile.
+
+        Pending tasks are enqueued again. Running and stopped tasks whose
+        process is still alive are adopted. Finished tasks (and those whose
+        process ended while taskpile was not running) are added to the
+        finished tasks and not run again. Task sources continue after the
+        last task taken from them.
+        """
+        tasks, sources = self._read()
+        for task in tasks:
+            task.poll()
+            state = task.state
+            if state == State.PENDING:
+                taskpile.pending.append(task)
+            elif state == State.RUNNING:
+                taskpile.running.append(task)
+            elif state == State.STOPPED:
+                taskpile.pending.appendleft(task)
+            else:
+                taskpile.finished.append(task)
+        taskpile.sources.extend(sources)
+        self._compact(taskpile)
+        taskpile.listeners.append(self)
+
+    def _read(self):
+        entries = OrderedDict()
+        source_entries = OrderedDict()
+        self._file.seek(0)
+        for line in self._file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # Incomplete record written when taskpile was killed.
+            event = record.pop('event')
+            if 'source' in record:
+                source_id = record.pop('source')
+                if event == 'source':
+                    source_entries[source_id] = record
+                elif event == 'drawn' and source_id in source_entries:
+                    source_entries[source_id].update(record)
+                elif event == 'exhausted':
+                    source_entries.pop(source_id, None)
+                continue
+            task_id = record.pop('id')
+            if event == 'enqueue':
+                entries[task_id] = record
+            elif task_id in entries:
+                entries[task_id].update(record)
+                entries[task_id]['state'] = {
+                    'start': State.RUNNING,
+                    'stop': State.STOPPED,
+                    'cont': State.RUNNING,
+                    'finish': State.FINISHED
+                }[event]
+        tasks = [AdoptedTask(**entry) for entry in entries.values()]
+        sources = []
+        for entry in source_entries.values():
+            try:
+                sources.append(SpecTaskSource(**entry))
+            except Exception:
+                pass  # The spec file might have been removed in between.
+        return tasks, sources
+
+    def _compact(self, taskpile):
+        """Replaces the journal by one only recording the current state of
+        `taskpile`."""
+        self._ids = {}
+        self._next_id = 0
+        self._sources = {}
+        self._next_source_id = 0
+        self._buffer = []
+        for source in taskpile.sources:
+            self.on_source_added(source)
+        for task in taskpile.running:
+            self.on_enqueued(task)
+            self.on_started(task)
+        for task in taskpile.pending:
+            self.on_enqueued(task)
+            if task.state == State.STOPPED:
+                self.on_started(task)
+                self.on_stopped(task)
+        for task in taskpile.finished:
+            self.on_enqueued(task)
+            self.on_finished(task)
+
+        tmp_filename = self.filename + '.tmp'
+        tmp_file = self._open_locked(tmp_filename, 'w')
+        self._file.close()
+        self._file = tmp_file
+        self.sync()
+        os.rename(tmp_filename, self.filename)
+
+    def _record(self, event, task, **data):
+        try:
+            data['id'] = self._ids[task]
+        except KeyError:
+            return
+        data['event'] = event
+        self._buffer.append(json.dumps(data))
+
+    def on_enqueued(self, task):
+        if not isinstance(task, ExternalTask):
+            return
+        self._ids[task] = self._next_id
+        self._next_id += 1
+        self._record(
+            'enqueue', task, command=task.command, name=task.name,
+            original_files=task.original_files, niceness=task.niceness,
+            priority=task.priority, expected_runtime=task.expected_runtime,
+            cwd=task.cwd, template_spec=task.template_spec, cpus=task.cpus,
+            memory=task.memory, unrendered_command=task.unrendered_command)
+
+    def on_started(self, task):
+        if task not in self._ids:
+            return
+        start_time = getattr(task, 'start_time', None)
+        if start_time is None and task.pid is not None:
+            start_time = process_start_time(task.pid)
+        # Template files are rendered on start and change the command.
+        self._record(
+            'start', task, command=task.command,
+            original_files=task.original_files,
+            unrendered_command=task.unrendered_command, pid=task.pid,
+            start_time=start_time, started_at=task.started_at,
+            outbuf_name=getattr(task, 'outbuf_name', None),
+            errbuf_name=getattr(task, 'errbuf_name', None))
+
+    def on_stopped(self, task):
+        self._record('stop', task)
+
+    def on_continued(self, task):
+        self._record('cont', task)
+
+    def on_finished(self, task):
+        self._record(
+            'finish', task, exitcode=task.exitcode,
+            exitsignal=task.exitsignal, finished_at=task.finished_at)
+        self._ids.pop(task, None)
+
+    def on_source_added(self, source):
+        if not isinstance(source, SpecTaskSource):
+            return
+        self._sources[source] = [self._next_source_id, source.drawn]
+        self._next_source_id += 1
+        self._record_source(
+            'source', source, filename=source.filename,
+            start_repeat=source.start_repeat, num_repeats=source.num_repeats,
+            niceness=source.niceness, priority=source.priority,
+            cwd=source.cwd, drawn=source.drawn)
+
+    def on_source_exhausted(self, source):
+        self._record_source('exhausted', source)
+        self._sources.pop(source, None)
+
+    def _record_source(self, event, source, **data):
+        try:
+            data['source'] = self._sources[source][0]
+        except KeyError:
+            return
+        data['event'] = event
+        self._buffer.append(json.dumps(data))
+
+    def on_updated(self):
+        # The progress of sources is recorded once per update together with
+        # the tasks taken from them.
+        for source, entry in self._sources.items():
+            if source.drawn != entry[1]:
+                entry[1] = source.drawn
+                self._record_source('drawn', source, drawn=source.drawn)
+        self.sync()
+
+    def sync(self):
+        """Writes all buffered records to disk."""
+        if len(self._buffer) <= 0:
+            return
+        self._file.write('\n'.join(self._buffer) + '\n')
+        self._buffer = []
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self, remove=False):
+        """Closes the journal. With `remove` the journal file is deleted, e.g.
+        because all tasks were terminated."""
+        if remove:
+            os.unlink(self.filename)
+        else:
+            self.sync()
+        self._file.close()
@@ -0,0 +1,116 @@
+from __future__ import absolute_import
+
+import math
+from multiprocessing import cpu_count
+import os
+
+from taskpile.core import _clock
+
+
+def read_loadavg():
+    """Returns the 1 minute load average."""
+    return os.getloadavg()[0]
+
+
+def read_pressure(resource):
+    """Returns the share of time in percent some tasks stalled on `resource`
+    (``'cpu'``, ``'memory'`` or ``'io'``) during the last 10 seconds or
+    ``None`` if the kernel does not provide pressure stall information."""
+    try:
+        with open('/proc/pressure/' + resource) as f:
+            for line in f:
+                fields = line.split()
+                if fields[0] == 'some':
+                    return float(fields[1].split('=', 1)[1])
+    except (IOError, IndexError, ValueError):
+        pass
+    return None
+
+
+class LoadController(object):
+    """Adjusts the `max_parallel` of a taskpile to the load of the system.
+
+    Every `interval` seconds the controller estimates the load not caused
+    by the taskpile from the load average and compares the remaining CPUs
+    (out of `capacity`) to its current target. If the target exceeds them
+    by more than `hysteresis` or the CPU, memory or IO pressure exceeds
+    `pressure_high` percent, the target is decreased by one. If more than
+    `hysteresis` CPUs are left and all pressures are below `pressure_low`,
+    it is increased by one. The target stays within `min_parallel` and
+    `max_parallel`. Running tasks above the target are stopped by the
+    taskpile and continued once the target rises again.
+
+    The load caused by the taskpile is the number of CPUs needed by its
+    running tasks, averaged like the load average over `load_period`
+    seconds. Otherwise the load of tasks which just finished would be taken
+    for foreign load and that of tasks which just started would be
+    subtracted before it shows in the load average.
+
+    Assign the controller to :attr:`taskpile.core.Taskpile.controller` to
+    use it.
+    """
+
+    resources = ('cpu', 'memory', 'io')
+    load_period = 60.
+
+    def __init__(
+            self, min_parallel=1, max_parallel=cpu_count(), capacity=None,
+            interval=5., hysteresis=0.5, pressure_low=5., pressure_high=20.):
+        if capacity is None:
+            capacity = cpu_count()
+        self.min_parallel = min_parallel
+        self.max_parallel = max_parallel
+        self.capacity = capacity
+        self.interval = interval
+        self.hysteresis = hysteresis
+        self.pressure_low = pressure_low
+        self.pressure_high = pressure_high
+        self.target = None
+        self.own_load = None
+        self._last_adjustment = None
+        self._last_update = None
+
+    def update(self, taskpile):
+        """Adjusts the target if due and sets the `max_parallel` of
+        `taskpile` to it."""
+        now = _clock()
+        self._average_own_load(taskpile, now)
+        if self.target is None:
+            self.target = taskpile.max_parallel
+        elif self._last_adjustment is None or \
+                now - self._last_adjustment >= self.interval:
+            self._adjust()
+            self._last_adjustment = now
+        self.target = max(
+            self.min_parallel, min(self.max_parallel, self.target))
+        taskpile.max_parallel = self.target
+
+    def seconds_until_update(self):
+        """Returns the time in seconds until the next adjustment is due."""
+        if self._last_adjustment is None:
+            return 0.
+        return max(0., self._last_adjustment + self.interval - _clock())
+
+    def _average_own_load(self, taskpile, now):
+        load = sum(task.cpus for task in taskpile.running)
+        if self.own_load is None:
+            # Tasks running already (e.g., adopted ones) have been
+            # contributing to the load average for a while.
+            self.own_load = float(load)
+        else:
+            decay = math.exp(-(now - self._last_update) / self.load_period)
+            self.own_load = decay * self.own_load + (1. - decay) * load
+        self._last_update = now
+
+    def _adjust(self):
+        free = self.capacity - max(0., read_loadavg() - self.own_load)
+        pressures = [read_pressure(r) for r in self.resources]
+        pressures = [p for p in pressures if p is not None]
+        pressure = max(pressures) if len(pressures) > 0 else 0.
+
+        if free < self.target - self.hysteresis or \
+                pressure > self.pressure_high:
+            self.target -= 1
+        elif free > self.target + self.hysteresis and \
+                pressure < self.pressure_low:
+            self.target += 1
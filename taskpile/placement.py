@@ -0,0 +1,247 @@
+from __future__ import absolute_import
+
+import ctypes
+import ctypes.util
+import errno
+import glob
+import math
+import os
+import os.path
+import platform
+
+from taskpile.accounting import iter_process_tree
+
+
+def parse_cpu_list(cpu_list):
+    """Parses a list like ``'0-3,8,10-11'`` as used in sysfs into a list of
+    numbers."""
+    numbers = []
+    for part in cpu_list.strip().split(','):
+        if part == '':
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            numbers.extend(range(int(first), int(last) + 1))
+        else:
+            numbers.append(int(part))
+    return numbers
+
+
+def _read(filename):
+    with open(filename) as f:
+        return f.read().strip()
+
+
+_CPU_SETSIZE = 1024
+_cpu_set_t = ctypes.c_ulong * (_CPU_SETSIZE // (8 * ctypes.sizeof(
+    ctypes.c_ulong)))
+_libc = None
+# Syscall number of set_mempolicy, which has no wrapper in libc.
+_set_mempolicy_nr = {'x86_64': 238, 'aarch64': 237, 'i686': 276}.get(
+    platform.machine())
+_MPOL_PREFERRED = 1
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return _libc
+
+
+def _cpu_set(cpus):
+    mask = _cpu_set_t()
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    for cpu in cpus:
+        mask[cpu // bits] |= 1 << (cpu % bits)
+    return mask
+
+
+def get_affinity(pid=0):
+    """Returns the CPUs process `pid` (or the calling process) may run on.
+    """
+    mask = _cpu_set_t()
+    if _get_libc().sched_getaffinity(
+            pid, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    return [
+        i for i in range(_CPU_SETSIZE) if (mask[i // bits] >> (i % bits)) & 1]
+
+
+def set_affinity(pid, cpus):
+    """Restricts all threads of process `pid` (0 for the calling thread) to
+    `cpus`."""
+    mask = _cpu_set(cpus)
+    tids = [pid]
+    if pid != 0:
+        try:
+            tids = [int(t) for t in os.listdir('/proc/{0}/task'.format(pid))]
+        except OSError:
+            pass
+    for tid in tids:
+        if _get_libc().sched_setaffinity(
+                tid, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+            err = ctypes.get_errno()
+            if err != errno.ESRCH:  # The thread might have exited.
+                raise OSError(err, os.strerror(err))
+
+
+def prefer_memory_nodes(nodes):
+    """Makes the calling process allocate memory preferably on NUMA
+    `nodes`. Does nothing where the syscall number is unknown."""
+    if _set_mempolicy_nr is None or len(nodes) <= 0:
+        return
+    mask = _cpu_set(nodes[:1])  # MPOL_PREFERRED accepts a single node.
+    _get_libc().syscall(
+        _set_mempolicy_nr, _MPOL_PREFERRED, ctypes.byref(mask),
+        ctypes.c_ulong(_CPU_SETSIZE))
+
+
+class CpuTopology(object):
+    """CPUs usable by taskpile grouped into NUMA nodes and physical cores.
+
+    `nodes` maps node numbers to lists of cores, each core being a tuple of
+    its SMT sibling CPUs.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    @classmethod
+    def from_sysfs(cls, root='/sys/devices/system', allowed=None):
+        """Reads the topology from sysfs. Only CPUs in `allowed` (by default
+        those the current process may run on) are included."""
+        cpu_dir = os.path.join(root, 'cpu')
+        cpus = parse_cpu_list(_read(os.path.join(cpu_dir, 'online')))
+        if allowed is None:
+            allowed = get_affinity()
+        cpus = [cpu for cpu in cpus if cpu in set(allowed)]
+
+        node_of = {}
+        for node_dir in glob.glob(os.path.join(root, 'node', 'node[0-9]*')):
+            node = int(os.path.basename(node_dir)[4:])
+            for cpu in parse_cpu_list(
+                    _read(os.path.join(node_dir, 'cpulist'))):
+                node_of[cpu] = node
+
+        nodes = {}
+        seen = set()
+        for cpu in cpus:
+            if cpu in seen:
+                continue
+            siblings_file = os.path.join(
+                cpu_dir, 'cpu{0}'.format(cpu), 'topology',
+                'thread_siblings_list')
+            try:
+                siblings = parse_cpu_list(_read(siblings_file))
+            except IOError:
+                siblings = [cpu]
+            core = tuple(s for s in siblings if s in cpus)
+            seen.update(core)
+            nodes.setdefault(node_of.get(cpu, 0), []).append(core)
+        return cls(nodes)
+
+
+class Placement(object):
+    """CPUs and NUMA nodes assigned to a task."""
+
+    def __init__(self, cpus, nodes):
+        self.cpus = cpus
+        self.nodes = nodes
+
+    def __repr__(self):
+        return 'Placement(cpus={0!r}, nodes={1!r})'.format(
+            self.cpus, self.nodes)
+
+
+class PlacementEngine(object):
+    """Assigns dedicated CPUs to running tasks.
+
+    A task gets as many physical cores (with all their SMT siblings) as it
+    needs CPUs, so no other task shares its cores. With `smt` each SMT
+    sibling counts as a CPU of its own, but siblings are still given to the
+    same task first. All cores of a task are taken from a single NUMA node
+    if possible, preferring the node with most free cores. Memory of
+    started tasks is preferably allocated on their nodes.
+
+    If not enough cores are free, a task is not restricted. Assign the
+    engine to :attr:`taskpile.core.Taskpile.placement_engine` to use it.
+    """
+
+    def __init__(self, topology=None, smt=False):
+        if topology is None:
+            topology = CpuTopology.from_sysfs()
+        self.topology = topology
+        self.smt = smt
+        self._free = {}
+        for node, cores in topology.nodes.items():
+            if smt:
+                self._free[node] = [(cpu,) for core in cores for cpu in core]
+            else:
+                self._free[node] = list(cores)
+        self._assigned = {}
+        self._unrestrict = set()
+
+    def num_free(self):
+        return sum(len(units) for units in self._free.values())
+
+    def assign(self, task):
+        """Reserves CPUs for `task` and stores them in its ``placement``
+        attribute (``None`` if not enough CPUs are free)."""
+        self.release(task)
+        needed = max(1, int(math.ceil(task.cpus)))
+        if needed > self.num_free():
+            if task.placement is not None:
+                self._unrestrict.add(task)
+            task.placement = None
+            return None
+
+        by_free = sorted(
+            self._free, key=lambda n: (-len(self._free[n]), n))
+        fitting = [n for n in by_free if len(self._free[n]) >= needed]
+        units = []
+        for node in fitting[:1] or by_free:
+            take = min(needed - len(units), len(self._free[node]))
+            units.extend((node, u) for u in self._free[node][:take])
+            del self._free[node][:take]
+            if len(units) >= needed:
+                break
+
+        self._assigned[task] = units
+        task.placement = Placement(
+            sorted(cpu for _, unit in units for cpu in unit),
+            sorted(set(node for node, _ in units)))
+        return task.placement
+
+    def release(self, task):
+        """Frees the CPUs reserved for `task`. The task keeps its last
+        ``placement`` for reference."""
+        self._unrestrict.discard(task)
+        for node, unit in self._assigned.pop(task, ()):
+            self._free[node].append(unit)
+            self._free[node].sort()
+
+    def apply(self, task):
+        """Restricts the running process of `task` and its descendants to
+        its placement."""
+        if task.pid is None:
+            return
+        if task.placement is not None:
+            cpus = task.placement.cpus
+        elif task in self._unrestrict:
+            # Lift the restriction of an earlier placement.
+            self._unrestrict.discard(task)
+            cpus = [cpu for cores in self.topology.nodes.values()
+                    for core in cores for cpu in core]
+        else:
+            return
+        # Processes started by the task inherit the affinity it had at that
+        # time. Tasks continued on other CPUs have to take them along.
+        for pid in iter_process_tree(task.pid):
+            try:
+                set_affinity(pid, cpus)
+            except OSError:
+                pass  # E.g. the process already exited.
@@ -1,8 +1,10 @@
+import re
+import shlex
+
+
 try:
     from shlex import quote as quote_for_shell
 except ImportError:
-    import re
-
     # Code copied from Python 3.3 implementation
     # <http://hg.python.org/cpython/file/2a59428dbff5/Lib/shlex.py>
     # It is licensed under the PSF License Agreement for Python 3.3.2. See
@@ -19,3 +21,49 @@ except ImportError:
         # use single quotes, and put single quotes into double quotes
         # the string $'b is then quoted as '$'"'"'b'
         return "'" + s.replace("'", "'\"'\"'") + "'"
+
+
+_needs_shell = re.compile(
+    r'[|&;<>()$`\\*?\[\]{}~#!\n]|^\s*[A-Za-z_][A-Za-z0-9_]*=').search
+_shell_builtins = frozenset([
+    '.', ':', 'alias', 'break', 'case', 'cd', 'command', 'continue', 'eval',
+    'exec', 'exit', 'export', 'for', 'function', 'getopts', 'hash', 'if',
+    'local', 'read', 'readonly', 'return', 'set', 'shift', 'source', 'times',
+    'trap', 'type', 'ulimit', 'umask', 'unalias', 'unset', 'until', 'wait',
+    'while'])
+
+
+def split_simple_command(command):
+    """Split `command` into an argument list if it can be executed without a
+    shell.
+
+    Returns ``None`` if the command uses shell syntax like pipes, redirection,
+    variable expansion, globbing or shell builtins and thus has to be run by
+    ``/bin/sh``.
+    """
+    if _needs_shell(command) is not None:
+        return None
+    try:
+        args = shlex.split(command)
+    except ValueError:
+        return None
+    if len(args) <= 0 or args[0] in _shell_builtins:
+        return None
+    return args
+
+
+_size_units = {
+    '': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(value):
+    """Converts a size like ``'512M'`` or ``'20G'`` (binary units) into a
+    number of bytes. Plain numbers are bytes."""
+    value = str(value).strip().upper()
+    if value.endswith('B'):
+        value = value[:-1]
+    unit = value[-1:] if value[-1:] in _size_units else ''
+    try:
+        return int(float(value[:len(value) - len(unit)]) * _size_units[unit])
+    except ValueError:
+        raise ValueError('Invalid size {0!r}.'.format(value))
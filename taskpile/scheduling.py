@@ -0,0 +1,261 @@
+from __future__ import absolute_import
+
+from bisect import bisect_left, bisect_right
+from heapq import heappop, heappush
+import itertools
+
+
+class TaskQueue(object):
+    """Ordered set of tasks.
+
+    In contrast to a list, adding and removing tasks at both ends as well as
+    removing an arbitrary task takes constant time.
+    """
+
+    def __init__(self, tasks=()):
+        # Doubly linked list of [prev, next, task] nodes with a sentinel.
+        self._root = root = []
+        root[:] = [root, root, None]
+        self._nodes = {}
+        for task in tasks:
+            self.append(task)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, task):
+        return task in self._nodes
+
+    def __iter__(self):
+        node = self._root[1]
+        while node is not self._root:
+            yield node[2]
+            node = node[1]
+
+    def __reversed__(self):
+        node = self._root[0]
+        while node is not self._root:
+            yield node[2]
+            node = node[0]
+
+    def append(self, task):
+        self._insert_before(self._root, task)
+
+    def appendleft(self, task):
+        self._insert_before(self._root[1], task)
+
+    def _insert_before(self, successor, task):
+        if task in self._nodes:
+            raise ValueError('Task is already in the queue.')
+        predecessor = successor[0]
+        node = [predecessor, successor, task]
+        predecessor[1] = successor[0] = node
+        self._nodes[task] = node
+
+    def remove(self, task):
+        try:
+            predecessor, successor, _ = self._nodes.pop(task)
+        except KeyError:
+            raise ValueError('Task is not in the queue.')
+        predecessor[1] = successor
+        successor[0] = predecessor
+
+    def peek(self):
+        if len(self) <= 0:
+            raise IndexError('Peek into empty queue.')
+        return self._root[1][2]
+
+    def last(self):
+        if len(self) <= 0:
+            raise IndexError('Last task of empty queue.')
+        return self._root[0][2]
+
+    def head(self, n):
+        """Returns a list of the first `n` tasks."""
+        return list(itertools.islice(self, n))
+
+    def next_task(self, task):
+        """Returns the task after `task` or ``None`` if it is the last one.
+        """
+        return self._nodes[task][1][2]
+
+    def prev_task(self, task):
+        """Returns the task before `task` or ``None`` if it is the first
+        one."""
+        return self._nodes[task][0][2]
+
+    def pop(self):
+        if len(self) <= 0:
+            raise IndexError('Pop from empty queue.')
+        task = self._root[0][2]
+        self.remove(task)
+        return task
+
+    def popleft(self):
+        task = self.peek()
+        self.remove(task)
+        return task
+
+
+class FifoPolicy(TaskQueue):
+    """Runs tasks in the order they were added.
+
+    Like all scheduling policies, this is a container of the pending tasks
+    used as :attr:`taskpile.core.Taskpile.pending`. Iterating it yields the
+    tasks in the order they will be run.
+    """
+
+
+_REMOVED = object()
+
+
+class HeapPolicy(object):
+    """Base class of policies running the task with the smallest
+    :meth:`key` first.
+
+    Tasks with equal keys are run in the order they were added. Tasks put
+    back with :meth:`appendleft` come before other tasks with an equal key.
+    Adding and removing tasks takes logarithmic time.
+    """
+
+    def __init__(self, tasks=()):
+        self._heap = []
+        self._entries = {}
+        self._back_seq = itertools.count()
+        self._front_seq = itertools.count(-1, -1)
+        # Sorted copy of the heap for iteration, rebuilt after tasks were
+        # added. Removed tasks are skipped lazily.
+        self._ordered = None
+        self._ordered_start = 0
+        for task in tasks:
+            self.append(task)
+
+    def key(self, task):
+        raise NotImplementedError()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, task):
+        return task in self._entries
+
+    def _ordered_entries(self):
+        if self._ordered is None:
+            self._ordered = sorted(
+                e for e in self._heap if e[2] is not _REMOVED)
+            self._ordered_start = 0
+        return self._ordered
+
+    def __iter__(self):
+        for entry in itertools.islice(
+                self._ordered_entries(), self._ordered_start, None):
+            if entry[2] is not _REMOVED:
+                yield entry[2]
+
+    def head(self, n):
+        """Returns a list of the first `n` tasks. Takes O(`n` log `n`) time
+        (plus the number of removed tasks in between), even if tasks were
+        added since iterating the queue."""
+        # The smallest entries are found by walking the heap from the root,
+        # always expanding the smallest entry seen so far.
+        tasks = []
+        candidates = [(self._heap[0], 0)] if len(self._heap) > 0 else []
+        while len(candidates) > 0 and len(tasks) < n:
+            entry, index = heappop(candidates)
+            if entry[2] is not _REMOVED:
+                tasks.append(entry[2])
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(self._heap):
+                    heappush(candidates, (self._heap[child], child))
+        return tasks
+
+    def last(self):
+        task = self._step(len(self._ordered_entries()), -1)
+        if task is None:
+            raise IndexError('Last task of empty queue.')
+        return task
+
+    def next_task(self, task):
+        """Returns the task after `task` or ``None`` if it is the last one.
+        Takes logarithmic time unless tasks were added since the last call.
+        """
+        return self._step(bisect_right(
+            self._ordered_entries(), self._entries[task]), 1)
+
+    def prev_task(self, task):
+        """Returns the task before `task` or ``None`` if it is the first
+        one."""
+        return self._step(bisect_left(
+            self._ordered_entries(), self._entries[task]), -1)
+
+    def _step(self, index, direction):
+        """Returns the first task from `index` (exclusive if `direction` is
+        negative) on in `direction` or ``None``."""
+        if direction < 0:
+            index -= 1
+        while self._ordered_start <= index < len(self._ordered):
+            task = self._ordered[index][2]
+            if task is not _REMOVED:
+                return task
+            index += direction
+        return None
+
+    def append(self, task):
+        self._push(task, next(self._back_seq))
+
+    def appendleft(self, task):
+        self._push(task, next(self._front_seq))
+
+    def _push(self, task, seq):
+        if task in self._entries:
+            raise ValueError('Task is already in the queue.')
+        entry = [self.key(task), seq, task]
+        self._entries[task] = entry
+        heappush(self._heap, entry)
+        self._ordered = None
+
+    def remove(self, task):
+        try:
+            entry = self._entries.pop(task)
+        except KeyError:
+            raise ValueError('Task is not in the queue.')
+        entry[2] = _REMOVED
+
+    def peek(self):
+        while len(self._heap) > 0 and self._heap[0][2] is _REMOVED:
+            heappop(self._heap)
+        if len(self._heap) <= 0:
+            raise IndexError('Peek into empty queue.')
+        return self._heap[0][2]
+
+    def popleft(self):
+        task = self.peek()
+        entry = heappop(self._heap)
+        del self._entries[task]
+        if self._ordered is not None and \
+                self._ordered_start < len(self._ordered) and \
+                self._ordered[self._ordered_start] is entry:
+            self._ordered_start += 1
+        else:
+            self._ordered = None
+        return task
+
+
+class PriorityPolicy(HeapPolicy):
+    """Runs tasks with a higher ``priority`` first."""
+
+    def key(self, task):
+        return -task.priority
+
+
+class ShortestJobFirstPolicy(HeapPolicy):
+    """Runs tasks with a shorter ``expected_runtime`` first.
+
+    The priority of tasks still takes precedence. Tasks without an expected
+    runtime are run after all tasks with one.
+    """
+
+    def key(self, task):
+        if task.expected_runtime is None:
+            return (-task.priority, float('inf'))
+        return (-task.priority, task.expected_runtime)
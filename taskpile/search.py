@@ -0,0 +1,197 @@
+"""Regular expression search in the output of tasks."""
+
+from __future__ import absolute_import
+
+from array import array
+import re
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from taskpile.capture import open_output, output_signature
+
+
+_WINDOW_SIZE = 16 * 1024 * 1024
+
+
+def compile_pattern(pattern):
+    """Compiles a search pattern. ``^`` and ``$`` match at line boundaries.
+    """
+    if not isinstance(pattern, bytes):
+        pattern = pattern.encode('utf-8')
+    return re.compile(pattern, re.MULTILINE)
+
+
+def iter_matching_lines(data, regex, start=0):
+    """Yields arrays with the offsets of the lines in `data` (from `start` on)
+    containing a match of `regex`.
+
+    `data` is searched in windows of whole lines and an array is yielded for
+    each window, so hits are available before all of `data` was searched.
+    """
+    end = len(data)
+    pos = start
+    while pos < end:
+        window_end = data.find(b'\n', min(pos + _WINDOW_SIZE, end) - 1)
+        window_end = end if window_end < 0 else window_end + 1
+        offsets = array('L')
+        for match in regex.finditer(data, pos, window_end):
+            line = data.rfind(b'\n', 0, match.start()) + 1
+            if len(offsets) <= 0 or offsets[-1] != line:
+                offsets.append(line)
+        yield offsets
+        pos = window_end
+
+
+def _iter_line_chunks(f, start=0):
+    """Yields ``(offset, data)`` tuples with chunks of whole lines read from
+    file `f` from `start` on. The last chunk might end with an incomplete
+    line."""
+    f.seek(start)
+    offset = start
+    partial = b''
+    while True:
+        chunk = f.read(_WINDOW_SIZE)
+        if not chunk:
+            if partial:
+                yield offset, partial
+            return
+        data = partial + chunk
+        end = data.rfind(b'\n') + 1
+        if end <= 0:
+            partial = data
+            continue
+        partial = data[end:]
+        yield offset, data[:end]
+        offset += end
+
+
+class SearchCache(object):
+    """Searches task outputs and caches the offsets of the matching lines.
+
+    Results are keyed on the pattern and the signature of the output (see
+    :func:`taskpile.capture.output_signature`), i.e. on the size and
+    modification time of its files. Searching outputs of finished tasks
+    again returns the cached results. If output was only appended since
+    the last search, only the new output is searched.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+
+    def search(self, filename, regex, cancelled=lambda: False):
+        """Yields arrays with the offsets of the lines of output `filename`
+        (as read with :func:`taskpile.capture.open_output`) matching
+        `regex`. The search stops early if `cancelled()` returns ``True``.
+        """
+        key = (filename, regex.pattern, regex.flags)
+        signature = output_signature(filename)
+        with self._lock:
+            cached = self._results.get(key)
+        if cached is not None and cached[0] == signature:
+            yield cached[2]
+            return
+
+        start = 0
+        offsets = array('L')
+        if cached is not None and self._extends(cached[0], signature):
+            start = cached[1]
+            offsets.extend(cached[2])
+            yield cached[2]
+
+        # The output is read rather than mapped: rotation truncates the
+        # output file of a running task, and accessing a mapping beyond the
+        # end of a truncated file raises SIGBUS.
+        searched = start
+        f = open_output(filename)
+        try:
+            for base, data in _iter_line_chunks(f, start):
+                for batch in iter_matching_lines(data, regex):
+                    if cancelled():
+                        return
+                    if base > 0:
+                        batch = array('L', (base + x for x in batch))
+                    offsets.extend(batch)
+                    yield batch
+                # The last line might still be written to. Search it again
+                # next time.
+                if data.endswith(b'\n'):
+                    searched = base + len(data)
+        finally:
+            f.close()
+        if len(offsets) > 0 and offsets[-1] >= searched:
+            offsets.pop()
+        with self._lock:
+            self._results[key] = (signature, searched, offsets)
+
+    @staticmethod
+    def _extends(old, new):
+        """Returns whether output with signature `new` equals the output with
+        signature `old` with output appended."""
+        old_segments, old_output = old
+        new_segments, new_output = new
+        return old_segments == new_segments and old_output is not None and \
+            new_output is not None and old_output[0] == new_output[0] and \
+            old_output[1] <= new_output[1]
+
+    def clear(self):
+        with self._lock:
+            self._results = {}
+
+
+search_cache = SearchCache()
+
+
+class BackgroundSearch(object):
+    """Searches the outputs `filenames` for compiled `regex` in a background
+    thread.
+
+    Results are put into the queue `results` as ``(filename, offsets)``
+    tuples as they are found, `offsets` being an array of offsets of
+    matching lines. A ``(None, None)`` tuple marks the end of the search.
+    `notify` is called after each put, e.g. to wake up an event loop.
+    """
+
+    def __init__(self, filenames, regex, cache=None, notify=None):
+        self.regex = regex
+        self.cache = search_cache if cache is None else cache
+        self.results = queue.Queue()
+        self._filenames = list(filenames)
+        self._notify = notify
+        self._cancelled = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, filename, offsets):
+        self.results.put((filename, offsets))
+        if self._notify is not None:
+            self._notify()
+
+    def _run(self):
+        try:
+            for filename in self._filenames:
+                if self._cancelled:
+                    break
+                try:
+                    for offsets in self.cache.search(
+                            filename, self.regex, self.is_cancelled):
+                        if len(offsets) > 0:
+                            self._put(filename, offsets)
+                except (IOError, OSError):
+                    pass  # Output removed meanwhile.
+        finally:
+            self._put(None, None)
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        self._cancelled = True
+
+    def join(self):
+        self._thread.join()
@@ -0,0 +1,227 @@
+from __future__ import absolute_import
+
+import errno
+import json
+import os
+import socket
+
+from taskpile.core import ExternalTask, SpecTaskSource, State, \
+    TaskpileListener
+
+
+state_names = {
+    State.PENDING: 'pending',
+    State.RUNNING: 'running',
+    State.FINISHED: 'finished',
+    State.STOPPED: 'stopped'
+}
+
+
+class ServerError(Exception):
+    pass
+
+
+def bind_unix_socket(path):
+    """Creates a listening Unix socket at `path`.
+
+    A socket file left behind by a dead server is replaced. Raises
+    :class:`ServerError` if another server is listening at `path`.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+    except socket.error as err:
+        if err.errno != errno.EADDRINUSE:
+            raise
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error:
+            os.unlink(path)
+            sock.bind(path)
+        else:
+            raise ServerError(
+                'Another taskpile is listening at {0}.'.format(path))
+        finally:
+            probe.close()
+    os.chmod(path, 0o600)
+    sock.listen(16)
+    return sock
+
+
+class _Connection(object):
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.buffer = b''
+        self.watch = server.event_loop.watch_file(
+            sock.fileno(), self.on_readable)
+
+    def on_readable(self):
+        try:
+            data = self.sock.recv(65536)
+        except socket.error:
+            data = b''
+        if len(data) <= 0:
+            self.close()
+            return
+        self.buffer += data
+        while b'\n' in self.buffer:
+            line, self.buffer = self.buffer.split(b'\n', 1)
+            response = self.server.handle_request(line)
+            try:
+                self.sock.sendall(json.dumps(response).encode() + b'\n')
+            except socket.error:
+                self.close()
+                return
+
+    def close(self):
+        self.server.event_loop.remove_watch_file(self.watch)
+        self.sock.close()
+        self.server.connections.discard(self)
+
+
+class TaskpileServer(TaskpileListener):
+    """Makes a taskpile accessible to :mod:`taskpile.client` over a Unix
+    socket.
+
+    Requests and responses are JSON objects, one per line. A request names
+    the command in ``cmd``; a response contains either the result or an
+    ``error`` message.
+
+    The server does not block. It registers its sockets with `event_loop`,
+    which has to provide ``watch_file`` and ``remove_watch_file`` like
+    ``urwid.MainLoop``. After a request changed the taskpile, the taskpile is
+    updated and `on_change` is called. The ``stop`` command calls `on_stop`
+    and is refused if `on_stop` is ``None``.
+    """
+
+    def __init__(
+            self, taskpile, path, event_loop, on_change=None, on_stop=None):
+        self.taskpile = taskpile
+        self.path = path
+        self.event_loop = event_loop
+        self.on_change = on_change
+        self.on_stop = on_stop
+        self.connections = set()
+        self._tasks = {}
+        self._ids = {}
+        self._next_id = 0
+        for task in self._iter_tasks():
+            self.on_enqueued(task)
+        taskpile.listeners.append(self)
+
+        self._socket = bind_unix_socket(path)
+        self._watch = event_loop.watch_file(
+            self._socket.fileno(), self._accept)
+
+    def _iter_tasks(self):
+        for task in self.taskpile.running:
+            yield task
+        for task in self.taskpile.pending:
+            yield task
+        for task in self.taskpile.finished:
+            yield task
+
+    def on_enqueued(self, task):
+        self._tasks[self._next_id] = task
+        self._ids[task] = self._next_id
+        self._next_id += 1
+
+    def on_archived(self, task, summary):
+        task_id = self._ids.pop(task)
+        self._ids[summary] = task_id
+        self._tasks[task_id] = summary
+
+    def _accept(self):
+        try:
+            sock, _ = self._socket.accept()
+        except socket.error:
+            return
+        self.connections.add(_Connection(self, sock))
+
+    def close(self):
+        for connection in list(self.connections):
+            connection.close()
+        self.event_loop.remove_watch_file(self._watch)
+        self._socket.close()
+        os.unlink(self.path)
+        self.taskpile.listeners.remove(self)
+
+    def handle_request(self, line):
+        try:
+            request = json.loads(line.decode())
+            cmd = request.pop('cmd')
+            handler = getattr(self, '_cmd_' + cmd, None)
+            if handler is None:
+                raise ServerError('Unknown command {0!r}.'.format(cmd))
+            return handler(**request)
+        except Exception as err:
+            return {'error': str(err) or type(err).__name__}
+
+    def _changed(self):
+        self.taskpile.update()
+        if self.on_change is not None:
+            self.on_change()
+
+    def _cmd_submit(self, tasks):
+        ids = []
+        for kwargs in tasks:
+            task = ExternalTask(**kwargs)
+            self.taskpile.enqueue(task)
+            ids.append(self._ids[task])
+        self._changed()
+        return {'ids': ids}
+
+    def _cmd_submit_spec(
+            self, filename, start_repeat=0, num_repeats=1, niceness=0,
+            priority=0, cwd=None):
+        source = SpecTaskSource(
+            filename, start_repeat, num_repeats, niceness, priority, cwd)
+        self.taskpile.add_source(source)
+        self._changed()
+        return {'count': source.total}
+
+    def _cmd_list(self):
+        return {'tasks': [{
+            'id': self._ids[task],
+            'name': task.name,
+            'command': getattr(task, 'command', None),
+            'state': state_names[task.state],
+            'pid': task.pid,
+            'priority': task.priority,
+            'exitcode': task.exitcode,
+            'exitsignal': task.exitsignal,
+            'outbuf_name': getattr(task, 'outbuf_name', None),
+            'errbuf_name': getattr(task, 'errbuf_name', None)
+        } for task in self._iter_tasks()]}
+
+    def _get_task(self, task_id):
+        try:
+            return self._tasks[task_id]
+        except KeyError:
+            raise ServerError('No task with id {0}.'.format(task_id))
+
+    def _cmd_kill(self, ids):
+        for task in [self._get_task(task_id) for task_id in ids]:
+            if task.state != State.FINISHED:
+                self.taskpile.terminate(task)
+        self._changed()
+        return {}
+
+    def _cmd_set_max_parallel(self, value):
+        if value < 0:
+            raise ServerError('Maximum number of parallel tasks must not be '
+                              'negative.')
+        if self.taskpile.controller is not None:
+            self.taskpile.controller.max_parallel = value
+        else:
+            self.taskpile.max_parallel = value
+        self._changed()
+        return {}
+
+    def _cmd_stop(self):
+        if self.on_stop is None:
+            raise ServerError('This taskpile cannot be stopped remotely.')
+        self.on_stop()
+        return {}
@@ -1,4 +1,4 @@
-import itertools
+import bisect
 import string
 from StringIO import StringIO
 
@@ -27,15 +27,41 @@ class TaskSpecCmdFormatter(string.Formatter):
                 value, conversion)
 
 
+class _SpecNode(object):
+    """Number of specs generated by a section of a task group spec and by
+    each of its subsections."""
+
+    def __init__(self, spec, split):
+        value_lists, spec_gens = split(spec)
+        self.keys = list(value_lists.keys())
+        self.value_lists = [value_lists[k] for k in self.keys]
+        self.children = [(name, _SpecNode(gen, split))
+                         for name, gen in spec_gens]
+        self.offsets = []
+        num_subspecs = 0
+        for name, child in self.children:
+            self.offsets.append(num_subspecs)
+            num_subspecs += child.count
+        self.num_subspecs = num_subspecs if len(self.children) > 0 else 1
+        self.count = self.num_subspecs
+        for values in self.value_lists:
+            self.count *= len(values)
+
+
 class TaskGroupSpec(object):
     CMD_KEY = '__cmd__'
     NAME_KEY = '__name__'
     REPEAT_KEY = '__repeat__'
+    PRIORITY_KEY = '__priority__'
+    RUNTIME_KEY = '__runtime__'
+    MEMORY_KEY = '__mem__'
+    CPUS_KEY = '__cpus__'
 
     __cmd_formatter = TaskSpecCmdFormatter()
 
     def __init__(self, group_spec):
         self.group_spec = group_spec
+        self._root_node = None
 
     @classmethod
     def from_spec_str(cls, spec_str):
@@ -45,30 +71,71 @@ class TaskGroupSpec(object):
     def from_spec_file(cls, filename):
         return cls(ConfigObj(filename, interpolation=False))
 
-    def iter_specs(self, start_repeat, num_repeats):
-        for repeat in xrange(start_repeat, num_repeats):
-            for spec in self._iter_subspecs(self.group_spec):
-                spec[self.REPEAT_KEY] = repeat
-                spec[self.CMD_KEY] = self.__cmd_formatter.format(
-                    spec[self.CMD_KEY], **spec)
-                yield spec
-
-    def _iter_subspecs(self, spec):
-        value_lists, spec_gens = self._split_into_value_lists_and_spec_gens(
-            spec)
-
-        for value_set in itertools.product(*value_lists.values()):
-            base = {self.NAME_KEY: ''}
-            for key, value in zip(value_lists.keys(), value_set):
-                base[key] = value
-
-                if len(value_lists[key]) > 1:
-                    if len(base[self.NAME_KEY]) > 0:
-                        base[self.NAME_KEY] += ' '
-                    base[self.NAME_KEY] += '{0}={1}'.format(key, value)
-
-            for merged in self._iter_merged_with_spec_gens(base, spec_gens):
-                yield merged
+    def __len__(self):
+        return len(self.specs())
+
+    def __getitem__(self, index):
+        return self.specs()[index]
+
+    def specs(self, start_repeat=0, num_repeats=1):
+        """Returns a :class:`TaskSpecSequence` of the specs for the repeats
+        from `start_repeat` up to (excluding) `num_repeats`."""
+        return TaskSpecSequence(self, start_repeat, num_repeats)
+
+    def iter_specs(self, start_repeat=0, num_repeats=1):
+        return iter(self.specs(start_repeat, num_repeats))
+
+    def count_specs(self, start_repeat, num_repeats):
+        """Returns the number of specs :meth:`iter_specs` would yield without
+        generating them."""
+        return len(self.specs(start_repeat, num_repeats))
+
+    def get_spec(self, repeat, index):
+        """Returns the spec with `index` of a single repeat."""
+        spec = self._get_subspec(self._root, index)
+        spec[self.REPEAT_KEY] = repeat
+        spec[self.CMD_KEY] = self.__cmd_formatter.format(
+            spec[self.CMD_KEY], **spec)
+        return spec
+
+    @property
+    def num_specs_per_repeat(self):
+        return self._root.count
+
+    @property
+    def _root(self):
+        if self._root_node is None:
+            self._root_node = _SpecNode(
+                self.group_spec, self._split_into_value_lists_and_spec_gens)
+        return self._root_node
+
+    def _get_subspec(self, node, index):
+        value_index, subspec_index = divmod(index, node.num_subspecs)
+        # The last value list varies fastest like in itertools.product.
+        value_set = [None] * len(node.value_lists)
+        for i in reversed(range(len(node.value_lists))):
+            value_index, value_set[i] = divmod(
+                value_index, len(node.value_lists[i]))
+
+        base = {self.NAME_KEY: ''}
+        for key, values, i in zip(node.keys, node.value_lists, value_set):
+            base[key] = values[i]
+
+            if len(values) > 1:
+                if len(base[self.NAME_KEY]) > 0:
+                    base[self.NAME_KEY] += ' '
+                base[self.NAME_KEY] += '{0}={1}'.format(key, values[i])
+
+        if len(node.children) <= 0:
+            return base
+        child = bisect.bisect_right(node.offsets, subspec_index) - 1
+        name, gen = node.children[child]
+        merged = base.copy()
+        merged.update(self._get_subspec(
+            gen, subspec_index - node.offsets[child]))
+        merged[self.NAME_KEY] = '{0}_{1}_{2}'.format(
+            base[self.NAME_KEY], name, merged[self.NAME_KEY])
+        return merged
 
     def _split_into_value_lists_and_spec_gens(self, spec):
         value_lists = {}
@@ -82,14 +149,46 @@ class TaskGroupSpec(object):
                 value_lists[k] = [v]
         return value_lists, spec_gens
 
-    def _iter_merged_with_spec_gens(self, base, spec_gens):
-        if len(spec_gens) <= 0:
-            yield base
-        else:
-            for name, gen in spec_gens:
-                for spec in self._iter_subspecs(gen):
-                    merged = base.copy()
-                    merged.update(spec)
-                    merged[self.NAME_KEY] = '{0}_{1}_{2}'.format(
-                        base[self.NAME_KEY], name, merged[self.NAME_KEY])
-                    yield merged
+
+class TaskSpecSequence(object):
+    """Read-only sequence of the task specs of a :class:`TaskGroupSpec` for
+    a range of repeats.
+
+    The spec at an index is computed from the index without generating the
+    preceding specs. Slicing returns another :class:`TaskSpecSequence`,
+    which allows to split large parameter sweeps into shards.
+    """
+
+    def __init__(
+            self, group_spec, start_repeat=0, num_repeats=1, _range=None):
+        self.group_spec = group_spec
+        self.start_repeat = start_repeat
+        self.num_repeats = num_repeats
+        if _range is None:
+            _range = (0, 1, max(0, num_repeats - start_repeat) *
+                      group_spec.num_specs_per_repeat)
+        self._start, self._step, self._len = _range
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for i in xrange(self._len):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            length = len(xrange(start, stop, step))
+            return TaskSpecSequence(
+                self.group_spec, self.start_repeat, self.num_repeats, (
+                    self._start + start * self._step, self._step * step,
+                    length))
+        if index < 0:
+            index += self._len
+        if index < 0 or index >= self._len:
+            raise IndexError('Task spec index out of range.')
+        repeat, index = divmod(
+            self._start + index * self._step,
+            self.group_spec.num_specs_per_repeat)
+        return self.group_spec.get_spec(self.start_repeat + repeat, index)
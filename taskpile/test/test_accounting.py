@@ -0,0 +1,61 @@
+import os
+import signal
+import time
+
+from hamcrest import assert_that, contains_inanyorder, greater_than, \
+    has_properties, is_, is_not
+
+from taskpile.accounting import get_usage, iter_process_tree, \
+    ResourceSampler, sample_process_tree
+from taskpile.core import ExternalTask, Taskpile
+
+
+def _wait_for_children(pid, num):
+    for i in range(100):
+        pids = list(iter_process_tree(pid))
+        if len(pids) >= num + 1:
+            return pids
+        time.sleep(0.01)
+    return pids
+
+
+class TestAccounting(object):
+    def setUp(self):
+        self.task = ExternalTask('sleep 10 & sleep 10 & wait')
+        self.task.start()
+
+    def tearDown(self):
+        for pid in iter_process_tree(self.task.pid):
+            os.kill(pid, signal.SIGTERM)
+        self.task.join()
+
+    def test_finds_descendants(self):
+        pids = _wait_for_children(self.task.pid, 2)
+        assert_that(pids, contains_inanyorder(
+            self.task.pid, is_not(self.task.pid), is_not(self.task.pid)))
+
+    def test_samples_process_tree(self):
+        _wait_for_children(self.task.pid, 2)
+        first = sample_process_tree(self.task.pid)
+        assert_that(first.rss, greater_than(0))
+        assert_that(first.cpu_percent, is_(None))
+        second = sample_process_tree(self.task.pid, first)
+        assert_that(second.cpu_percent, greater_than(-1))
+
+    def test_sampler_sets_usage_of_running_tasks(self):
+        _wait_for_children(self.task.pid, 2)
+        taskpile = Taskpile()
+        taskpile.running.append(self.task)
+        sampler = ResourceSampler(taskpile, interval=0)
+        taskpile.update()
+        sampler.close()
+        assert_that(self.task.usage.rss, greater_than(0))
+
+
+def test_stores_rusage_of_finished_task():
+    task = ExternalTask('i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done')
+    task.start()
+    task.join()
+    assert_that(task.rusage, is_not(None))
+    assert_that(get_usage(task), has_properties(
+        cpu_time=greater_than(0), rss=greater_than(0)))
@@ -0,0 +1,87 @@
+import time
+
+from hamcrest import all_of, assert_that, contains, \
+    greater_than_or_equal_to, has_property, instance_of, is_
+try:
+    from unittest.mock import MagicMock
+except:
+    from mock import MagicMock
+
+from taskpile.archive import load_details, TaskArchive, TaskSummary
+from taskpile.core import ExternalTask, State, Taskpile, TaskpileListener
+
+
+def run_to_completion(taskpile, task):
+    taskpile.enqueue(task)
+    taskpile.update()
+    while len(taskpile.finished) <= 0:
+        time.sleep(0.01)
+        taskpile.update()
+
+
+class TestTaskArchive(object):
+    def setUp(self):
+        self.archive = TaskArchive()
+        self.taskpile = Taskpile(max_parallel=1)
+        self.taskpile.set_archive(self.archive)
+
+    def tearDown(self):
+        self.archive.close()
+
+    def test_replaces_finished_tasks_by_summaries(self):
+        run_to_completion(self.taskpile, ExternalTask('exit 3', 'name'))
+        assert_that(self.taskpile.finished, contains(all_of(
+            instance_of(TaskSummary),
+            has_property('name', 'name'),
+            has_property('exitcode', 3),
+            has_property('state', State.FINISHED))))
+        assert_that(self.taskpile.finished[0].usage, has_property(
+            'cpu_time', instance_of(float)))
+
+    def test_keeps_command_and_times_in_summaries(self):
+        before = time.time()
+        run_to_completion(self.taskpile, ExternalTask('sleep 0.05'))
+        summary = self.taskpile.finished[0]
+        assert_that(summary.command, is_('sleep 0.05'))
+        assert_that(summary.started_at, greater_than_or_equal_to(before))
+        assert_that(summary.runtime, greater_than_or_equal_to(0.05))
+        assert_that(load_details(summary), has_property(
+            'finished_at', summary.finished_at))
+
+    def test_loads_details_of_archived_tasks(self):
+        run_to_completion(self.taskpile, ExternalTask(
+            'exit 3', original_files={'/tmp/copy': 'original'}, niceness=5))
+        task = load_details(self.taskpile.finished[0])
+        assert_that(task, all_of(
+            has_property('command', 'exit 3'),
+            has_property('original_files', {'/tmp/copy': 'original'}),
+            has_property('niceness', 5),
+            has_property('exitcode', 3),
+            has_property('state', State.FINISHED)))
+        assert_that(task.poll(), is_(True))
+
+    def test_keeps_unrendered_command_of_templated_tasks(self):
+        task = ExternalTask('true', template_spec={'x': '1'})
+        task.render_templates()
+        run_to_completion(self.taskpile, task)
+        assert_that(load_details(self.taskpile.finished[0]), all_of(
+            has_property('unrendered_command', 'true'),
+            has_property('template_spec', {'x': '1'})))
+
+    def test_notifies_listeners_of_archived_tasks(self):
+        listener = MagicMock(spec=TaskpileListener)
+        self.taskpile.listeners.append(listener)
+        task = ExternalTask('true')
+        self.taskpile.enqueue(task)
+        self.taskpile.terminate(task)
+        listener.on_finished.assert_called_once_with(task)
+        listener.on_archived.assert_called_once_with(
+            task, self.taskpile.finished[0])
+
+    def test_archives_tasks_finished_before_set(self):
+        taskpile = Taskpile(max_parallel=1)
+        task = ExternalTask('true')
+        taskpile.enqueue(task)
+        taskpile.terminate(task)
+        taskpile.set_archive(self.archive)
+        assert_that(taskpile.finished, contains(instance_of(TaskSummary)))
@@ -0,0 +1,134 @@
+import os
+import os.path
+import shutil
+import tempfile
+
+from hamcrest import assert_that, contains, ends_with, is_, starts_with
+
+from matcher import file_with_content
+from taskpile.capture import GZIP, open_output, OutputCapture, \
+    OutputFollower, remove_output, _segments
+from taskpile.core import ExternalTask, Taskpile
+
+
+class TestOutputCapture(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'out')
+        self.taskpile = Taskpile()
+        self.capture = OutputCapture(
+            self.taskpile, max_bytes=40, segment_bytes=10, compression=GZIP,
+            min_compress_bytes=0)
+
+    def tearDown(self):
+        self.capture.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _append(self, data):
+        with open(self.filename, 'ab') as f:
+            f.write(data)
+
+    def _read(self):
+        f = open_output(self.filename)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def test_does_not_rotate_small_outputs(self):
+        self._append(b'1234\n')
+        self.capture.rotate(self.filename)
+        self._append(b'abc\n')
+        self.capture.rotate(self.filename)
+        assert_that(_segments(self.filename), contains())
+        assert_that(self._read(), is_(b'1234\nabc\n'))
+
+    def test_rotated_output_reads_like_the_original(self):
+        self._append(b'0123456789\n')
+        self.capture.rotate(self.filename)
+        self._append(b'abc\n')
+        assert_that(os.path.getsize(self.filename), is_(4))
+        assert_that(self._read(), is_(b'0123456789\nabc\n'))
+
+    def test_compresses_segments_in_the_background(self):
+        self._append(b'0123456789\n')
+        self.capture.rotate(self.filename)
+        self.capture.close()
+        self.capture = OutputCapture(self.taskpile)
+        assert_that(_segments(self.filename), contains(contains(
+            0, ends_with('.' + GZIP))))
+        assert_that(self._read(), is_(b'0123456789\n'))
+
+    def test_keeps_head_and_tail_of_output(self):
+        for i in range(10):
+            self._append('line{0:05d}\n'.format(i).encode())
+            self.capture.rotate(self.filename)
+        assert_that(len(_segments(self.filename)), is_(3))
+        assert_that(self._read(), is_(
+            b'line00000\n[taskpile: 70 bytes of output dropped]\n'
+            b'line00008\nline00009\n'))
+
+    def test_follower_adds_appended_and_rotated_output(self):
+        self._append(b'1234\n')
+        follower = OutputFollower(self.filename)
+        try:
+            self._append(b'abc\n')
+            assert_that(follower.update(), is_(True))
+            follower.file.seek(0)
+            assert_that(follower.file.read(), is_(b'1234\nabc\n'))
+
+            self._append(b'def\n')
+            self.capture.rotate(self.filename)
+            self._append(b'ghi\n')
+            assert_that(follower.update(), is_(False))
+            self._append(b'jkl\n')
+            assert_that(follower.update(), is_(True))
+            follower.file.seek(0)
+            assert_that(
+                follower.file.read(), is_(b'1234\nabc\ndef\nghi\njkl\n'))
+        finally:
+            follower.close()
+
+    def test_compresses_output_of_finished_tasks(self):
+        self.capture.min_compress_bytes = 1
+        task = ExternalTask('echo out; echo err >&2')
+        task.start()
+        task.join()
+        self.capture.on_finished(task)
+        self.capture.close()
+        self.capture = OutputCapture(self.taskpile)
+        assert_that(os.path.exists(task.outbuf_name), is_(False))
+        assert_that(
+            _segments(task.outbuf_name)[0][1], ends_with('.' + GZIP))
+        self.filename = task.errbuf_name
+        assert_that(self._read(), is_(b'err\n'))
+        remove_output(task.outbuf_name)
+        remove_output(task.errbuf_name)
+        assert_that(_segments(task.outbuf_name), contains())
+
+    def test_keeps_output_of_finished_tasks_uncompressed_without_cap(self):
+        self.capture.close()
+        self.capture = OutputCapture(self.taskpile, min_compress_bytes=0)
+        task = ExternalTask('echo out')
+        task.start()
+        task.join()
+        self.capture.on_finished(task)
+        self.capture.close()
+        self.capture = OutputCapture(self.taskpile)
+        assert_that(_segments(task.outbuf_name), contains())
+        assert_that(task.outbuf_name, is_(file_with_content(b'out\n')))
+        remove_output(task.outbuf_name)
+        remove_output(task.errbuf_name)
+
+    def test_tasks_append_to_truncated_output(self):
+        task = ExternalTask('echo 0123456789; sleep 0.2; echo abc')
+        task.start()
+        self.filename = task.outbuf_name
+        while os.path.getsize(self.filename) < 11:
+            pass
+        self.capture.rotate(self.filename)
+        task.join()
+        assert_that(os.path.getsize(self.filename), is_(4))
+        assert_that(self._read(), starts_with(b'0123456789\nabc'))
+        remove_output(task.outbuf_name)
+        remove_output(task.errbuf_name)
@@ -0,0 +1,193 @@
+import os
+import os.path
+import shutil
+import tempfile
+import time
+
+from hamcrest import all_of, assert_that, contains, has_property, is_, \
+    is_not
+from nose.tools import raises
+
+from taskpile.core import ExternalTask, SpecTaskSource, State, Taskpile
+from taskpile.journal import AdoptedTask, Journal, JournalLockedError
+
+
+class TestJournal(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _restore(self, max_parallel=0):
+        taskpile = Taskpile(max_parallel=max_parallel)
+        journal = Journal(self.filename)
+        journal.restore(taskpile)
+        return taskpile, journal
+
+    def test_restores_pending_tasks(self):
+        taskpile, journal = self._restore()
+        taskpile.enqueue(ExternalTask('cmd0', 'name0', priority=2))
+        taskpile.enqueue(ExternalTask('cmd1', expected_runtime=3.))
+        taskpile.update()
+        journal.close()
+
+        taskpile, journal = self._restore()
+        journal.close()
+        assert_that(taskpile.pending, contains(
+            all_of(
+                has_property('command', 'cmd0'),
+                has_property('name', 'name0'),
+                has_property('priority', 2),
+                has_property('state', State.PENDING)),
+            all_of(
+                has_property('command', 'cmd1'),
+                has_property('expected_runtime', 3.))))
+
+    def test_restores_unrendered_template_spec(self):
+        spec = {'__cmd__': 'cat {t!t}', 't': '/some/template', 'x': ['1']}
+        taskpile, journal = self._restore()
+        taskpile.enqueue(ExternalTask.from_task_spec(spec))
+        taskpile.update()
+        journal.close()
+
+        taskpile, journal = self._restore()
+        journal.close()
+        assert_that(taskpile.pending, contains(all_of(
+            has_property('command', 'cat {t!t}'),
+            has_property('template_spec', spec))))
+
+    def test_keeps_unrendered_command_of_started_tasks(self):
+        template = os.path.join(self.tmpdir, 'template')
+        with open(template, 'w') as f:
+            f.write('{x}\n')
+        spec = {'__cmd__': 'cat {t!t}', 't': template, 'x': '1'}
+        taskpile, journal = self._restore(max_parallel=1)
+        taskpile.enqueue(ExternalTask.from_task_spec(spec))
+        taskpile.update()
+        while len(taskpile.finished) <= 0:
+            time.sleep(0.01)
+            taskpile.update()
+        journal.close()
+
+        taskpile, journal = self._restore()
+        journal.close()
+        assert_that(taskpile.finished, contains(all_of(
+            has_property('command', is_not('cat {t!t}')),
+            has_property('unrendered_command', 'cat {t!t}'),
+            has_property('template_spec', spec))))
+
+    def test_does_not_rerun_finished_tasks(self):
+        taskpile, journal = self._restore(max_parallel=1)
+        taskpile.enqueue(ExternalTask('exit 3'))
+        taskpile.update()
+        while len(taskpile.finished) <= 0:
+            time.sleep(0.01)
+            taskpile.update()
+        journal.close()
+
+        taskpile, journal = self._restore()
+        journal.close()
+        assert_that(taskpile.pending, contains())
+        assert_that(taskpile.finished, contains(all_of(
+            has_property('command', 'exit 3'),
+            has_property('exitcode', 3),
+            has_property('state', State.FINISHED))))
+
+    def test_adopts_still_running_tasks(self):
+        taskpile, journal = self._restore(max_parallel=1)
+        task = ExternalTask('sleep 10')
+        taskpile.enqueue(task)
+        taskpile.update()
+        journal.close()
+
+        try:
+            restored, journal = self._restore(max_parallel=1)
+            assert_that(restored.running, contains(all_of(
+                is_(AdoptedTask), has_property('pid', task.pid))))
+            adopted = restored.running.peek()
+            assert_that(adopted.poll(), is_(False))
+            restored.terminate(adopted)
+            task.join()
+            restored.update()
+            assert_that(restored.finished, contains(adopted))
+            journal.close()
+        finally:
+            task.terminate()
+            task.join()
+
+    def test_finishes_tasks_whose_process_ended_in_between(self):
+        taskpile, journal = self._restore(max_parallel=1)
+        task = ExternalTask('true')
+        taskpile.enqueue(task)
+        taskpile.update()
+        journal.close()
+        task.join()
+
+        taskpile, journal = self._restore()
+        journal.close()
+        assert_that(taskpile.running, contains())
+        assert_that(taskpile.finished, contains(
+            has_property('state', State.FINISHED)))
+
+    def test_ignores_incomplete_last_record(self):
+        taskpile, journal = self._restore()
+        taskpile.enqueue(ExternalTask('cmd'))
+        taskpile.update()
+        journal.close()
+        with open(self.filename, 'a') as f:
+            f.write('{"event": "enq')
+
+        taskpile, journal = self._restore()
+        journal.close()
+        assert_that(taskpile.pending, contains(
+            has_property('command', 'cmd')))
+
+    def test_resumes_task_sources(self):
+        spec_filename = os.path.join(self.tmpdir, 'spec')
+        with open(spec_filename, 'w') as f:
+            f.write('__cmd__ = cmd {x}\n_x = 1, 2, 3, 4\n')
+        taskpile, journal = self._restore()
+        taskpile.lookahead = 1
+        taskpile.add_source(SpecTaskSource(spec_filename, priority=2))
+        taskpile.update()
+        journal.close()
+
+        taskpile, journal = self._restore()
+        journal.close()
+        assert_that(taskpile.pending, contains(
+            has_property('command', 'cmd 1')))
+        assert_that(taskpile.sources, contains(all_of(
+            has_property('filename', spec_filename),
+            has_property('priority', 2),
+            has_property('drawn', 1))))
+        assert_that(
+            taskpile.sources[0].next_task(), has_property('command', 'cmd 2'))
+
+    def test_forgets_exhausted_task_sources(self):
+        spec_filename = os.path.join(self.tmpdir, 'spec')
+        with open(spec_filename, 'w') as f:
+            f.write('__cmd__ = cmd\n')
+        taskpile, journal = self._restore()
+        taskpile.add_source(SpecTaskSource(spec_filename))
+        taskpile.update()
+        journal.close()
+
+        taskpile, journal = self._restore()
+        journal.close()
+        assert_that(taskpile.pending, contains(has_property('command', 'cmd')))
+        assert_that(taskpile.sources, contains())
+
+    def test_remove_on_close_deletes_journal(self):
+        taskpile, journal = self._restore()
+        journal.close(remove=True)
+        assert_that(os.path.exists(self.filename), is_(False))
+
+    @raises(JournalLockedError)
+    def test_cannot_be_used_by_two_taskpiles(self):
+        taskpile, journal = self._restore()
+        try:
+            self._restore()
+        finally:
+            journal.close()
@@ -0,0 +1,107 @@
+from hamcrest import assert_that, is_
+try:
+    from unittest.mock import MagicMock, patch
+except:
+    from mock import MagicMock, patch
+
+from taskpile.core import State, Task, Taskpile
+from taskpile.loadcontrol import LoadController
+
+
+class TestLoadController(object):
+    def setUp(self):
+        self.taskpile = Taskpile(max_parallel=4)
+        self.controller = LoadController(
+            min_parallel=1, max_parallel=6, capacity=8, interval=0)
+        self.taskpile.controller = self.controller
+        self.loadavg = 0.
+        self.pressure = {'cpu': 0., 'memory': 0., 'io': None}
+        self.now = 0.
+        self._patches = [
+            patch('taskpile.loadcontrol._clock', lambda: self.now),
+            patch('taskpile.loadcontrol.read_loadavg',
+                  lambda: self.loadavg),
+            patch('taskpile.loadcontrol.read_pressure',
+                  lambda r: self.pressure[r])]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+    @staticmethod
+    def _create_running_task():
+        task = MagicMock(spec=Task)
+        task.state = State.RUNNING
+        task.cpus = 1
+        task.memory = None
+        return task
+
+    def _update(self, times=1, step=1.):
+        for i in range(times):
+            self.now += step
+            self.taskpile.update()
+
+    def test_starts_with_max_parallel_of_taskpile(self):
+        self._update()
+        assert_that(self.controller.target, is_(4))
+
+    def test_ramps_up_to_max_parallel_without_load(self):
+        self._update(10)
+        assert_that(self.taskpile.max_parallel, is_(6))
+
+    def test_backs_off_under_foreign_load(self):
+        self.loadavg = 6.
+        self._update(10)
+        assert_that(self.taskpile.max_parallel, is_(2))
+
+    def test_does_not_oscillate_within_hysteresis(self):
+        self.loadavg = 4.7
+        self._update()
+        self._update(10)
+        assert_that(self.taskpile.max_parallel, is_(3))
+
+    def test_backs_off_under_pressure(self):
+        self.pressure['memory'] = 50.
+        self._update(10)
+        assert_that(self.taskpile.max_parallel, is_(1))
+
+    def test_does_not_ramp_up_under_moderate_pressure(self):
+        self.pressure['io'] = 10.
+        self._update(10)
+        assert_that(self.taskpile.max_parallel, is_(4))
+
+    def test_does_not_count_own_tasks_as_foreign_load(self):
+        self.taskpile.running.append(self._create_running_task())
+        self.loadavg = 1.
+        self._update(10)
+        assert_that(self.taskpile.max_parallel, is_(6))
+
+    def test_does_not_take_load_of_finished_tasks_for_foreign_load(self):
+        tasks = [self._create_running_task() for i in range(4)]
+        for task in tasks:
+            self.taskpile.running.append(task)
+        self.loadavg = 4.
+        self._update(10)
+        for task in tasks:
+            self.taskpile.running.remove(task)
+        self._update(5)
+        assert_that(self.taskpile.max_parallel, is_(6))
+
+    def test_does_not_subtract_new_tasks_before_load_average_rises(self):
+        self.loadavg = 4.
+        self._update()
+        for i in range(4):
+            self.taskpile.running.append(self._create_running_task())
+        self._update(5)
+        assert_that(self.taskpile.max_parallel, is_(4))
+
+    def test_stops_tasks_above_target(self):
+        tasks = [self._create_running_task() for i in range(4)]
+        for task in tasks:
+            self.taskpile.running.append(task)
+        self.loadavg = 12.
+        self._update(2)
+        assert_that(len(self.taskpile.running), is_(3))
+        tasks[-1].stop.assert_called_once_with()
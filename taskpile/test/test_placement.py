@@ -0,0 +1,191 @@
+import os
+import os.path
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+
+from hamcrest import assert_that, contains, contains_inanyorder, \
+    has_properties, is_
+try:
+    from unittest.mock import MagicMock, patch
+except:
+    from mock import MagicMock, patch
+
+from taskpile.accounting import iter_process_tree
+from taskpile.core import State, Task, Taskpile
+from taskpile.placement import CpuTopology, get_affinity, parse_cpu_list, \
+    Placement, PlacementEngine, set_affinity
+
+
+def test_parses_cpu_lists():
+    assert_that(parse_cpu_list('0-2,5,7-8\n'), contains(0, 1, 2, 5, 7, 8))
+
+
+def test_sets_affinity_of_other_process():
+    cpu = get_affinity()[0]
+    process = subprocess.Popen(['sleep', '10'])
+    try:
+        set_affinity(process.pid, [cpu])
+        assert_that(get_affinity(process.pid), contains(cpu))
+    finally:
+        process.kill()
+        process.wait()
+
+
+class TestCpuTopology(object):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self._write('cpu/online', '0-7')
+        self._write('node/node0/cpulist', '0-1,4-5')
+        self._write('node/node1/cpulist', '2-3,6-7')
+        for cpu in range(8):
+            self._write(
+                'cpu/cpu{0}/topology/thread_siblings_list'.format(cpu),
+                '{0},{1}'.format(cpu % 4, cpu % 4 + 4))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, content):
+        filename = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(content + '\n')
+
+    def test_groups_smt_siblings_by_node(self):
+        topology = CpuTopology.from_sysfs(self.root, allowed=range(8))
+        assert_that(topology.nodes, is_({
+            0: [(0, 4), (1, 5)],
+            1: [(2, 6), (3, 7)]}))
+
+    def test_only_includes_allowed_cpus(self):
+        topology = CpuTopology.from_sysfs(self.root, allowed=[0, 1, 4])
+        assert_that(topology.nodes, is_({0: [(0, 4), (1,)]}))
+
+
+class TestPlacementEngine(object):
+    def setUp(self):
+        self.topology = CpuTopology({
+            0: [(0, 4), (1, 5)],
+            1: [(2, 6), (3, 7), (8, 9)]})
+
+    @staticmethod
+    def _create_task(cpus=1):
+        task = MagicMock(spec=Task)
+        task.cpus = cpus
+        task.memory = None
+        task.placement = None
+        task.pid = None
+        task.state = State.PENDING
+        return task
+
+    def test_applies_placement_to_all_processes_of_task(self):
+        process = subprocess.Popen(['sh', '-c', 'sleep 10; true'])
+        try:
+            while len(list(iter_process_tree(process.pid))) < 2:
+                time.sleep(0.01)
+            task = self._create_task()
+            task.pid = process.pid
+            task.placement = Placement([0], [0])
+            with patch('taskpile.placement.set_affinity') as set_affinity:
+                PlacementEngine(self.topology).apply(task)
+            assert_that(
+                [c[0][0] for c in set_affinity.call_args_list],
+                contains_inanyorder(*iter_process_tree(process.pid)))
+        finally:
+            for pid in iter_process_tree(process.pid):
+                os.kill(pid, signal.SIGKILL)
+            process.wait()
+
+    def test_assigns_whole_cores_on_node_with_most_free_cores(self):
+        engine = PlacementEngine(self.topology)
+        task = self._create_task(cpus=2)
+        engine.assign(task)
+        assert_that(task.placement, has_properties(
+            cpus=[2, 3, 6, 7], nodes=[1]))
+
+    def test_keeps_task_on_one_node_if_possible(self):
+        engine = PlacementEngine(self.topology)
+        engine.assign(self._create_task(cpus=2))
+        task = self._create_task(cpus=2)
+        engine.assign(task)
+        assert_that(task.placement, has_properties(
+            cpus=[0, 1, 4, 5], nodes=[0]))
+
+    def test_spreads_task_over_nodes_if_necessary(self):
+        engine = PlacementEngine(self.topology)
+        task = self._create_task(cpus=4)
+        engine.assign(task)
+        assert_that(task.placement.nodes, contains(0, 1))
+        assert_that(len(task.placement.cpus), is_(8))
+
+    def test_uses_smt_siblings_as_cpus_with_smt(self):
+        engine = PlacementEngine(self.topology, smt=True)
+        task = self._create_task(cpus=2)
+        engine.assign(task)
+        assert_that(task.placement.cpus, contains(2, 6))
+
+    def test_does_not_restrict_task_if_not_enough_cores_are_free(self):
+        engine = PlacementEngine(self.topology)
+        task = self._create_task(cpus=6)
+        assert_that(engine.assign(task), is_(None))
+
+    def test_reuses_released_cores(self):
+        engine = PlacementEngine(self.topology)
+        tasks = [self._create_task(cpus=5), self._create_task()]
+        engine.assign(tasks[0])
+        engine.release(tasks[0])
+        engine.assign(tasks[1])
+        assert_that(tasks[1].placement.cpus, contains(2, 6))
+        assert_that(engine.num_free(), is_(4))
+
+
+class TestTaskpileWithPlacement(object):
+    def setUp(self):
+        self.engine = MagicMock(spec=PlacementEngine)
+        self.taskpile = Taskpile(max_parallel=1)
+        self.taskpile.placement_engine = self.engine
+
+    @staticmethod
+    def _create_task():
+        task = MagicMock(spec=Task)
+        task.state = State.PENDING
+        task.cpus = 1
+        task.memory = None
+
+        def start():
+            task.state = State.RUNNING
+
+        task.start.side_effect = start
+        return task
+
+    def test_places_started_tasks(self):
+        task = self._create_task()
+        self.taskpile.enqueue(task)
+        self.taskpile.update()
+        self.engine.assign.assert_called_once_with(task)
+        self.engine.apply.assert_called_with(task)
+
+    def test_reassigns_cpus_on_stop_and_continue(self):
+        task = self._create_task()
+        self.taskpile.enqueue(task)
+        self.taskpile.update()
+        task.state = State.RUNNING
+        self.taskpile.max_parallel = 0
+        self.taskpile.update()
+        self.engine.release.assert_called_once_with(task)
+        task.state = State.STOPPED
+        self.taskpile.max_parallel = 1
+        self.taskpile.update()
+        assert_that(self.engine.assign.call_count, is_(2))
+
+    def test_releases_cpus_of_finished_tasks(self):
+        task = self._create_task()
+        self.taskpile.enqueue(task)
+        self.taskpile.update()
+        task.state = State.FINISHED
+        self.taskpile.update()
+        self.engine.release.assert_called_once_with(task)
@@ -0,0 +1,151 @@
+from hamcrest import assert_that, contains, is_
+from nose.tools import raises
+
+from taskpile.scheduling import FifoPolicy, PriorityPolicy, \
+    ShortestJobFirstPolicy, TaskQueue
+
+
+class DummyTask(object):
+    def __init__(self, name, priority=0, expected_runtime=None):
+        self.name = name
+        self.priority = priority
+        self.expected_runtime = expected_runtime
+
+    def __repr__(self):
+        return self.name
+
+
+class TestTaskQueue(object):
+    def test_keeps_insertion_order(self):
+        queue = TaskQueue([1, 2])
+        queue.append(3)
+        queue.appendleft(0)
+        assert_that(queue, contains(0, 1, 2, 3))
+        assert_that(list(reversed(queue)), contains(3, 2, 1, 0))
+
+    def test_can_remove_arbitrary_task(self):
+        queue = TaskQueue([0, 1, 2])
+        queue.remove(1)
+        assert_that(queue, contains(0, 2))
+        assert_that(1 in queue, is_(False))
+        assert_that(len(queue), is_(2))
+
+    def test_pops_from_both_ends(self):
+        queue = TaskQueue([0, 1, 2])
+        assert_that(queue.peek(), is_(0))
+        assert_that(queue.popleft(), is_(0))
+        assert_that(queue.pop(), is_(2))
+        assert_that(queue, contains(1))
+
+    @raises(IndexError)
+    def test_raises_index_error_if_empty(self):
+        TaskQueue().popleft()
+
+    @raises(ValueError)
+    def test_rejects_duplicate_tasks(self):
+        TaskQueue([0, 0])
+
+
+class PolicyTests(object):
+    policy_class = None
+
+    def test_pops_tasks_with_equal_keys_in_insertion_order(self):
+        tasks = [DummyTask(str(i)) for i in range(3)]
+        policy = self.policy_class(tasks)
+        assert_that(
+            [policy.popleft() for i in range(3)], contains(*tasks))
+
+    def test_appendleft_puts_task_before_tasks_with_equal_key(self):
+        tasks = [DummyTask(str(i)) for i in range(3)]
+        policy = self.policy_class(tasks[:2])
+        policy.appendleft(tasks[2])
+        assert_that(policy.peek(), is_(tasks[2]))
+        assert_that(policy, contains(tasks[2], tasks[0], tasks[1]))
+
+    def test_can_remove_arbitrary_task(self):
+        tasks = [DummyTask(str(i)) for i in range(3)]
+        policy = self.policy_class(tasks)
+        policy.remove(tasks[0])
+        assert_that(len(policy), is_(2))
+        assert_that(tasks[0] in policy, is_(False))
+        assert_that(policy, contains(tasks[1], tasks[2]))
+        assert_that(policy.popleft(), is_(tasks[1]))
+
+    def test_iteration_reflects_popped_tasks(self):
+        tasks = [DummyTask(str(i)) for i in range(3)]
+        policy = self.policy_class(tasks)
+        list(policy)
+        policy.popleft()
+        assert_that(policy, contains(tasks[1], tasks[2]))
+
+    def test_steps_through_tasks_in_iteration_order(self):
+        tasks = [DummyTask(str(i), priority=i % 2) for i in range(5)]
+        policy = self.policy_class(tasks)
+        policy.popleft()
+        policy.remove(tasks[2])
+        ordered = list(policy)
+        task = policy.peek()
+        forward = [task]
+        while task is not None:
+            task = policy.next_task(task)
+            forward.append(task)
+        task = policy.last()
+        backward = [task]
+        while task is not None:
+            task = policy.prev_task(task)
+            backward.append(task)
+        assert_that(forward, contains(*ordered + [None]))
+        assert_that(backward, contains(*ordered[::-1] + [None]))
+
+    def test_head_returns_first_tasks_in_iteration_order(self):
+        tasks = [DummyTask(str(i), priority=i % 3) for i in range(10)]
+        policy = self.policy_class(tasks)
+        policy.remove(tasks[5])
+        policy.popleft()
+        policy.append(DummyTask('new', priority=1))
+        assert_that(policy.head(4), contains(*list(policy)[:4]))
+        assert_that(policy.head(20), contains(*list(policy)))
+
+    @raises(IndexError)
+    def test_raises_index_error_if_empty(self):
+        self.policy_class().popleft()
+
+
+class TestFifoPolicy(PolicyTests):
+    policy_class = FifoPolicy
+
+
+class TestPriorityPolicy(PolicyTests):
+    policy_class = PriorityPolicy
+
+    def test_runs_higher_priority_first(self):
+        low = DummyTask('low', priority=0)
+        high = DummyTask('high', priority=5)
+        policy = PriorityPolicy([low, high])
+        assert_that(policy, contains(high, low))
+        assert_that(policy.popleft(), is_(high))
+
+    def test_iteration_reflects_added_tasks(self):
+        low = DummyTask('low', priority=0)
+        high = DummyTask('high', priority=5)
+        policy = PriorityPolicy([low])
+        list(policy)
+        policy.append(high)
+        assert_that(policy, contains(high, low))
+
+
+class TestShortestJobFirstPolicy(PolicyTests):
+    policy_class = ShortestJobFirstPolicy
+
+    def test_runs_shorter_jobs_first(self):
+        unknown = DummyTask('unknown')
+        short = DummyTask('short', expected_runtime=1.)
+        long_ = DummyTask('long', expected_runtime=10.)
+        policy = ShortestJobFirstPolicy([unknown, long_, short])
+        assert_that(policy, contains(short, long_, unknown))
+
+    def test_priority_takes_precedence(self):
+        short = DummyTask('short', expected_runtime=1.)
+        urgent = DummyTask('urgent', priority=1, expected_runtime=10.)
+        policy = ShortestJobFirstPolicy([short, urgent])
+        assert_that(policy.popleft(), is_(urgent))
@@ -0,0 +1,90 @@
+import os.path
+import shutil
+import tempfile
+
+from hamcrest import assert_that, contains, is_
+try:
+    from unittest.mock import patch
+except:
+    from mock import patch
+
+from taskpile.search import BackgroundSearch, compile_pattern, \
+    iter_matching_lines, SearchCache
+
+
+def test_finds_each_matching_line_once():
+    data = b'a NaN NaN\nb\nNaN c\n'
+    batches = list(iter_matching_lines(data, compile_pattern('NaN')))
+    assert_that([list(b) for b in batches], contains(contains(0, 12)))
+
+
+@patch('taskpile.search._WINDOW_SIZE', 4)
+def test_searches_in_windows_of_whole_lines():
+    data = b'x1\ny22\nx333\n'
+    batches = list(iter_matching_lines(data, compile_pattern('^x')))
+    assert_that([list(b) for b in batches], contains(contains(0), contains(7)))
+
+
+class TestSearchCache(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'out')
+        self.cache = SearchCache()
+        self.regex = compile_pattern('err')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _append(self, data):
+        with open(self.filename, 'ab') as f:
+            f.write(data)
+
+    def _search(self):
+        offsets = []
+        for batch in self.cache.search(self.filename, self.regex):
+            offsets.extend(batch)
+        return offsets
+
+    def test_finds_matching_lines(self):
+        self._append(b'ok\nerror\nok\nerror\n')
+        assert_that(self._search(), contains(3, 12))
+
+    @patch('taskpile.search._WINDOW_SIZE', 4)
+    def test_finds_matching_lines_across_chunks(self):
+        self._append(b'ok\nerror\nokay\nerr')
+        assert_that(self._search(), contains(3, 14))
+
+    def test_returns_cached_results_for_unchanged_output(self):
+        self._append(b'ok\nerror\n')
+        self._search()
+        with patch('taskpile.search.open_output') as open_output:
+            assert_that(self._search(), contains(3))
+            assert_that(open_output.called, is_(False))
+
+    def test_searches_only_appended_output(self):
+        self._append(b'error\nok\nerr')
+        assert_that(self._search(), contains(0, 9))
+        self._append(b'or\nok\nerror\n')
+        with patch('taskpile.search.iter_matching_lines') as iter_lines:
+            iter_lines.return_value = iter([])
+            self._search()
+            assert_that(
+                iter_lines.call_args[0][0], is_(b'error\nok\nerror\n'))
+        self.cache.clear()
+        self._search()
+        self._append(b'error\n')
+        assert_that(self._search(), contains(0, 9, 18, 24))
+
+
+def test_background_search_marks_end_of_results():
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(b'ok\nerror\n')
+        f.flush()
+        search = BackgroundSearch(
+            [f.name, f.name + '.missing'], compile_pattern('err'),
+            SearchCache())
+        search.join()
+        filename, offsets = search.results.get_nowait()
+        assert_that(filename, is_(f.name))
+        assert_that(list(offsets), contains(3))
+        assert_that(search.results.get_nowait(), is_((None, None)))
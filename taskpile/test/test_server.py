@@ -0,0 +1,132 @@
+import os
+import os.path
+import shutil
+import socket
+import tempfile
+import threading
+
+from hamcrest import all_of, assert_that, contains, has_entries, \
+    has_property, is_
+from nose.tools import raises
+try:
+    from unittest.mock import MagicMock
+except:
+    from mock import MagicMock
+
+from taskpile.archive import TaskArchive
+from taskpile.client import Client, RemoteError
+from taskpile.core import Taskpile
+from taskpile.daemon import SelectLoop
+from taskpile.server import bind_unix_socket, ServerError, TaskpileServer
+
+
+class TestTaskpileServer(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'socket')
+        self.taskpile = Taskpile(max_parallel=0)
+        self.loop = SelectLoop()
+        self.on_stop = MagicMock()
+        self.server = TaskpileServer(
+            self.taskpile, self.path, self.loop, on_stop=self.on_stop)
+        self._serving = True
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.start()
+        self.client = Client(self.path)
+
+    def _serve(self):
+        while self._serving:
+            self.loop.run_once(0.01)
+
+    def tearDown(self):
+        self.client.close()
+        self._serving = False
+        self._thread.join()
+        self.server.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_submit_enqueues_tasks(self):
+        ids = self.client.submit(['cmd0', 'cmd1'], priority=2, cwd='/tmp')
+        assert_that(ids, contains(0, 1))
+        assert_that(self.taskpile.pending, contains(
+            all_of(
+                has_property('command', 'cmd0'),
+                has_property('priority', 2),
+                has_property('cwd', '/tmp')),
+            has_property('command', 'cmd1')))
+
+    def test_submit_spec_enqueues_tasks_of_spec(self):
+        filename = os.path.join(self.tmpdir, 'spec')
+        with open(filename, 'w') as f:
+            f.write('__cmd__ = cmd {x}\n_x = 1, 2\n')
+        count = self.client.submit_spec(filename, num_repeats=2)
+        assert_that(count, is_(4))
+        assert_that(
+            [t.command for t in self.taskpile.pending],
+            contains('cmd 1', 'cmd 2', 'cmd 1', 'cmd 2'))
+
+    def test_lists_tasks(self):
+        self.client.submit(['cmd'], name='name')
+        assert_that(self.client.list(), contains(has_entries({
+            'id': 0, 'name': 'name', 'command': 'cmd', 'state': 'pending',
+            'pid': None, 'outbuf_name': None})))
+
+    def test_kill_removes_pending_task(self):
+        ids = self.client.submit(['cmd'])
+        self.client.kill(ids)
+        assert_that(self.taskpile.pending, contains())
+        assert_that(self.client.list(), contains(has_entries({
+            'state': 'finished'})))
+
+    def test_lists_archived_tasks(self):
+        archive = TaskArchive()
+        self.taskpile.set_archive(archive)
+        ids = self.client.submit(['cmd'])
+        self.client.kill(ids)
+        assert_that(self.client.list(), contains(has_entries({
+            'id': 0, 'command': 'cmd', 'state': 'finished'})))
+        archive.close()
+
+    def test_sets_max_parallel(self):
+        self.client.set_max_parallel(3)
+        assert_that(self.taskpile.max_parallel, is_(3))
+
+    def test_stop_calls_on_stop(self):
+        self.client.stop()
+        self.on_stop.assert_called_once_with()
+
+    @raises(RemoteError)
+    def test_stop_is_refused_without_on_stop(self):
+        self.server.on_stop = None
+        self.client.stop()
+
+    @raises(RemoteError)
+    def test_reports_errors(self):
+        self.client.kill([42])
+
+    @raises(RemoteError)
+    def test_reports_unknown_commands(self):
+        self.client.request('unknown')
+
+
+class TestBindUnixSocket(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'socket')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @raises(ServerError)
+    def test_refuses_socket_of_running_server(self):
+        sock = bind_unix_socket(self.path)
+        try:
+            bind_unix_socket(self.path)
+        finally:
+            sock.close()
+
+    def test_replaces_stale_socket(self):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        bind_unix_socket(self.path).close()
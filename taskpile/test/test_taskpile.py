@@ -1,13 +1,17 @@
+import errno
 from functools import wraps
 from multiprocessing import Pipe, Process
 from multiprocessing.reduction import reduce_connection
 import os
 import pickle
+import shutil
+import signal
 import tempfile
 import time
 
-from hamcrest import all_of, assert_that, contains, described_as, \
-    greater_than_or_equal_to, has_entries, has_property, is_, is_not
+from hamcrest import all_of, assert_that, contains, contains_string, \
+    described_as, greater_than, greater_than_or_equal_to, has_entries, \
+    has_property, is_, is_in, is_not, less_than, only_contains
 try:
     from unittest.mock import patch, MagicMock
 except:
@@ -15,7 +19,11 @@ except:
 from nose import SkipTest
 
 from matcher import file_with_content
-from taskpile.core import ExternalTask, State, Task, Taskpile
+from taskpile.accounting import iter_process_tree, read_process_state, \
+    ResourceUsage, sample_process_tree
+from taskpile.core import ChildWatcher, ExternalTask, SpecTaskSource, State, \
+    Task, TaskSource, TemplateCache, Taskpile, TaskpileListener
+from taskpile.scheduling import PriorityPolicy, TaskQueue
 
 
 def run_in_process(connection, function, *args, **kwargs):
@@ -124,6 +132,19 @@ class TestTask(object):
         finally:
             task_ctrl.finish()
 
+    def test_state_is_running_right_after_start(self):
+        task_ctrl = DummyTaskController()
+        task = task_ctrl.create_task()
+        task.start()
+        try:
+            assert_that(task.state, is_(State.RUNNING))
+        finally:
+            task_ctrl.finish()
+            task.join()
+
+    def test_has_no_instance_dict(self):
+        assert_that(hasattr(ExternalTask('cmd'), '__dict__'), is_(False))
+
     @timelimit(1)
     def test_stores_integer_return_value_of_function_as_exitcode(self):
         def check_args():
@@ -157,6 +178,27 @@ class TestTask(object):
         task.join()
         assert_that(task.state, is_(State.FINISHED))
 
+    @timelimit(1)
+    def test_poll_reaps_finished_task_without_blocking(self):
+        task_ctrl = DummyTaskController()
+        task = task_ctrl.create_task()
+        task.start()
+        task_ctrl.wait_until_started_or_fail()
+        assert_that(task.poll(), is_(False))
+        task_ctrl.finish()
+        while not task.poll():
+            time.sleep(0.01)
+        assert_that(task.state, is_(State.FINISHED))
+        assert_that(task.exitcode, is_(0))
+
+    def test_join_after_poll_keeps_exitcode(self):
+        task = Task(noop)
+        task.start()
+        while not task.poll():
+            time.sleep(0.01)
+        task.join()
+        assert_that(task.exitcode, is_(0))
+
     def test_exitcode_is_initially_none(self):
         task = Task(noop)
         assert_that(task.exitcode, is_(None))
@@ -259,8 +301,70 @@ class TestTask(object):
 
 
 class TestExternalTask(object):
-    # TODO basically external task functionality is not tested, yet
-    # (except the creation from task specs)
+    @timelimit(1)
+    def test_runs_command_and_captures_output(self):
+        task = ExternalTask('echo out; echo err >&2; exit 3')
+        task.start()
+        task.join()
+        assert_that(task.exitcode, is_(3))
+        assert_that(task.state, is_(State.FINISHED))
+        assert_that(task.outbuf_name, is_(file_with_content(b'out\n')))
+        assert_that(task.errbuf_name, is_(file_with_content(b'err\n')))
+
+    @timelimit(1)
+    def test_runs_shell_builtins(self):
+        task = ExternalTask('exit 3')
+        task.start()
+        task.join()
+        assert_that(task.exitcode, is_(3))
+
+    @timelimit(1)
+    def test_reports_unknown_command_by_exitcode(self):
+        task = ExternalTask('taskpile-nonexistent-command')
+        task.start()
+        task.join()
+        assert_that(task.exitcode, is_(127))
+
+    @timelimit(1)
+    def test_pid_is_the_pid_of_the_spawned_command(self):
+        task = ExternalTask('echo $$')
+        task.start()
+        task.join()
+        assert_that(task.outbuf_name, is_(file_with_content(
+            '{0}\n'.format(task.pid).encode())))
+
+    @timelimit(1)
+    def test_signals_reach_the_command(self):
+        task = ExternalTask('sleep 10')
+        task.start()
+        task.terminate()
+        task.join()
+        assert_that(task.exitsignal, is_(signal.SIGTERM))
+
+    @timelimit(2)
+    def test_stop_suspends_all_descendants(self):
+        task = ExternalTask('yes > /dev/null & yes > /dev/null; wait')
+        task.start()
+        try:
+            while len(list(iter_process_tree(task.pid))) < 3:
+                time.sleep(0.01)
+            task.stop()
+            while not task.is_suspended():
+                time.sleep(0.01)
+            before = sample_process_tree(task.pid)
+            time.sleep(0.1)
+            after = sample_process_tree(task.pid)
+            assert_that(after.cpu_time, is_(before.cpu_time))
+            task.cont()
+            assert_that(task.is_suspended(), is_(False))
+        finally:
+            descendants = list(iter_process_tree(task.pid))
+            task.terminate()
+            task.join()
+        time.sleep(0.05)
+        assert_that(
+            [read_process_state(pid) for pid in descendants],
+            only_contains(is_in((None, 'Z'))))
 
     def test_can_be_created_from_task_spec(self):
         spec = {'__cmd__': 'cmd', '__name__': 'foo'}
@@ -281,6 +385,7 @@ class TestExternalTask(object):
                 'config_template': filename
             }
             task = ExternalTask.from_task_spec(spec)
+            task.render_templates()
             assert_that(task.command, is_not(filename))
             try:
                 assert_that(task.command, is_(file_with_content(
@@ -290,6 +395,117 @@ class TestExternalTask(object):
         finally:
             os.unlink(filename)
 
+    def test_renders_template_files_on_start_and_removes_them_on_finish(self):
+        fd, filename = tempfile.mkstemp()
+        try:
+            os.write(fd, b'echo {somevar}\n')
+            os.close(fd)
+
+            spec = {
+                '__cmd__': 'sh {config_template!t}',
+                'somevar': 'somevalue',
+                'config_template': filename
+            }
+            task = ExternalTask.from_task_spec(spec)
+            assert_that(task.command, is_('sh {config_template!t}'))
+            task.start()
+            rendered = list(task.original_files)
+            assert_that(rendered, contains(is_(file_with_content(
+                b'echo somevalue\n'))))
+            task.join()
+            assert_that(task.outbuf_name, is_(file_with_content(
+                b'somevalue\n')))
+            assert_that(os.path.exists(rendered[0]), is_(False))
+        finally:
+            os.unlink(filename)
+
+    def test_copy_of_finished_task_renders_templates_again(self):
+        fd, filename = tempfile.mkstemp()
+        try:
+            os.write(fd, b'echo {somevar}\n')
+            os.close(fd)
+
+            spec = {
+                '__cmd__': 'sh {config_template!t}',
+                'somevar': 'somevalue',
+                'config_template': filename
+            }
+            task = ExternalTask.from_task_spec(spec)
+            task.start()
+            task.join()
+            assert_that(task, all_of(
+                has_property('unrendered_command', 'sh {config_template!t}'),
+                has_property('template_spec', spec)))
+
+            copy = ExternalTask(
+                task.unrendered_command, template_spec=task.template_spec)
+            copy.start()
+            copy.join()
+            assert_that(copy.outbuf_name, is_(file_with_content(
+                b'somevalue\n')))
+        finally:
+            os.unlink(filename)
+
+    def test_resolves_relative_template_files_against_cwd(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, 'tmpl'), 'w') as f:
+                f.write('{somevar}\n')
+            spec = {
+                '__cmd__': 'cat {config_template!t}',
+                'somevar': 'somevalue',
+                'config_template': 'tmpl'
+            }
+            task = ExternalTask.from_task_spec(spec, cwd=directory)
+            task.start()
+            task.join()
+            assert_that(task.outbuf_name, is_(file_with_content(
+                b'somevalue\n')))
+            assert_that(task.original_files.values(), contains(
+                os.path.join(directory, 'tmpl')))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_fails_on_start_if_template_cannot_be_rendered(self):
+        spec = {
+            '__cmd__': 'cat {config_template!t}',
+            'config_template': '/nonexistent/template'
+        }
+        task = ExternalTask.from_task_spec(spec)
+        task.start()
+        task.join()
+        assert_that(task.exitcode, is_(1))
+        with open(task.errbuf_name) as f:
+            assert_that(f.read(), contains_string('/nonexistent/template'))
+
+    def test_fails_on_start_if_niceness_cannot_be_set(self):
+        task = ExternalTask('true', niceness=-5)
+        with patch('os.nice', side_effect=OSError(errno.EPERM, 'denied')):
+            task.start()
+        task.join()
+        assert_that(task.exitcode, is_(1))
+        assert_that(task.state, is_(State.FINISHED))
+        with open(task.errbuf_name) as f:
+            assert_that(f.read(), contains_string('Cannot start command'))
+
+    def test_takes_priority_and_runtime_from_task_spec(self):
+        spec = {'__cmd__': 'cmd', '__priority__': '3', '__runtime__': '1.5'}
+        task = ExternalTask.from_task_spec(spec, priority=1)
+        assert_that(task, all_of(
+            has_property('priority', 3),
+            has_property('expected_runtime', 1.5)))
+
+    def test_takes_resources_from_task_spec(self):
+        spec = {'__cmd__': 'cmd', '__mem__': '1.5G', '__cpus__': '2'}
+        task = ExternalTask.from_task_spec(spec)
+        assert_that(task, all_of(
+            has_property('memory', 3 * 1024 ** 3 // 2),
+            has_property('cpus', 2)))
+
+    def test_uses_default_priority_if_not_in_task_spec(self):
+        task = ExternalTask.from_task_spec({'__cmd__': 'cmd'}, priority=2)
+        assert_that(task.priority, is_(2))
+
     def test_sets_original_files_for_template_files(self):
         fd, filename = tempfile.mkstemp()
         try:
@@ -301,21 +517,102 @@ class TestExternalTask(object):
                 'config_template': filename
             }
             task = ExternalTask.from_task_spec(spec)
+            task.render_templates()
             os.unlink(task.command)
             assert_that(task.original_files[task.command], is_(filename))
         finally:
             os.unlink(filename)
 
 
+class TestTemplateCache(object):
+    def setUp(self):
+        self.cache = TemplateCache()
+        fd, self.template = tempfile.mkstemp(suffix='.conf')
+        os.write(fd, b'a = {a}\n')
+        os.close(fd)
+
+    def tearDown(self):
+        self.cache.close()
+        os.unlink(self.template)
+
+    def test_renders_template(self):
+        filename = self.cache.render(self.template, {'a': '1', 'b': '2'})
+        assert_that(filename, is_(file_with_content(b'a = 1\n')))
+        assert_that(filename.endswith('.conf'), is_(True))
+
+    def test_removes_rendered_file_after_last_release(self):
+        first = self.cache.render(self.template, {'a': '1'})
+        second = self.cache.render(self.template, {'a': '1'})
+        self.cache.release(first)
+        assert_that(os.path.exists(second), is_(True))
+        self.cache.release(second)
+        assert_that(os.path.exists(second), is_(False))
+
+    def test_forgets_renderings_of_removed_files(self):
+        with open(self.template, 'w') as f:
+            f.write('a = {a[0]}\n')
+        first = self.cache.render(self.template, {'a': 'x1'})
+        second = self.cache.render(self.template, {'a': 'x2'})
+        self.cache.release(first)
+        self.cache.release(second)
+        assert_that(self.cache._rendered, is_({}))
+
+    def test_reuses_rendering_for_same_values_of_used_fields(self):
+        first = self.cache.render(self.template, {'a': '1', 'b': '2'})
+        second = self.cache.render(self.template, {'a': '1', 'b': '3'})
+        assert_that(second, is_(first))
+        assert_that(self.cache.hits, is_(1))
+        assert_that(self.cache.misses, is_(1))
+
+    def test_identical_renderings_share_a_file(self):
+        with open(self.template, 'w') as f:
+            f.write('a = {a[0]}\n')
+        first = self.cache.render(self.template, {'a': 'x1'})
+        second = self.cache.render(self.template, {'a': 'x2'})
+        assert_that(self.cache.misses, is_(2))
+        assert_that(second, is_(first))
+
+    def test_rereads_modified_template(self):
+        self.cache.render(self.template, {'a': '1'})
+        with open(self.template, 'w') as f:
+            f.write('b = {a}\n')
+        os.utime(self.template, (0, 0))
+        filename = self.cache.render(self.template, {'a': '1'})
+        assert_that(filename, is_(file_with_content(b'b = 1\n')))
+
+    def test_close_removes_rendered_files(self):
+        filename = self.cache.render(self.template, {'a': '1'})
+        self.cache.close()
+        assert_that(os.path.exists(filename), is_(False))
+
+
+class TestChildWatcher(object):
+    @timelimit(1)
+    def test_becomes_readable_when_child_exits(self):
+        watcher = ChildWatcher()
+        try:
+            task = Task(noop)
+            task.start()
+            assert_that(watcher.wait(0.9), is_(True))
+            task.join()
+            assert_that(watcher.wait(0), is_(False))
+        finally:
+            watcher.close()
+
+
 class TestTaskpile(object):
     def setUp(self):
         self.taskpile = Taskpile()
 
     @staticmethod
-    def _create_mocktask_in_state(state):
+    def _create_mocktask_in_state(state, cpus=1, memory=None):
 
         task = MagicMock(spec=Task)
         task.state = state
+        task.cpus = cpus
+        task.memory = memory
+        task.usage = None
+        task.needs_polling = False
 
         def start():
             task.state = State.RUNNING
@@ -363,6 +660,104 @@ class TestTaskpile(object):
         for task in tasks[-num_more:]:
             assert_that(task.start.called, is_(False))
 
+    def test_fills_all_free_slots_in_one_update(self):
+        self.taskpile.max_parallel = 4
+        tasks = [self._create_mocktask_in_state(State.PENDING)
+                 for i in range(6)]
+        for task in tasks:
+            self.taskpile.enqueue(task)
+        self.taskpile.update()
+        for task in tasks[:4]:
+            task.start.assert_called_once_with()
+        assert_that(self.taskpile.running, contains(*tasks[:4]))
+        assert_that(self.taskpile.pending, contains(*tasks[4:]))
+
+    def test_respects_min_start_interval(self):
+        self.taskpile = Taskpile(max_parallel=4, min_start_interval=60)
+        tasks = [self._create_mocktask_in_state(State.PENDING)
+                 for i in range(2)]
+        for task in tasks:
+            self.taskpile.enqueue(task)
+        self.taskpile.update()
+        tasks[0].start.assert_called_once_with()
+        assert_that(tasks[1].start.called, is_(False))
+        assert_that(
+            self.taskpile.seconds_until_next_start(), greater_than(59))
+
+    def test_needs_no_update_when_idle(self):
+        self.taskpile.max_parallel = 1
+        for i in range(2):
+            self.taskpile.enqueue(
+                self._create_mocktask_in_state(State.PENDING))
+        self.taskpile.update()
+        assert_that(self.taskpile.seconds_until_update(), is_(None))
+
+    def test_needs_update_when_next_start_is_due(self):
+        self.taskpile = Taskpile(max_parallel=2, min_start_interval=60)
+        for i in range(2):
+            self.taskpile.enqueue(
+                self._create_mocktask_in_state(State.PENDING))
+        self.taskpile.update()
+        assert_that(self.taskpile.seconds_until_update(), all_of(
+            greater_than(59), less_than(61)))
+
+    def test_needs_update_when_listener_needs_it(self):
+        listener = MagicMock(spec=TaskpileListener)
+        listener.seconds_until_update.return_value = 3.
+        self.taskpile.listeners.append(listener)
+        assert_that(self.taskpile.seconds_until_update(), is_(3.))
+
+    def test_polls_tasks_not_signalling_their_exit(self):
+        task = self._create_mocktask_in_state(State.PENDING)
+        task.needs_polling = True
+        self.taskpile.enqueue(task)
+        self.taskpile.update()
+        assert_that(
+            self.taskpile.seconds_until_update(),
+            is_(self.taskpile.poll_interval))
+
+    def test_continuing_stopped_tasks_is_not_rate_limited(self):
+        self.taskpile = Taskpile(max_parallel=2, min_start_interval=60)
+        pending = self._create_mocktask_in_state(State.PENDING)
+        stopped = self._create_mocktask_in_state(State.STOPPED)
+        self.taskpile.enqueue(pending)
+        self.taskpile.update()
+        self.taskpile.pending.appendleft(stopped)
+        self.taskpile.update()
+        stopped.cont.assert_called_once_with()
+
+    def test_no_start_time_without_free_slots(self):
+        self.taskpile.max_parallel = 1
+        for i in range(2):
+            self.taskpile.enqueue(
+                self._create_mocktask_in_state(State.PENDING))
+        self.taskpile.update()
+        assert_that(self.taskpile.seconds_until_next_start(), is_(None))
+
+    def test_starts_tasks_in_order_of_policy(self):
+        self.taskpile = Taskpile(max_parallel=1, policy=PriorityPolicy())
+        low = self._create_mocktask_in_state(State.PENDING)
+        low.priority = 0
+        high = self._create_mocktask_in_state(State.PENDING)
+        high.priority = 1
+        self.taskpile.enqueue(low)
+        self.taskpile.enqueue(high)
+        self.taskpile.update()
+        high.start.assert_called_once_with()
+        assert_that(low.start.called, is_(False))
+
+    def test_set_policy_keeps_stopped_tasks_in_front(self):
+        self.taskpile.max_parallel = 0
+        stopped = self._create_mocktask_in_state(State.STOPPED)
+        stopped.priority = 0
+        pending = self._create_mocktask_in_state(State.PENDING)
+        pending.priority = 1
+        self.taskpile.enqueue(pending)
+        self.taskpile.pending.appendleft(stopped)
+        self.taskpile.set_policy(PriorityPolicy())
+        assert_that(self.taskpile.pending, contains(pending, stopped))
+        assert_that(self.taskpile.pending, is_(PriorityPolicy))
+
     def test_stop_newest_process_on_reducing_max_parallel(self):
         self.taskpile.max_parallel = 2
         tasks = [self._create_mocktask_in_state(State.PENDING)
@@ -382,7 +777,7 @@ class TestTaskpile(object):
         assert_that(task.start.called, is_(False))
         task.cont.assert_called_once_with()
 
-    def test_update_sorts_queues(self):
+    def test_update_sorts_running_tasks_into_queues(self):
         pending_tasks = [self._create_mocktask_in_state(State.PENDING)
                          for i in range(2)]
         running_tasks = [self._create_mocktask_in_state(State.RUNNING)
@@ -391,20 +786,245 @@ class TestTaskpile(object):
                          for i in range(2)]
         finished_tasks = [self._create_mocktask_in_state(State.FINISHED)
                           for i in range(2)]
-        self.taskpile.pending = [pending_tasks[0], running_tasks[0],
-                                 stopped_tasks[0], finished_tasks[0]]
-        self.taskpile.running = [pending_tasks[1], running_tasks[1],
-                                 stopped_tasks[1], finished_tasks[1]]
+        self.taskpile.pending = TaskQueue(pending_tasks)
+        self.taskpile.running = TaskQueue(
+            running_tasks + stopped_tasks + finished_tasks)
         self.taskpile.max_parallel = len(running_tasks)
         self.taskpile.update()
 
         assert_that(
-            self.taskpile.pending, contains(*stopped_tasks + pending_tasks))
+            self.taskpile.pending,
+            contains(*stopped_tasks[::-1] + pending_tasks))
         assert_that(self.taskpile.running, contains(*running_tasks))
         assert_that(self.taskpile.finished, contains(*finished_tasks))
 
-    def test_joins_finished_tasks(self):
+    def test_does_not_inspect_pending_tasks_on_update(self):
+        self.taskpile.max_parallel = 0
+        task = self._create_mocktask_in_state(State.PENDING)
+        self.taskpile.enqueue(task)
+        task.reset_mock()
+        self.taskpile.update()
+        assert_that(task.method_calls, contains())
+
+    def test_terminate_removes_pending_task(self):
+        self.taskpile.max_parallel = 0
+        task = self._create_mocktask_in_state(State.PENDING)
+        task.pid = None
+        self.taskpile.enqueue(task)
+        self.taskpile.terminate(task)
+        task.terminate.assert_called_once_with()
+        assert_that(self.taskpile.pending, contains())
+        assert_that(self.taskpile.finished, contains(task))
+
+    def test_terminate_moves_stopped_task_to_running_for_reaping(self):
+        self.taskpile.max_parallel = 0
+        task = self._create_mocktask_in_state(State.STOPPED)
+        task.pid = 42
+        self.taskpile.enqueue(task)
+        self.taskpile.terminate(task)
+        assert_that(self.taskpile.pending, contains())
+        assert_that(self.taskpile.running, contains(task))
+
+    @timelimit(2)
+    def test_shutdown_kills_tasks_ignoring_sigterm_after_grace(self):
+        self.taskpile.max_parallel = 2
+        tasks = [
+            ExternalTask('sleep 10'),
+            ExternalTask('trap "" TERM; while true; do sleep 0.05; done'),
+            ExternalTask('sleep 10')]
+        for task in tasks:
+            self.taskpile.enqueue(task)
+        self.taskpile.update()
+        time.sleep(0.1)  # Let the shell install the trap.
+        start = time.time()
+        report = self.taskpile.shutdown(grace=0.2)
+        assert_that(time.time() - start, is_(less_than(1)))
+        assert_that(report, has_entries({
+            tasks[0]: 'terminated', tasks[1]: 'killed',
+            tasks[2]: 'cancelled'}))
+        assert_that(tasks[1].exitsignal, is_(signal.SIGKILL))
+        assert_that(self.taskpile.running, contains())
+        assert_that(self.taskpile.pending, contains())
+        assert_that(len(self.taskpile.finished), is_(3))
+
+    def test_reaps_exited_running_tasks(self):
+        task = self._create_mocktask_in_state(State.RUNNING)
+
+        def poll():
+            task.state = State.FINISHED
+
+        task.poll.side_effect = poll
+        self.taskpile.running = TaskQueue([task])
+        self.taskpile.update()
+        assert_that(self.taskpile.finished, contains(task))
+
+    def test_tasks_occupy_a_slot_per_cpu(self):
+        self.taskpile.max_parallel = 4
+        tasks = [self._create_mocktask_in_state(State.PENDING, cpus=c)
+                 for c in (2, 3, 2)]
+        for task in tasks:
+            self.taskpile.enqueue(task)
+        self.taskpile.update()
+        assert_that(self.taskpile.running, contains(tasks[0], tasks[2]))
+        assert_that(self.taskpile.pending, contains(tasks[1]))
+
+    def test_skips_tasks_exceeding_memory_budget(self):
+        self.taskpile = Taskpile(max_parallel=4, memory_budget=1000)
+        tasks = [self._create_mocktask_in_state(State.PENDING, memory=m)
+                 for m in (600, 600, None, 400)]
+        for task in tasks:
+            self.taskpile.enqueue(task)
+        self.taskpile.update()
+        assert_that(
+            self.taskpile.running, contains(tasks[0], tasks[2], tasks[3]))
+        assert_that(self.taskpile.pending, contains(tasks[1]))
+
+    def test_runs_task_exceeding_budget_alone(self):
+        self.taskpile = Taskpile(max_parallel=2, memory_budget=1000)
+        tasks = [self._create_mocktask_in_state(State.PENDING, memory=2000)
+                 for i in range(2)]
+        for task in tasks:
+            self.taskpile.enqueue(task)
+        self.taskpile.update()
+        assert_that(self.taskpile.running, contains(tasks[0]))
+
+    @patch('taskpile.core.available_memory')
+    def test_can_use_available_memory_as_budget(self, available_memory):
+        available_memory.return_value = 1000
+        self.taskpile = Taskpile(max_parallel=4, memory_budget='available')
+        tasks = [self._create_mocktask_in_state(State.PENDING, memory=m)
+                 for m in (600, 600, 300)]
+        for task in tasks:
+            self.taskpile.enqueue(task)
+        self.taskpile.update()
+        assert_that(self.taskpile.running, contains(tasks[0], tasks[2]))
+
+    def test_counts_stopped_tasks_against_memory_budget(self):
+        self.taskpile = Taskpile(
+            max_parallel=2, memory_budget=1000, policy=PriorityPolicy())
+        tasks = [self._create_mocktask_in_state(state, memory=m)
+                 for state, m in ((State.PENDING, 300),
+                                  (State.STOPPED, 600),
+                                  (State.PENDING, 600))]
+        for task, priority in zip(tasks, (10, 0, 5)):
+            task.priority = priority
+            self.taskpile.enqueue(task)
+        self.taskpile.update()
+        assert_that(self.taskpile.running, contains(tasks[0], tasks[1]))
+        assert_that(self.taskpile.pending, contains(tasks[2]))
+
+    @patch('taskpile.core.available_memory')
+    def test_reserves_memory_not_yet_allocated_by_started_tasks(
+            self, available_memory):
+        available_memory.return_value = 1000
+        self.taskpile = Taskpile(max_parallel=4, memory_budget='available')
+        tasks = [self._create_mocktask_in_state(State.PENDING, memory=600)
+                 for i in range(2)]
+        self.taskpile.enqueue(tasks[0])
+        self.taskpile.update()
+        self.taskpile.enqueue(tasks[1])
+        self.taskpile.update()
+        assert_that(self.taskpile.running, contains(tasks[0]))
+        tasks[0].usage = ResourceUsage(rss=500)
+        self.taskpile.update()
+        assert_that(self.taskpile.running, contains(tasks[0], tasks[1]))
+
+    def test_takes_tasks_from_sources_only_up_to_lookahead(self):
+        self.taskpile = Taskpile(max_parallel=2, lookahead=3)
+        created = []
+
+        def create_tasks():
+            for i in range(10):
+                task = self._create_mocktask_in_state(State.PENDING)
+                created.append(task)
+                yield task
+
+        source = TaskSource(create_tasks(), total=10)
+        self.taskpile.add_source(source)
+        self.taskpile.update()
+        assert_that(self.taskpile.running, contains(*created[:2]))
+        assert_that(self.taskpile.pending, contains(*created[2:5]))
+        assert_that(len(created), is_(5))
+        assert_that(source.remaining, is_(5))
+        assert_that(self.taskpile.num_undrawn(), is_(5))
+
+    def test_keeps_next_task_of_every_source_pending(self):
+        self.taskpile = Taskpile(
+            max_parallel=1, lookahead=2, policy=PriorityPolicy())
+        low = [self._create_mocktask_in_state(State.PENDING)
+               for i in range(10)]
+        high = [self._create_mocktask_in_state(State.PENDING)
+                for i in range(2)]
+        for task in high:
+            task.priority = 10
+        for task in low:
+            task.priority = 0
+        self.taskpile.add_source(TaskSource(low))
+        self.taskpile.add_source(TaskSource(high))
+        self.taskpile.update()
+        assert_that(self.taskpile.running, contains(high[0]))
+        assert_that(self.taskpile.pending, contains(high[1], low[0]))
+
+    def test_notifies_about_exhausted_sources(self):
+        listener = MagicMock(spec=TaskpileListener)
+        self.taskpile.listeners.append(listener)
+        source = TaskSource([self._create_mocktask_in_state(State.PENDING)])
+        self.taskpile.add_source(source)
+        listener.on_source_added.assert_called_once_with(source)
+        self.taskpile.update()
+        listener.on_source_exhausted.assert_called_once_with(source)
+        assert_that(self.taskpile.sources, contains())
+        assert_that(source.error, is_(None))
+
+    def test_drops_source_failing_to_create_task(self):
+        def create_tasks():
+            yield self._create_mocktask_in_state(State.PENDING)
+            raise KeyError('undefined')
+
+        self.taskpile.max_parallel = 0
+        source = TaskSource(create_tasks())
+        self.taskpile.add_source(source)
+        self.taskpile.update()
+        assert_that(len(self.taskpile.pending), is_(1))
+        assert_that(self.taskpile.sources, contains())
+        assert_that(source.error, is_(KeyError))
+
+    def test_spec_task_source_creates_tasks_lazily(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write('__cmd__ = cmd {x}\n_x = 1, 2, 3\n')
+            f.flush()
+            source = SpecTaskSource(f.name, num_repeats=2, priority=3, drawn=2)
+            assert_that(source.total, is_(6))
+            assert_that(source.remaining, is_(4))
+            task = source.next_task()
+        assert_that(task, all_of(
+            has_property('command', 'cmd 3'), has_property('priority', 3)))
+        assert_that(source.drawn, is_(3))
+
+    def test_moves_reaped_tasks_to_finished_without_joining(self):
         task = self._create_mocktask_in_state(State.FINISHED)
-        self.taskpile.running = [task]
+        self.taskpile.running = TaskQueue([task])
+        self.taskpile.update()
+        assert_that(task.join.called, is_(False))
+        assert_that(self.taskpile.finished, contains(task))
+
+    @timelimit(2)
+    def test_kills_terminated_tasks_ignoring_sigterm_after_grace(self):
+        self.taskpile.max_parallel = 1
+        self.taskpile.kill_grace = 0.2
+        task = ExternalTask("trap '' TERM; sleep 10; true")
+        self.taskpile.enqueue(task)
         self.taskpile.update()
-        task.join.assert_called_once_with()
+        time.sleep(0.05)
+        start = time.time()
+        self.taskpile.terminate(task)
+        self.taskpile.update()
+        assert_that(time.time() - start, is_(less_than(0.1)))
+        assert_that(self.taskpile.running, contains(task))
+        assert_that(
+            self.taskpile.seconds_until_update(), is_(less_than(0.21)))
+        time.sleep(0.2)
+        while len(self.taskpile.finished) <= 0:
+            self.taskpile.update()
+            time.sleep(0.01)
+        assert_that(task.exitsignal, is_(signal.SIGKILL))
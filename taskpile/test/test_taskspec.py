@@ -1,5 +1,7 @@
 from hamcrest import all_of, assert_that, contains, contains_inanyorder, \
     contains_string, has_entries, is_
+from nose.tools import raises
+
 from taskpile.taskspec import TaskGroupSpec
 
 
@@ -115,3 +117,60 @@ class TestTaskGroupSpec(object):
         group = TaskGroupSpec.from_spec_str(spec_str)
         assert_that(group.iter_specs().next()['__cmd__'], is_(
             'cmd \'some string\'"\'"\'\''))
+
+    def test_counts_specs_without_generating_them(self):
+        spec_str = '''
+            __cmd__ = cmd
+            _value0 = 1, 2
+            [multitask]
+                _value1 = 3, 4, 5
+            [another_task]
+                value1 = 5
+            '''
+        group = TaskGroupSpec.from_spec_str(spec_str)
+        assert_that(group.count_specs(1, 3), is_(16))
+        assert_that(
+            group.count_specs(1, 3), is_(len(list(group.iter_specs(1, 3)))))
+
+    def test_supports_len_and_random_access(self):
+        spec_str = '''
+            __cmd__ = cmd {value0} {value2} {__repeat__}
+            _value0 = 1, 2
+            _value2 = a, b, c
+            [multitask]
+                _value1 = 3, 4, 5
+                [[nested]]
+                    _value3 = x, y
+            [another_task]
+                value1 = 5
+            '''
+        group = TaskGroupSpec.from_spec_str(spec_str)
+        specs = group.specs(1, 4)
+        expected = list(group.iter_specs(1, 4))
+        assert_that(len(group), is_(6 * 7))
+        assert_that(len(specs), is_(len(expected)))
+        assert_that(
+            [specs[i] for i in range(len(specs))], contains(*expected))
+        assert_that(specs[-1], is_(expected[-1]))
+        assert_that(specs[len(specs) // 2]['__repeat__'], is_(2))
+
+    def test_slices_specs(self):
+        spec_str = '''
+            __cmd__ = cmd {value0}
+            _value0 = 1, 2, 3, 4, 5
+            '''
+        group = TaskGroupSpec.from_spec_str(spec_str)
+        specs = group.specs(0, 2)
+        shard = specs[1::3]
+        assert_that(len(shard), is_(3))
+        assert_that(
+            [(s['__cmd__'], s['__repeat__']) for s in shard],
+            contains(('cmd 2', 0), ('cmd 5', 0), ('cmd 3', 1)))
+        assert_that(
+            [s['__cmd__'] for s in shard[::-2]], contains('cmd 3', 'cmd 2'))
+        assert_that(len(specs[8:2]), is_(0))
+
+    @raises(IndexError)
+    def test_raises_index_error_for_index_out_of_range(self):
+        group = TaskGroupSpec.from_spec_str('__cmd__ = cmd\n_x = 1, 2\n')
+        group[2]
@@ -1,20 +1,42 @@
 from __future__ import absolute_import
 
+import argparse
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+import itertools
+import mmap
 import multiprocessing
 import os
 import os.path
 import shlex
 import shutil
+import socket
 import subprocess
+import sys
 from tempfile import mkstemp
-from weakref import WeakKeyDictionary
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 import urwid
 
-from taskpile.core import State, Taskpile, ExternalTask
-from taskpile.sanitize import quote_for_shell
+from taskpile.accounting import get_usage, ResourceSampler
+from taskpile.archive import load_details, TaskArchive
+from taskpile.capture import OutputCapture, OutputFollower
+from taskpile.client import Client, default_socket_path, RemoteError
+from taskpile.core import ChildWatcher, ExternalTask, parse_memory_budget, \
+    SpecTaskSource, State, Taskpile, TaskpileListener, template_cache
+from taskpile.journal import Journal, JournalLockedError
+from taskpile.loadcontrol import LoadController
+from taskpile.placement import PlacementEngine
+from taskpile.sanitize import parse_size, quote_for_shell
+from taskpile.server import ServerError, state_names, TaskpileServer
+from taskpile.scheduling import FifoPolicy, PriorityPolicy, \
+    ShortestJobFirstPolicy
+from taskpile.search import BackgroundSearch, compile_pattern
 from taskpile.signalnames import signalnames
-from taskpile.taskspec import TaskGroupSpec
 
 
 def tabbed_focus(cls):
@@ -130,26 +152,45 @@ class NewTaskInputs(urwid.ListBox):
     def __init__(self, template=None):
         self.__split_command = []
         self.original_files = {}
+        self.cwd = None
+        self.template_spec = None
         self.name = urwid.Edit("Task name: ")
         self.command = urwid.Edit("Command: ")
         self._command_attr_map = urwid.AttrMap(self.command, 'failure')
         self.niceness = IntEditWithNegNumbers("Niceness: ", '20')
         self._niceness_attr_map = urwid.AttrMap(self.niceness, None)
-        controls = [self._command_attr_map, self.name, self._niceness_attr_map]
+        # Single tasks are usually more urgent than task groups from specs.
+        self.priority = IntEditWithNegNumbers("Priority: ", '1')
+        self._priority_attr_map = urwid.AttrMap(self.priority, None)
+        controls = [
+            self._command_attr_map, self.name, self._niceness_attr_map,
+            self._priority_attr_map]
         self._num_fixed_elements = len(controls)
         walker = urwid.SimpleFocusListWalker(controls)
         urwid.connect_signal(self.command, 'change', self._on_command_change)
         urwid.connect_signal(self.niceness, 'change', self._on_niceness_change)
+        urwid.connect_signal(self.priority, 'change', self._on_priority_change)
         urwid.ListBox.__init__(self, walker)
 
         if template is not None:
             self.init_from_template(template)
 
     def init_from_template(self, template):
-        self.original_files = template.original_files
-        self.command.set_edit_text(template.command)
-        if template.command != template.name:
+        self.cwd = template.cwd
+        if template.template_spec is not None:
+            # Rendered template files are removed when the task finishes.
+            # The copy renders the templates again instead.
+            self.template_spec = dict(template.template_spec)
+            command = template.unrendered_command
+            if command is None:
+                command = template.command
+        else:
+            self.original_files = template.original_files
+            command = template.command
+        self.command.set_edit_text(command)
+        if command != template.name:
             self.name.set_edit_text(template.name)
+        self.priority.set_edit_text(str(template.priority))
         for i, f in enumerate(self._get_files(), 1):
             if f in self.original_files:
                 copy = self._create_tmp_file_for(self.original_files[f])
@@ -263,6 +304,14 @@ class NewTaskInputs(urwid.ListBox):
             return
         self._niceness_attr_map.set_attr_map({'failure': None})
 
+    def _on_priority_change(self, w, value):
+        try:
+            value = int(value)
+        except ValueError:
+            self._priority_attr_map.set_attr_map({None: 'failure'})
+            return
+        self._priority_attr_map.set_attr_map({'failure': None})
+
     def validate(self):
         if self.command.edit_text == '':
             raise InputValidationError('Empty command string.')
@@ -270,6 +319,10 @@ class NewTaskInputs(urwid.ListBox):
             int(self.niceness.edit_text)
         except ValueError:
             raise InputValidationError('Invalid niceness.')
+        try:
+            int(self.priority.edit_text)
+        except ValueError:
+            raise InputValidationError('Invalid priority.')
 
 
 class NewTaskGroupFromSpecInputs(urwid.ListBox):
@@ -278,6 +331,8 @@ class NewTaskGroupFromSpecInputs(urwid.ListBox):
         self._filename_attr_map = urwid.AttrMap(self.filename, 'failure')
         self.niceness = IntEditWithNegNumbers("Niceness: ", '20')
         self._niceness_attr_map = urwid.AttrMap(self.niceness, None)
+        self.priority = IntEditWithNegNumbers("Priority: ", '0')
+        self._priority_attr_map = urwid.AttrMap(self.priority, None)
         self.num_repeats = urwid.IntEdit("Repeats: ", '1')
         self._num_repeats_attr_map = urwid.AttrMap(self.num_repeats, None)
         self.start_repeat = urwid.IntEdit("Start repeat: ", '0')
@@ -285,11 +340,12 @@ class NewTaskGroupFromSpecInputs(urwid.ListBox):
         self.error = urwid.Text('')
         controls = [
             self._filename_attr_map, self._niceness_attr_map,
-            self._num_repeats_attr_map, self.error,
+            self._priority_attr_map, self._num_repeats_attr_map, self.error,
             self._start_repeat_attr_map]
         walker = urwid.SimpleFocusListWalker(controls)
         urwid.connect_signal(self.filename, 'change', self._on_filename_change)
         urwid.connect_signal(self.niceness, 'change', self._on_niceness_change)
+        urwid.connect_signal(self.priority, 'change', self._on_priority_change)
         urwid.connect_signal(
             self.num_repeats, 'change', self._on_num_repeats_change)
         urwid.connect_signal(
@@ -328,6 +384,14 @@ class NewTaskGroupFromSpecInputs(urwid.ListBox):
             return
         self._niceness_attr_map.set_attr_map({'failure': None})
 
+    def _on_priority_change(self, w, value):
+        try:
+            value = int(value)
+        except ValueError:
+            self._priority_attr_map.set_attr_map({None: 'failure'})
+            return
+        self._priority_attr_map.set_attr_map({'failure': None})
+
     def _on_num_repeats_change(self, w, value):
         try:
             value = int(value)
@@ -356,6 +420,10 @@ class NewTaskGroupFromSpecInputs(urwid.ListBox):
             int(self.num_repeats.edit_text)
         except ValueError:
             raise InputValidationError('Invalid niceness.')
+        try:
+            int(self.priority.edit_text)
+        except ValueError:
+            raise InputValidationError('Invalid priority.')
 
 
 class InputValidationError(Exception):
@@ -383,13 +451,25 @@ class NewTaskDialog(Dialog):
     def get_original_files(self):
         return self._inputs.original_files
 
+    def get_cwd(self):
+        return self._inputs.cwd
+
+    def get_template_spec(self):
+        return self._inputs.template_spec
+
     def get_niceness(self):
         return int(self._inputs.niceness.edit_text)
 
+    def get_priority(self):
+        return int(self._inputs.priority.edit_text)
+
     name = property(get_name)
     command = property(get_command)
     original_files = property(get_original_files)
+    cwd = property(get_cwd)
+    template_spec = property(get_template_spec)
     niceness = property(get_niceness)
+    priority = property(get_priority)
 
 
 class NewTaskGroupFromSpecDialog(Dialog):
@@ -407,6 +487,9 @@ class NewTaskGroupFromSpecDialog(Dialog):
     def get_niceness(self):
         return int(self._inputs.niceness.edit_text)
 
+    def get_priority(self):
+        return int(self._inputs.priority.edit_text)
+
     def get_num_repeats(self):
         return int(self._inputs.num_repeats.edit_text)
 
@@ -421,11 +504,29 @@ class NewTaskGroupFromSpecDialog(Dialog):
 
     filename = property(get_filename)
     niceness = property(get_niceness)
+    priority = property(get_priority)
     num_repeats = property(get_num_repeats)
     start_repeat = property(get_start_repeat)
     error = property(get_error, set_error)
 
 
+def format_size(num_bytes):
+    for unit in 'BKMGT':
+        if num_bytes < 1000 or unit == 'T':
+            break
+        num_bytes /= 1024.
+    if unit == 'B' or num_bytes >= 10:
+        return '{:.0f}{}'.format(num_bytes, unit)
+    return '{:.1f}{}'.format(num_bytes, unit)
+
+
+def format_duration(seconds):
+    for unit, length in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= length:
+            return '{:.0f}{}'.format(seconds // length, unit)
+    return '{:.0f}s'.format(seconds)
+
+
 class TaskView(urwid.AttrMap):
     state_indicators = {
         State.PENDING: ' ',
@@ -434,12 +535,18 @@ class TaskView(urwid.AttrMap):
         State.STOPPED: 'Stopped'
     }
 
-    def __init__(self, task):
+    def __init__(self, task, taskpile):
         self.task = task
+        self.taskpile = taskpile
         self.state = urwid.Text('', wrap='clip')
         self.pid = urwid.Text('', 'right', wrap='clip')
         self.name = urwid.Text('', wrap='clip')
-        w = urwid.Columns([(6, self.pid), (1, self.state), self.name], 1)
+        self.cpu = urwid.Text('', 'right', wrap='clip')
+        self.mem = urwid.Text('', 'right', wrap='clip')
+        self.io = urwid.Text('', 'right', wrap='clip')
+        w = urwid.Columns([
+            (6, self.pid), (1, self.state), (5, self.cpu), (5, self.mem),
+            (5, self.io), self.name], 1)
         super(TaskView, self).__init__(w, None, 'focus')
         self.update()
 
@@ -449,7 +556,7 @@ class TaskView(urwid.AttrMap):
     def keypress(self, size, key):
         if key == 'k':
             def terminate():
-                self.task.terminate()
+                self.taskpile.terminate(self.task)
                 self.update()
 
             confirm_diag = Dialog(urwid.Filler(urwid.Padding(urwid.Text(
@@ -465,6 +572,19 @@ class TaskView(urwid.AttrMap):
     def update(self):
         self.state.set_text(self.state_indicators[self.task.state])
         self.pid.set_text(str(self.task.pid))
+        usage = get_usage(self.task)
+        if usage is None:
+            self.cpu.set_text('')
+            self.mem.set_text('')
+            self.io.set_text('')
+        else:
+            if self.task.rusage is not None or usage.cpu_percent is None:
+                self.cpu.set_text(format_duration(usage.cpu_time))
+            else:
+                self.cpu.set_text('{:.0f}%'.format(usage.cpu_percent))
+            self.mem.set_text(format_size(usage.rss))
+            self.io.set_text(
+                format_size(usage.read_bytes + usage.write_bytes))
         exitcode_str = ''
         if self.task.exitcode is not None:
             if self.task.exitsignal is not None and self.task.exitsignal != 0:
@@ -487,58 +607,215 @@ class TaskView(urwid.AttrMap):
             urwid.Columns([
                 (6, urwid.Text('PID', 'right', wrap='clip')),
                 (1, urwid.Text('Status', wrap='clip')),
+                (5, urwid.Text('CPU', 'right', wrap='clip')),
+                (5, urwid.Text('Mem', 'right', wrap='clip')),
+                (5, urwid.Text('I/O', 'right', wrap='clip')),
                 urwid.Text('Task', wrap='clip')], 1),
             'tbl_header')
 
 
+class SearchDialog(Dialog):
+    def __init__(self, pattern=''):
+        self._pattern = urwid.Edit('Regular expression: ', pattern)
+        self._error = urwid.Text('')
+        super(SearchDialog, self).__init__(
+            urwid.ListBox(urwid.SimpleFocusListWalker(
+                [self._pattern, self._error])),
+            ('relative', 75), ('relative', 25), 'Search')
+
+    def get_pattern(self):
+        return self._pattern.edit_text
+
+    def get_error(self):
+        return self._error.text
+
+    def set_error(self, msg):
+        self._error.set_text(('failure', msg))
+
+    pattern = property(get_pattern)
+    error = property(get_error, set_error)
+
+
+def ask_for_search_pattern(callback, pattern=''):
+    """Shows a :class:`SearchDialog` and calls `callback` with the compiled
+    pattern."""
+    dialog = SearchDialog(pattern)
+
+    def on_ok():
+        try:
+            regex = compile_pattern(dialog.pattern)
+        except Exception as err:
+            dialog.error = 'Error: {}'.format(err)
+            dialog.show()
+            return
+        callback(regex)
+
+    urwid.connect_signal(dialog, 'ok', on_ok)
+    dialog.show()
+
+
+def start_search(filenames, regex, on_result, on_done):
+    """Searches the outputs `filenames` in the background and calls
+    ``on_result(filename, offsets)`` for each batch of hits and `on_done`
+    at the end in the main loop. Returns the :class:`BackgroundSearch`."""
+    def on_wakeup(data):
+        while True:
+            try:
+                filename, offsets = search.results.get_nowait()
+            except queue.Empty:
+                return True
+            if filename is None:
+                os.close(write_fd)
+                on_done()
+                return False  # Removes the watch.
+            on_result(filename, offsets)
+
+    write_fd = ModalWidget.mainloop.watch_pipe(on_wakeup)
+    search = BackgroundSearch(
+        filenames, regex, notify=lambda: os.write(write_fd, b'\0'))
+    return search
+
+
 class FileWalker(urwid.ListWalker):
+    """Walks the lines of `file`.
+
+    Positions are the byte offsets of the line starts. Lines are looked up on
+    demand in a memory map of the file, so opening the file and scrolling
+    take the same time regardless of the file size. Call :meth:`update` to
+    add lines appended to the file.
+
+    The file may be the output file of a running task, which
+    :class:`taskpile.capture.OutputCapture` truncates when rotating it.
+    Reading a memory map beyond the end of the file raises ``SIGBUS``, thus
+    the size of the file is checked before each access and the map is
+    dropped once the file shrank.
+    """
+
     def __init__(self, file):
         self.file = file
         self.focus = 0
-        self.linepos = [0]
+        self._map = None
+        self._end = 0
         super(FileWalker, self).__init__()
+        self._map_file()
         self.move_to_end()
 
-    def __getitem__(self, position):
-        if position < len(self.linepos):
-            self.file.seek(self.linepos[position], 0)
+    def _map_file(self):
+        if self._map is not None:
+            self._map.close()
+        try:
+            self._map = mmap.mmap(
+                self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty files cannot be mapped.
+            self._map = None
+        self._size = 0 if self._map is None else len(self._map)
+        self._end = self._size
+        if self._end > 0 and self._map[self._end - 1:self._end] == b'\n':
+            self._end -= 1
+
+    def update(self):
+        """Adds the lines appended to the file since the last update.
+
+        If the focus is on the last line, it is moved to the new last line.
+        Only the appended bytes are inspected.
+        """
+        size = os.fstat(self.file.fileno()).st_size
+        if size < self._size:
+            # Truncated. Positions do not refer to the same lines anymore.
+            self._map_file()
+            self.move_to_end()
+            return
+        elif size == self._size:
+            return
+        at_end = self.focus == self._line_start(self._end)
+        self._map_file()
+        if at_end:
+            self.move_to_end()
         else:
-            self.file.seek(self.linepos[-1], 0)
-        for i in range(len(self.linepos), position + 1):
-            line = self.file.readline()
-            if line == '':
-                raise IndexError()
-            self.linepos.append(self.file.tell())
-        line = self.file.readline()
-        return urwid.Text(line.rstrip())
+            self._modified()
+
+    def _check_size(self):
+        if self._map is not None and \
+                os.fstat(self.file.fileno()).st_size < self._size:
+            self.close()
+            self._size = self._end = 0
+            self.focus = 0
+
+    def _line_start(self, position):
+        self._check_size()
+        if self._map is None:
+            return 0
+        return self._map.rfind(b'\n', 0, position) + 1
+
+    def _line_end(self, position):
+        self._check_size()
+        if self._map is None:
+            return 0
+        end = self._map.find(b'\n', position, self._end)
+        return self._end if end < 0 else end
+
+    def __getitem__(self, position):
+        self._check_size()
+        if position < 0 or position > self._end:
+            raise IndexError()
+        if self._map is None:
+            return urwid.Text('')
+        end = self._line_end(position)
+        return urwid.Text(self._map[position:end].rstrip())
 
     def next_position(self, position):
-        self[position + 1]  # check if position is valid
-        return position + 1
+        end = self._line_end(position)
+        if end >= self._end:
+            raise IndexError()
+        return end + 1
 
     def prev_position(self, position):
         if position < 1:
             raise IndexError()
-        return position - 1
+        return self._line_start(position - 1)
 
     def set_focus(self, position):
         self.focus = position
         self._modified()
 
     def move_to_end(self):
-        try:
-            while True:
-                self.set_focus(self.next_position(self.focus))
-        except IndexError:
-            pass
+        self.set_focus(self._line_start(self._end))
+
+    def close(self):
+        """Unmaps the file. The file itself is not closed."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
 
 
 class IOView(ModalWidget):
-    def __init__(self, title, stdout, stderr):
-        self.stdout_file = stdout
-        self.stderr_file = stderr
-        self.stdout = urwid.ListBox(FileWalker(stdout))
-        self.stderr = urwid.ListBox(FileWalker(stderr))
+    """Shows the output of a task, given by the names of its output files.
+
+    While the view is shown, output written by the task is added every
+    `follow_interval` seconds. The view stays at the end of the output if
+    the last line is focused.
+
+    Both outputs can be searched with :meth:`search`. Lines found are
+    focused with ``n`` (next) and ``N`` (previous).
+    """
+
+    follow_interval = 0.5
+
+    def __init__(self, title, stdout_name, stderr_name):
+        self._followers = {}
+        self._views = {}
+        for stream, filename in (
+                ('stdout', stdout_name), ('stderr', stderr_name)):
+            self._followers[stream] = OutputFollower(filename)
+            self._views[stream] = self._create_view(
+                self._followers[stream].file)
+        self.stdout = self._views['stdout']
+        self.stderr = self._views['stderr']
+        self._stream = 'stdout'
+        self._alarm = None
+        self._search = None
+        self._hits = {}
+        self._search_status = urwid.Text('')
 
         title = urwid.Text(('title', title))
         bgroup = []
@@ -554,59 +831,391 @@ class IOView(ModalWidget):
         self.textview = urwid.WidgetPlaceholder(self.stdout)
         w = urwid.Pile([
             ('pack', title), ('pack', buttons), ('pack', divider),
-            self.textview, ('pack', divider), ('pack', footer)])
+            self.textview, ('pack', divider), ('pack', self._search_status),
+            ('pack', footer)])
         w = urwid.LineBox(urwid.Padding(w, left=1, right=1))
         super(IOView, self).__init__(w, ('relative', 100), ('relative', 100))
 
+    @staticmethod
+    def _create_view(file):
+        view = urwid.ListBox(FileWalker(file))
+        view.set_focus_valign('bottom')
+        return view
+
+    def show(self):
+        super(IOView, self).show()
+        if self._alarm is None:
+            self._follow()
+
+    def _follow(self, loop=None, user_data=None):
+        for stream, follower in self._followers.items():
+            if follower.update():
+                self._views[stream].body.update()
+                continue
+            # The output was rotated and is read from a new file.
+            self._views[stream].body.close()
+            view = self._create_view(follower.file)
+            if self.textview.original_widget is self._views[stream]:
+                self.textview.original_widget = view
+            self._views[stream] = view
+            setattr(self, stream, view)
+        self._alarm = self.mainloop.set_alarm_in(
+            self.follow_interval, self._follow)
+
     def keypress(self, size, key):
         key = super(IOView, self).keypress(size, key)
         if key == 'esc':
-            self.hide()
+            self.close()
+            key = None
+        elif key == '/':
+            pattern = ''
+            if self._search is not None:
+                pattern = self._search.regex.pattern
+            ask_for_search_pattern(self.search, pattern)
+            key = None
+        elif key in ('n', 'N'):
+            self._focus_hit(forward=key == 'n')
             key = None
         return key
 
+    def search(self, regex):
+        """Searches both outputs for compiled `regex` in the background."""
+        if self._search is not None:
+            self._search.cancel()
+        streams = dict(
+            (follower.filename, stream)
+            for stream, follower in self._followers.items())
+        self._hits = dict((stream, []) for stream in self._followers)
+
+        def on_result(filename, offsets):
+            if search is self._search:
+                self._hits[streams[filename]].extend(offsets)
+                self._update_search_status(False)
+
+        def on_done():
+            if search is self._search:
+                self._update_search_status(True)
+
+        search = start_search(list(streams), regex, on_result, on_done)
+        self._search = search
+        self._update_search_status(False)
+
+    def _update_search_status(self, done):
+        self._search_status.set_text(
+            "'{}': {} lines in stdout, {} in stderr{} (n/N: next/previous)"
+            .format(
+                self._search.regex.pattern, len(self._hits['stdout']),
+                len(self._hits['stderr']), '' if done else ', searching'))
+
+    def _focus_hit(self, forward):
+        hits = self._hits.get(self._stream, [])
+        view = self._views[self._stream]
+        if forward:
+            i = bisect_right(hits, view.body.focus)
+        else:
+            i = bisect_left(hits, view.body.focus) - 1
+        if i < 0 or i >= len(hits):
+            return
+        view.body.update()
+        try:
+            view.body[hits[i]]
+        except IndexError:
+            return  # Found in output rotated meanwhile.
+        view.set_focus(hits[i])
+        view.set_focus_valign('middle')
+
+    def close(self):
+        if self._alarm is not None:
+            self.mainloop.remove_alarm(self._alarm)
+            self._alarm = None
+        if self._search is not None:
+            self._search.cancel()
+            self._search = None
+        for stream, follower in self._followers.items():
+            self._views[stream].body.close()
+            follower.close()
+        self.hide()
+
     def on_stdout_btn_change(self, btn, state):
         if state:
+            self._stream = 'stdout'
             self.textview.original_widget = self.stdout
 
     def on_stderr_btn_change(self, btn, state):
         if state:
+            self._stream = 'stderr'
             self.textview.original_widget = self.stderr
 
     def on_back_btn_click(self, btn):
-        self.stdout_file.close()
-        self.stderr_file.close()
+        self.close()
+
+
+class SearchHitView(urwid.AttrMap):
+    def __init__(self, task):
+        self.task = task
+        self.hits = 0
+        self._text = urwid.Text('', wrap='clip')
+        super(SearchHitView, self).__init__(self._text, None, 'focus')
+
+    def selectable(self):
+        return True
+
+    def keypress(self, size, key):
+        return key
+
+    def add_hits(self, num):
+        self.hits += num
+        self._text.set_text('{:>8} {}'.format(self.hits, self.task.name))
+
+
+class SearchResultsView(ModalWidget):
+    """Searches the outputs of `tasks` for compiled `regex` and lists the
+    tasks with matching lines as they are found. Enter shows the output of
+    the selected task."""
+
+    def __init__(self, tasks, regex):
+        self.regex = regex
+        self._num_tasks = len(tasks)
+        self._tasks = {}
+        for task in tasks:
+            self._tasks[task.outbuf_name] = task
+            self._tasks[task.errbuf_name] = task
+        self._hit_views = {}
+        self._results = urwid.SimpleFocusListWalker([])
+        self._status = urwid.Text('')
+        title = urwid.Text(('title', "Tasks with output matching '{}'".format(
+            regex.pattern)))
+        back_btn = urwid.Button('Back')
+        urwid.connect_signal(back_btn, 'click', self.on_back_btn_click)
+        w = urwid.Pile([
+            ('pack', title), ('pack', urwid.Divider('-')),
+            ('pack', urwid.AttrMap(urwid.Columns([
+                (8, urwid.Text('Lines', 'right', wrap='clip')),
+                urwid.Text('Task', wrap='clip')], 1), 'tbl_header')),
+            urwid.ListBox(self._results), ('pack', urwid.Divider('-')),
+            ('pack', self._status),
+            ('pack', ButtonPane([back_btn], align='left'))])
+        w = urwid.LineBox(urwid.Padding(w, left=1, right=1))
+        super(SearchResultsView, self).__init__(
+            w, ('relative', 100), ('relative', 100))
+        self._search = start_search(
+            list(self._tasks), regex, self._on_result, self._on_done)
+        self._update_status(False)
+
+    def _on_result(self, filename, offsets):
+        task = self._tasks[filename]
+        view = self._hit_views.get(task)
+        if view is None:
+            view = SearchHitView(task)
+            self._hit_views[task] = view
+            self._results.append(view)
+        view.add_hits(len(offsets))
+        self._update_status(False)
+
+    def _on_done(self):
+        self._update_status(True)
+
+    def _update_status(self, done):
+        self._status.set_text('{} of {} tasks{}'.format(
+            len(self._hit_views), self._num_tasks,
+            '' if done else ', searching'))
+
+    def keypress(self, size, key):
+        key = super(SearchResultsView, self).keypress(size, key)
+        focus_widget, _ = self._results.get_focus()
+        if key == 'esc':
+            self.close()
+            key = None
+        elif key == 'enter' and focus_widget is not None:
+            task = focus_widget.task
+            view = IOView(
+                "Output of task '%s' (%i)" % (task.name, task.pid),
+                task.outbuf_name, task.errbuf_name)
+            view.show()
+            view.search(self.regex)
+            key = None
+        return key
+
+    def close(self):
+        self._search.cancel()
         self.hide()
 
+    def on_back_btn_click(self, btn):
+        self.close()
+
+
+class TaskWalker(urwid.ListWalker, TaskpileListener):
+    """Lists the running, pending and finished (latest first) tasks of
+    `taskpile`.
+
+    Positions are the tasks themselves, so the focus stays on a task when
+    it moves to another queue. A :class:`TaskView` is only created for
+    tasks urwid displays and at most `max_views` views are kept. Thus, the
+    cost of :meth:`update` depends on the screen height and not on the
+    number of tasks.
+    """
+
+    max_views = 256
+
+    def __init__(self, taskpile):
+        self.taskpile = taskpile
+        self.focus = None
+        self._views = OrderedDict()
+        self._changed = set()
+        self._finished_positions = {}
+        super(TaskWalker, self).__init__()
+        taskpile.listeners.append(self)
+
+    def on_started(self, task):
+        self._changed.add(task)
+
+    def on_stopped(self, task):
+        self._changed.add(task)
+
+    def on_continued(self, task):
+        self._changed.add(task)
+
+    def on_finished(self, task):
+        self._changed.add(task)
+
+    def on_archived(self, task, summary):
+        # The summary takes the place of the task in the finished list.
+        i = self._finished_positions.pop(task, None)
+        if i is not None:
+            self._finished_positions[summary] = i
+        self._views.pop(task, None)
+        self._changed.discard(task)
+        if self.focus is task:
+            self.focus = summary
+
+    def _finished_position(self, task):
+        """Returns the index of `task` in the finished list or ``None``."""
+        finished = self.taskpile.finished
+        for i in range(len(self._finished_positions), len(finished)):
+            self._finished_positions[finished[i]] = i
+        return self._finished_positions.get(task)
+
+    def _first(self):
+        if len(self.taskpile.running) > 0:
+            return self.taskpile.running.peek()
+        return self._first_after_running()
+
+    def _first_after_running(self):
+        if len(self.taskpile.pending) > 0:
+            return self.taskpile.pending.peek()
+        return self._first_finished()
+
+    def _first_finished(self):
+        if len(self.taskpile.finished) > 0:
+            return self.taskpile.finished[-1]
+        return None
+
+    def _last(self):
+        taskpile = self.taskpile
+        if len(taskpile.finished) > 0:
+            return taskpile.finished[0]
+        elif len(taskpile.pending) > 0:
+            return taskpile.pending.last()
+        elif len(taskpile.running) > 0:
+            return taskpile.running.last()
+        return None
+
+    def _contains(self, task):
+        return task in self.taskpile.running or \
+            task in self.taskpile.pending or \
+            self._finished_position(task) is not None
+
+    def __getitem__(self, position):
+        if position is None or not self._contains(position):
+            raise IndexError()
+        view = self._views.pop(position, None)
+        if view is None:
+            view = TaskView(position, self.taskpile)
+            self._changed.discard(position)
+            if len(self._views) >= self.max_views:
+                self._views.popitem(last=False)
+        self._views[position] = view
+        return view
+
+    def next_position(self, position):
+        taskpile = self.taskpile
+        if position in taskpile.running:
+            task = taskpile.running.next_task(position)
+            if task is None:
+                task = self._first_after_running()
+        elif position in taskpile.pending:
+            task = taskpile.pending.next_task(position)
+            if task is None:
+                task = self._first_finished()
+        else:
+            i = self._finished_position(position)
+            if i is None:
+                raise IndexError()
+            task = taskpile.finished[i - 1] if i > 0 else None
+        if task is None:
+            raise IndexError()
+        return task
+
+    def prev_position(self, position):
+        taskpile = self.taskpile
+        task = None
+        if position in taskpile.running:
+            task = taskpile.running.prev_task(position)
+        elif position in taskpile.pending:
+            task = taskpile.pending.prev_task(position)
+            if task is None and len(taskpile.running) > 0:
+                task = taskpile.running.last()
+        else:
+            i = self._finished_position(position)
+            if i is None:
+                raise IndexError()
+            i += 1
+            if i < len(taskpile.finished):
+                task = taskpile.finished[i]
+            elif len(taskpile.pending) > 0:
+                task = taskpile.pending.last()
+            elif len(taskpile.running) > 0:
+                task = taskpile.running.last()
+        if task is None:
+            raise IndexError()
+        return task
+
+    def positions(self, reverse=False):
+        if reverse:
+            position, step = self._last(), self.prev_position
+        else:
+            position, step = self._first(), self.next_position
+        while position is not None:
+            yield position
+            try:
+                position = step(position)
+            except IndexError:
+                return
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def update(self):
+        """Updates the kept views of running tasks and of tasks which
+        changed their state."""
+        for task, view in self._views.items():
+            if task in self._changed or task in self.taskpile.running:
+                view.update()
+        self._changed.clear()
+        if self.focus is None or not self._contains(self.focus):
+            self.focus = self._first()
+        self._modified()
+
 
 class TaskList(urwid.ListBox):
     def __init__(self, taskpile):
         self.taskpile = taskpile
-        self._model_to_view = WeakKeyDictionary()
-        super(TaskList, self).__init__(urwid.SimpleFocusListWalker([]))
+        super(TaskList, self).__init__(TaskWalker(taskpile))
 
     def update(self):
         self.taskpile.update()
-        tasks = self.taskpile.running + self.taskpile.pending + \
-            self.taskpile.finished[::-1]
-        focus_widget, focus_pos = self.body.get_focus()
-        self.body[:] = [self._get_view_for_task(t) for t in tasks]
-        if focus_pos is not None:
-            try:
-                new_focus = self.body.index(focus_widget)
-            except:
-                new_focus = max(len(self.body) - 1, focus_pos)
-            self.body.set_focus(new_focus)
-        for view in self.body:
-            view.update()
-
-    def _get_view_for_task(self, task):
-        try:
-            return self._model_to_view[task]
-        except KeyError:
-            view = TaskView(task)
-            self._model_to_view[task] = view
-            return view
+        self.body.update()
 
     def keypress(self, size, key):
         key = super(TaskList, self).keypress(size, key)
@@ -617,32 +1226,44 @@ class TaskList(urwid.ListBox):
         selected_process_started = focus_widget is not None and \
             focus_widget.task.pid is not None
         if key == 'enter' and selected_process_started:
-            outbuf = open(focus_widget.task.outbuf_name)
-            errbuf = open(focus_widget.task.errbuf_name)
             IOView(
                 "Output of task '%s' (%i)" %
                 (focus_widget.task.name, focus_widget.task.pid),
-                outbuf, errbuf).show()
+                focus_widget.task.outbuf_name,
+                focus_widget.task.errbuf_name).show()
             key = None
         elif key == 'a':
             self.add_task_with_dialog(NewTaskDialog())
             key = None
         elif key == 'c' and focus_widget is not None:
-            self.add_task_with_dialog(NewTaskDialog(focus_widget.task))
+            self.add_task_with_dialog(
+                NewTaskDialog(load_details(focus_widget.task)))
             key = None
         elif key == 's':
             self.add_tasks_from_spec()
             key = None
+        elif key == '/':
+            ask_for_search_pattern(self.search_outputs)
+            key = None
 
         return key
 
+    def search_outputs(self, regex):
+        tasks = [
+            t for t in itertools.chain(
+                self.taskpile.running, self.taskpile.pending,
+                reversed(self.taskpile.finished))
+            if getattr(t, 'outbuf_name', None) is not None]
+        SearchResultsView(tasks, regex).show()
+
     def add_task_with_dialog(self, dialog):
         def callback():
             try:
                 dialog.validate()
                 task = ExternalTask(
                     dialog.command, dialog.name, dialog.original_files,
-                    niceness=dialog.niceness)
+                    niceness=dialog.niceness, priority=dialog.priority,
+                    cwd=dialog.cwd, template_spec=dialog.template_spec)
                 self.taskpile.enqueue(task)
                 self.update()
             except InputValidationError:
@@ -658,27 +1279,59 @@ class TaskList(urwid.ListBox):
         def callback():
             try:
                 dialog.validate()
-                group_spec = TaskGroupSpec.from_spec_file(dialog.filename)
-                for spec in group_spec.iter_specs(
-                        dialog.start_repeat, dialog.num_repeats):
-                    task = ExternalTask.from_task_spec(
-                        spec, niceness=dialog.niceness)
-                    self.taskpile.enqueue(task)
-                self.update()
+                source = SpecTaskSource(
+                    dialog.filename, dialog.start_repeat, dialog.num_repeats,
+                    niceness=dialog.niceness, priority=dialog.priority)
+                # Create the first task right away to report errors in the
+                # spec while the dialog is still open.
+                task = source.next_task()
+                if task is not None:
+                    task.render_templates()
             except Exception as err:
-                msg = 'Error: '
-                if isinstance(err, KeyError):
-                    msg += 'Undefined replacement key {}'.format(str(err))
-                else:
-                    msg += str(err)
-                dialog.error = msg
+                dialog.error = format_spec_error(err)
                 dialog.show()
+                return
+            if task is not None:
+                self.taskpile.enqueue(task)
+                self.taskpile.add_source(source)
+            self.update()
 
         urwid.connect_signal(dialog, 'ok', callback)
         dialog.show()
 
 
+def format_spec_error(err):
+    msg = 'Error: '
+    if isinstance(err, KeyError):
+        msg += 'Undefined replacement key {}'.format(str(err))
+    else:
+        msg += str(err)
+    return msg
+
+
+class SourceErrorReporter(TaskpileListener):
+    """Shows a dialog if creating a task from a task source failed."""
+
+    def on_source_exhausted(self, source):
+        if source.error is None:
+            return
+        Dialog(urwid.Filler(urwid.Padding(urwid.Text(
+            "Stopped creating tasks from '{}' after {} tasks.\n{}".format(
+                source.name, source.drawn,
+                format_spec_error(source.error))))),
+            ('relative', 75), ('relative', 25), 'OK').show()
+
+
 class Sidebar(urwid.Pile):
+    __metaclass__ = urwid.MetaSignals
+    signals = ['change']
+
+    policies = [
+        ('FIFO', FifoPolicy),
+        ('Priority', PriorityPolicy),
+        ('Shortest first', ShortestJobFirstPolicy)
+    ]
+
     def __init__(self, taskpile):
         self.taskpile = taskpile
         max_jobs_edit = urwid.IntEdit(
@@ -686,17 +1339,38 @@ class Sidebar(urwid.Pile):
         self._max_jobs_attr_map = urwid.AttrMap(max_jobs_edit, None)
         urwid.connect_signal(
             max_jobs_edit, 'change', self._on_max_jobs_changed)
+        self._max_parallel = taskpile.max_parallel
+        adapt_checkbox = urwid.CheckBox(
+            'Adapt to load', taskpile.controller is not None,
+            on_state_change=self._on_adapt_changed)
+        start_gap_edit = urwid.IntEdit(
+            'Start gap (ms): ', int(1000 * taskpile.min_start_interval))
+        self._start_gap_attr_map = urwid.AttrMap(start_gap_edit, None)
+        urwid.connect_signal(
+            start_gap_edit, 'change', self._on_start_gap_changed)
+        policy_group = []
+        policy_buttons = [urwid.RadioButton(
+            policy_group, label, isinstance(taskpile.pending, policy),
+            on_state_change=self._on_policy_changed, user_data=policy)
+            for label, policy in self.policies]
+        self._status = urwid.Text('')
         controls = [
+            ('pack', urwid.Divider()),
+            ('pack', self._status),
             ('pack', urwid.Divider()),
             urwid.ListBox(urwid.SimpleFocusListWalker([
-                self._max_jobs_attr_map
-            ])),
+                self._max_jobs_attr_map,
+                adapt_checkbox,
+                self._start_gap_attr_map,
+                urwid.Text('Scheduling:')
+            ] + policy_buttons)),
             ('pack', urwid.Text("""
 Keys:
 a: Add new task
 c: Copy selected task
 s: Create tasks from spec
 k: Kill selected task
+/: Search outputs
 q: Quit
 """.strip())),
             ('pack', urwid.Divider())
@@ -707,24 +1381,73 @@ q: Quit
                 ('failure', "Not running in screen!"))))
 
         super(Sidebar, self).__init__(controls)
+        self.update()
+
+    def update(self):
+        taskpile = self.taskpile
+        num_finished = len(taskpile.finished)
+        num_running = len(taskpile.running)
+        num_pending = len(taskpile.pending)
+        num_undrawn = taskpile.num_undrawn()
+        total = num_finished + num_running + num_pending + num_undrawn
+        status = 'Finished: {}/{}\nRunning: {}\nPending: {}\n' \
+            'Not created yet: {}'.format(
+                num_finished, total, num_running, num_pending, num_undrawn)
+        if taskpile.controller is not None:
+            status += '\nParallel target: {}'.format(taskpile.max_parallel)
+        self._status.set_text(status)
 
     def _on_max_jobs_changed(self, w, value):
         value = int(value) if value != '' else -1
         if value >= 0 and value <= multiprocessing.cpu_count():
-            self.taskpile.max_parallel = value
+            self._max_parallel = value
+            if self.taskpile.controller is None:
+                self.taskpile.max_parallel = value
+            else:
+                self.taskpile.controller.max_parallel = value
             self._max_jobs_attr_map.set_attr_map({'failure': None})
+            urwid.emit_signal(self, 'change')
         else:
             self._max_jobs_attr_map.set_attr_map({None: 'failure'})
 
+    def _on_adapt_changed(self, w, state):
+        if state:
+            self.taskpile.controller = LoadController(
+                max_parallel=self._max_parallel)
+        else:
+            self.taskpile.controller = None
+            self.taskpile.max_parallel = self._max_parallel
+        self.update()
+        urwid.emit_signal(self, 'change')
+
+    def _on_start_gap_changed(self, w, value):
+        if value != '':
+            self.taskpile.min_start_interval = int(value) / 1000.
+            self._start_gap_attr_map.set_attr_map({'failure': None})
+            urwid.emit_signal(self, 'change')
+        else:
+            self._start_gap_attr_map.set_attr_map({None: 'failure'})
+
+    def _on_policy_changed(self, btn, state, policy):
+        if state and not isinstance(self.taskpile.pending, policy):
+            self.taskpile.set_policy(policy())
+            urwid.emit_signal(self, 'change')
+
 
 class MainWindow(urwid.WidgetPlaceholder):
-    def __init__(self):
-        self.taskpile = Taskpile()
+    def __init__(self, journal=None):
+        self.taskpile = Taskpile(policy=PriorityPolicy())
+        self.taskpile.listeners.append(SourceErrorReporter())
+        self.journal = journal
+        if self.journal is not None:
+            self.journal.restore(self.taskpile)
+        self.taskpile.set_archive(TaskArchive())
         self.tasklist = TaskList(self.taskpile)
 
         left = urwid.LineBox(urwid.Pile(
             [('pack', TaskView.create_header()), self.tasklist]))
-        right = Sidebar(self.taskpile)
+        self.sidebar = Sidebar(self.taskpile)
+        right = self.sidebar
         super(MainWindow, self).__init__(urwid.Columns([left, (22, right)], 1))
 
     def keypress(self, size, key):
@@ -737,16 +1460,18 @@ class MainWindow(urwid.WidgetPlaceholder):
 
     def _clean_files_of_finished_processes(self):
         for task in self.taskpile.finished:
-            for filename in task.original_files:
+            for filename in load_details(task).original_files:
                 if os.path.isfile(filename):
                     os.unlink(filename)
 
     def on_quit_requested(self):
         def terminate_all_and_quit():
-            for task in self.taskpile.pending + self.taskpile.running:
-                task.terminate()
-                task.join()
+            report = self.taskpile.shutdown()
             self._clean_files_of_finished_processes()
+            template_cache.close()
+            if self.journal is not None:
+                # Keep the journal if some task could not be reaped.
+                self.journal.close(remove='unreaped' not in report.values())
             raise urwid.ExitMainLoop()
 
         confirm_diag = Dialog(urwid.Filler(urwid.Padding(urwid.Text(
@@ -755,7 +1480,7 @@ class MainWindow(urwid.WidgetPlaceholder):
             'Yes', 'No')
         urwid.connect_signal(confirm_diag, 'ok', terminate_all_and_quit)
         processes_unfinished = len(self.taskpile.pending) > 0 or \
-            len(self.taskpile.running) > 0
+            len(self.taskpile.running) > 0 or len(self.taskpile.sources) > 0
         if processes_unfinished:
             confirm_diag.show()
         else:
@@ -763,15 +1488,281 @@ class MainWindow(urwid.WidgetPlaceholder):
 
     def update(self):
         self.tasklist.update()
+        self.sidebar.update()
+
+
+class UpdateScheduler(TaskpileListener):
+    """Updates `target` (e.g. the :class:`MainWindow`) and with it its
+    taskpile in the urwid main `loop` whenever something changed.
+
+    Call :meth:`request` when the state of the taskpile changed. Requests
+    are coalesced: however many arrive until the loop gets to handle them,
+    `target` is updated once. Task transitions and added tasks or sources
+    request an update by themselves. Besides that, the loop only wakes up
+    when the taskpile needs a time-based update (see
+    :meth:`taskpile.core.Taskpile.seconds_until_update`) and stays idle
+    otherwise.
+    """
+
+    min_delay = 0.01
+
+    def __init__(self, loop, target):
+        self.loop = loop
+        self.target = target
+        self._requested = False
+        self._updating = False
+        self._alarm = None
+        self._write_fd = loop.watch_pipe(self._on_wakeup)
+        target.taskpile.listeners.append(self)
+
+    def request(self, *args):
+        """Requests an update. May be called from other threads."""
+        if not self._requested and not self._updating:
+            self._requested = True
+            os.write(self._write_fd, b'\0')
+
+    def _on_wakeup(self, data):
+        if self._requested:
+            self._requested = False
+            self.update()
+        return True
+
+    def _on_alarm(self, loop, user_data):
+        self._alarm = None
+        self.update()
 
+    def update(self):
+        """Updates `target` right away and schedules the next time-based
+        update."""
+        if self._alarm is not None:
+            self.loop.remove_alarm(self._alarm)
+            self._alarm = None
+        self._updating = True
+        try:
+            self.target.update()
+        finally:
+            self._updating = False
+        delay = self.target.taskpile.seconds_until_update()
+        if delay is not None:
+            self._alarm = self.loop.set_alarm_in(
+                max(self.min_delay, delay), self._on_alarm)
+
+    def on_enqueued(self, task):
+        self.request()
+
+    def on_started(self, task):
+        self.request()
+
+    def on_stopped(self, task):
+        self.request()
+
+    def on_continued(self, task):
+        self.request()
+
+    def on_finished(self, task):
+        self.request()
+
+    def on_terminated(self, task):
+        self.request()
+
+    def on_source_added(self, source):
+        self.request()
+
+    def close(self):
+        if self._alarm is not None:
+            self.loop.remove_alarm(self._alarm)
+            self._alarm = None
+        self.target.taskpile.listeners.remove(self)
+        self.loop.remove_watch_pipe(self._write_fd)
+
+
+remote_states = dict((name, state) for state, name in state_names.items())
+
+
+class RemoteTask(object):
+    """Task of a taskpile daemon as listed by
+    :meth:`taskpile.client.Client.list`. Provides the attributes shown by
+    :class:`TaskView`."""
+
+    rusage = None
+    usage = None
 
-def invoke_update(loop, args):
-    interval, act_on = args
-    act_on.update()
-    loop.set_alarm_in(interval, invoke_update, (interval, act_on))
+    def __init__(self, listing):
+        self.id = listing['id']
+        self.name = listing['name']
+        self.state = remote_states[listing['state']]
+        self.pid = listing['pid']
+        self.exitcode = listing['exitcode']
+        self.exitsignal = listing['exitsignal']
+        self.outbuf_name = listing.get('outbuf_name')
+        self.errbuf_name = listing.get('errbuf_name')
 
 
-def main():
+class AttachedWindow(urwid.WidgetPlaceholder):
+    """Shows the tasks of a taskpile daemon (see :mod:`taskpile.daemon`)
+    listed with `client` every `refresh_interval` seconds.
+
+    Tasks can be killed and their output can be shown. Quitting detaches
+    from the daemon, which keeps running the tasks. If the connection gets
+    lost, the main loop exits with the reason in `error`.
+    """
+
+    refresh_interval = 1.
+
+    def __init__(self, client):
+        self.client = client
+        self.error = None
+        self._views = {}
+        self._walker = urwid.SimpleFocusListWalker([])
+        self._status = urwid.Text('')
+
+        left = urwid.LineBox(urwid.Pile([
+            ('pack', TaskView.create_header()),
+            urwid.ListBox(self._walker)]))
+        right = urwid.Pile([
+            ('pack', urwid.Divider()),
+            ('pack', urwid.Text(('title', 'Attached to daemon'))),
+            ('pack', urwid.Divider()),
+            ('pack', self._status),
+            urwid.SolidFill(' '),
+            ('pack', urwid.Text("""
+Keys:
+k: Kill selected task
+q: Detach
+""".strip())),
+            ('pack', urwid.Divider())
+        ])
+        super(AttachedWindow, self).__init__(
+            urwid.Columns([left, (22, right)], 1))
+
+    def keypress(self, size, key):
+        key = super(AttachedWindow, self).keypress(size, key)
+        focus_widget, _ = self._walker.get_focus()
+        if key == 'enter' and focus_widget is not None and \
+                focus_widget.task.outbuf_name is not None:
+            IOView(
+                "Output of task '%s' (%i)" %
+                (focus_widget.task.name, focus_widget.task.pid),
+                focus_widget.task.outbuf_name,
+                focus_widget.task.errbuf_name).show()
+            key = None
+        elif key == 'q':
+            raise urwid.ExitMainLoop()
+        return key
+
+    def terminate(self, task):
+        """Kills `task` (called by :class:`TaskView`)."""
+        self._request(self.client.kill, [task.id])
+        self.update()
+
+    def refresh(self, loop, user_data=None):
+        self.update()
+        loop.set_alarm_in(self.refresh_interval, self.refresh)
+
+    def update(self):
+        tasks = [RemoteTask(listing)
+                 for listing in self._request(self.client.list)]
+        unfinished = [t for t in tasks if t.state != State.FINISHED]
+        finished = [t for t in tasks if t.state == State.FINISHED]
+        views = {}
+        for task in unfinished + finished[::-1]:
+            view = self._views.get(task.id)
+            if view is None:
+                view = TaskView(task, self)
+            else:
+                view.task = task
+                view.update()
+            views[task.id] = view
+        focus_widget, _ = self._walker.get_focus()
+        self._views = views
+        self._walker[:] = [views[t.id] for t in unfinished + finished[::-1]]
+        if focus_widget is not None and focus_widget.task.id in views:
+            self._walker.set_focus(
+                self._walker.index(views[focus_widget.task.id]))
+
+        num_running = sum(1 for t in unfinished if t.state == State.RUNNING)
+        self._status.set_text(
+            'Finished: {}/{}\nRunning: {}\nPending: {}'.format(
+                len(finished), len(tasks), num_running,
+                len(unfinished) - num_running))
+
+    def _request(self, method, *args):
+        try:
+            return method(*args)
+        except (socket.error, RemoteError) as err:
+            self.error = 'Lost connection to taskpile: {0}'.format(err)
+            raise urwid.ExitMainLoop()
+
+
+def attach(client, palette):
+    """Runs the UI as client of a taskpile daemon connected to with
+    `client`."""
+    window = AttachedWindow(client)
+    loop = urwid.MainLoop(window, palette)
+    ModalWidget.mainloop = loop
+    loop.set_alarm_in(0, window.refresh)
+    try:
+        loop.run()
+    finally:
+        client.close()
+    if window.error is not None:
+        sys.exit(window.error)
+
+
+def default_journal_filename():
+    return os.path.join(os.path.expanduser('~'), '.taskpile', 'journal')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Simple single-user job queue management system.')
+    parser.add_argument(
+        '--journal', default=default_journal_filename(),
+        help='File recording the tasks to resume them if taskpile gets '
+        'killed (default: %(default)s).')
+    parser.add_argument(
+        '--no-journal', action='store_true',
+        help='Do not record the tasks.')
+    parser.add_argument(
+        '--socket', default=default_socket_path(),
+        help='Socket to accept tasks from taskpilectl at '
+        '(default: %(default)s).')
+    parser.add_argument(
+        '--no-socket', action='store_true',
+        help='Do not accept tasks from taskpilectl.')
+    parser.add_argument(
+        '--attach', action='store_true',
+        help='Show the tasks of the taskpile daemon listening at the socket '
+        'instead of running tasks. Done by default if the journal is used '
+        'by the daemon.')
+    parser.add_argument(
+        '--tmpfs-templates', action='store_true',
+        help='Render template files to /dev/shm instead of the temporary '
+        'directory.')
+    parser.add_argument(
+        '--memory-budget',
+        help='Memory the running tasks may reserve in total, e.g. 64G, or '
+        '"available" to start tasks only while their memory is available.')
+    parser.add_argument(
+        '--pin-cpus', action='store_true',
+        help='Give each running task dedicated CPU cores, taking the NUMA '
+        'nodes into account.')
+    parser.add_argument(
+        '--sample-interval', type=float, default=5.,
+        help='Seconds between measurements of the CPU, memory and I/O usage '
+        'of running tasks, 0 to disable (default: %(default)s).')
+    parser.add_argument(
+        '--max-output',
+        help='Output to keep per task and stream, e.g. 100M. The beginning '
+        'and the end of longer outputs are kept.')
+    parser.add_argument(
+        '--compress-output', action='store_true',
+        help='Compress the output of finished tasks, which is done by '
+        'default with --max-output. Compressed output has to be '
+        'decompressed as a whole to view it.')
+    args = parser.parse_args(argv)
+    template_cache.use_tmpfs = args.tmpfs_templates
+
     palette = [
         ('focus', 'standout', ''),
         ('tbl_header', 'bold', ''),
@@ -780,11 +1771,79 @@ def main():
         ('warning', 'brown', ''),
         ('failure', 'dark red', '')
     ]
-    m = MainWindow()
+
+    if args.attach:
+        try:
+            client = Client(args.socket)
+        except socket.error as err:
+            sys.exit('Cannot connect to taskpile at {0}: {1}'.format(
+                args.socket, err))
+        attach(client, palette)
+        return
+
+    journal = None
+    if not args.no_journal:
+        journal_dir = os.path.dirname(os.path.abspath(args.journal))
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir)
+        try:
+            journal = Journal(args.journal)
+        except JournalLockedError as err:
+            # Most likely the daemon is running. Become its client.
+            try:
+                client = Client(args.socket)
+            except socket.error:
+                sys.exit(
+                    '{0} Use --journal to choose another one.'.format(err))
+            attach(client, palette)
+            return
+    m = MainWindow(journal)
+    if args.memory_budget is not None:
+        m.taskpile.memory_budget = parse_memory_budget(args.memory_budget)
+    if args.pin_cpus:
+        m.taskpile.placement_engine = PlacementEngine()
+    if args.sample_interval > 0:
+        ResourceSampler(m.taskpile, args.sample_interval)
+    max_output = None
+    if args.max_output is not None:
+        max_output = parse_size(args.max_output)
+    output_capture = OutputCapture(
+        m.taskpile, max_output,
+        compress_finished=args.compress_output or max_output is not None)
     loop = urwid.MainLoop(m, palette)
     ModalWidget.mainloop = loop
-    invoke_update(loop, (1, m))
-    loop.run()
+
+    scheduler = UpdateScheduler(loop, m)
+    urwid.connect_signal(m.sidebar, 'change', scheduler.request)
+    child_watcher = ChildWatcher()
+
+    def on_child_exit():
+        child_watcher.clear()
+        scheduler.request()
+
+    loop.watch_file(child_watcher.fileno(), on_child_exit)
+
+    server = None
+    if not args.no_socket:
+        socket_path = os.path.abspath(args.socket)
+        if not os.path.isdir(os.path.dirname(socket_path)):
+            os.makedirs(os.path.dirname(socket_path))
+        try:
+            server = TaskpileServer(
+                m.taskpile, socket_path, loop, on_change=scheduler.request)
+        except ServerError as err:
+            sys.exit('{0} Use --socket to choose another one.'.format(err))
+
+    scheduler.update()
+    try:
+        loop.run()
+    finally:
+        scheduler.close()
+        child_watcher.close()
+        m.taskpile.archive.close()
+        if server is not None:
+            server.close()
+        output_capture.close()
 
 
 if __name__ == '__main__':